@@ -0,0 +1,74 @@
+"""
+Synthetic file trees shared by all benchmarks.
+The trees are created once per session with create_file_tree and must not be modified by benchmarks.
+"""
+from pathlib import Path
+from typing import Dict, Iterator
+
+from pytest import fixture
+
+from tjpy_file_util.code_file_trees import DictFileHierarchy, create_file_tree
+from tjpy_file_util.temporary import create_temp_directory
+
+SMALL_FILE_SIZE = 1024
+HUGE_FILE_SIZE = 64 * 1024 * 1024
+
+
+def _many_small_files() -> DictFileHierarchy:
+    return {f"dir_{directory}": {f"file_{file}.txt": None for file in range(100)} for directory in range(20)}
+
+
+def _few_huge_files() -> DictFileHierarchy:
+    return {f"huge_{file}.bin": None for file in range(4)}
+
+
+def _deep() -> DictFileHierarchy:
+    hierarchy: DictFileHierarchy = {"file.txt": None}
+    for depth in range(100):
+        hierarchy = {f"level_{depth}": hierarchy, f"file_{depth}.txt": None}
+    return hierarchy
+
+
+def _wide() -> DictFileHierarchy:
+    return {f"file_{file}.txt": None for file in range(5000)}
+
+
+TREE_SHAPES = {
+    "many_small_files": (_many_small_files, SMALL_FILE_SIZE),
+    "few_huge_files": (_few_huge_files, HUGE_FILE_SIZE),
+    "deep": (_deep, SMALL_FILE_SIZE),
+    "wide": (_wide, 0),
+}
+
+
+def _fill_files(directory: Path, size: int):
+    if size == 0:
+        return
+    content = b"x" * size
+    for path in directory.rglob("*"):
+        if path.is_file():
+            path.write_bytes(content)
+
+
+@fixture(scope="session")
+def trees() -> Iterator[Dict[str, Path]]:
+    with create_temp_directory("benchmark_trees") as base_dir:
+        shape_directories = dict()
+        for name, (hierarchy_function, file_size) in TREE_SHAPES.items():
+            shape_directory = base_dir.joinpath(name)
+            shape_directory.mkdir()
+            create_file_tree(shape_directory, hierarchy_function())
+            _fill_files(shape_directory, file_size)
+            shape_directories[name] = shape_directory
+        yield shape_directories
+
+
+@fixture(params=list(TREE_SHAPES))
+def tree(request, trees: Dict[str, Path]) -> Path:
+    return trees[request.param]
+
+
+@fixture
+def target_base_dir() -> Iterator[Path]:
+    with create_temp_directory("benchmark_targets") as base_dir:
+        yield base_dir
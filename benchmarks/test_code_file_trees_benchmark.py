@@ -0,0 +1,16 @@
+import os
+from pathlib import Path
+
+from tjpy_file_util.code_file_trees import read_children_as_file_tree
+
+
+def test_read_children_as_file_tree(benchmark, tree: Path):
+    benchmark(read_children_as_file_tree, tree)
+
+
+def test_os_walk_baseline(benchmark, tree: Path):
+    def walk():
+        return [(directory_path, directory_names, file_names)
+                for directory_path, directory_names, file_names in os.walk(str(tree))]
+
+    benchmark(walk)
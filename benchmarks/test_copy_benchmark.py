@@ -0,0 +1,32 @@
+import itertools
+import shutil
+from pathlib import Path
+
+from tjpy_file_util.copy import copy_children
+from tjpy_file_util.remove import remove_tree
+
+
+def _target_directories(base_dir: Path):
+    """Setup for benchmark.pedantic providing a new target per round and removing the one of the previous round"""
+    counter = itertools.count()
+
+    def setup():
+        for previous_target in list(base_dir.iterdir()):
+            remove_tree(previous_target)
+        return (base_dir.joinpath(f"target_{next(counter)}"),), dict()
+    return setup
+
+
+def test_copy_children(benchmark, tree: Path, target_base_dir: Path):
+    def copy_to_new_directory(target: Path):
+        target.mkdir()
+        copy_children(tree, target)
+
+    benchmark.pedantic(copy_to_new_directory, setup=_target_directories(target_base_dir), rounds=5)
+
+
+def test_shutil_copytree_baseline(benchmark, tree: Path, target_base_dir: Path):
+    def copytree(target: Path):
+        shutil.copytree(str(tree), str(target))
+
+    benchmark.pedantic(copytree, setup=_target_directories(target_base_dir), rounds=5)
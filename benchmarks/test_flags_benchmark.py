@@ -0,0 +1,52 @@
+import os
+import stat
+from pathlib import Path
+from typing import Iterator, List
+
+from pytest import fixture
+
+from tjpy_file_util.flags import make_file_executable_if_necessary
+from tjpy_file_util.temporary import create_temp_directory
+
+
+@fixture
+def files() -> Iterator[List[Path]]:
+    with create_temp_directory("benchmark_flags") as base_dir:
+        file_list = [base_dir.joinpath(f"file_{index}.sh") for index in range(1000)]
+        for file in file_list:
+            file.touch()
+        yield file_list
+
+
+def _make_not_executable(file_list: List[Path]):
+    def setup():
+        for file in file_list:
+            file.chmod(0o644)
+    return setup
+
+
+def test_make_file_executable_if_necessary(benchmark, files: List[Path]):
+    def make_executable():
+        for file in files:
+            make_file_executable_if_necessary(file)
+
+    benchmark.pedantic(make_executable, setup=_make_not_executable(files), rounds=10)
+
+
+def test_make_file_executable_if_necessary__already_executable(benchmark, files: List[Path]):
+    for file in files:
+        file.chmod(0o755)
+
+    def make_executable():
+        for file in files:
+            make_file_executable_if_necessary(file)
+
+    benchmark(make_executable)
+
+
+def test_os_chmod_baseline(benchmark, files: List[Path]):
+    def make_executable():
+        for file in files:
+            os.chmod(str(file), stat.S_IMODE(os.stat(str(file)).st_mode) | stat.S_IEXEC)
+
+    benchmark.pedantic(make_executable, setup=_make_not_executable(files), rounds=10)
@@ -0,0 +1,24 @@
+import shutil
+import tempfile
+from pathlib import Path
+
+from tjpy_file_util.temporary import create_temp_directory_for
+
+
+def test_create_temp_directory_for(benchmark, tree: Path):
+    def create_and_cleanup():
+        with create_temp_directory_for(tree):
+            pass
+
+    benchmark.pedantic(create_and_cleanup, rounds=5)
+
+
+def test_mkdtemp_copytree_baseline(benchmark, tree: Path):
+    def create_and_cleanup():
+        temp_directory = tempfile.mkdtemp()
+        try:
+            shutil.copytree(str(tree), str(Path(temp_directory, tree.name)))
+        finally:
+            shutil.rmtree(temp_directory)
+
+    benchmark.pedantic(create_and_cleanup, rounds=5)
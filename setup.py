@@ -21,6 +21,7 @@ development_requirements = [
     'pytest-runner>=4.2',
     'pytest-mock>=1.10.1',
     'pytest-cov>=2.7.1',
+    'pytest-benchmark>=3.2.2',
 ]
 
 setup(
@@ -36,9 +37,15 @@ setup(
         'Programming Language :: Python :: 3.7',
     ],
     description="Utilities related to files",
+    entry_points={
+        'console_scripts': [
+            'tjpy-file-util=tjpy_file_util.cli:main',
+        ],
+    },
     install_requires=runtime_requirements,
     extras_require={
-        'dev': development_requirements
+        'dev': development_requirements,
+        'zstd': ['zstandard>=0.11.0'],
     },
     license="MIT license",
     long_description=readme + '\n\n' + history,
@@ -0,0 +1,110 @@
+import os
+import re
+import subprocess
+import sys
+from pathlib import Path
+
+from pytest import fixture, raises
+
+import tjpy_file_util.cli as mut
+from tjpy_file_util.code_file_trees import create_file_tree, read_children_as_file_tree
+from tjpy_file_util.temporary import create_temp_directory
+
+
+@fixture
+def base_dir():
+    with create_temp_directory("base_dir") as base_dir:
+        yield base_dir
+
+
+@fixture
+def source_dir(base_dir: Path) -> Path:
+    source_dir = base_dir.joinpath("source")
+    source_dir.mkdir()
+    create_file_tree(source_dir, {"dir": {"a.py": None, "b.txt": None}, "c.py": None})
+    source_dir.joinpath("c.py").write_text("content")
+    return source_dir
+
+
+def test_copy(base_dir: Path, source_dir: Path):
+    assert mut.main(["copy", str(source_dir), str(base_dir / "target"), "-j", "2"]) == 0
+    assert read_children_as_file_tree(base_dir / "target") == read_children_as_file_tree(source_dir)
+
+    assert mut.main(["copy", str(source_dir), str(base_dir / "target")]) == 1
+    assert mut.main(["copy", str(source_dir), str(base_dir / "target"), "--overwrite", "files"]) == 0
+
+
+def test_copy_with_compression_and_stats(base_dir: Path, source_dir: Path, capsys):
+    assert mut.main(["copy", str(source_dir), str(base_dir / "target"), "--compress", "gzip", "--stats"]) == 0
+    assert base_dir.joinpath("target", "dir", "a.py.gz").is_file()
+    err = capsys.readouterr().err
+    assert "MiB/s" in err
+    # the copied bytes are counted during the copy, the source is not scanned again
+    assert re.search(r"list:\s+2 calls", err)
+
+
+def test_copy_with_stats_counts_the_copied_bytes(base_dir: Path, source_dir: Path, capsys):
+    source_dir.joinpath("big.bin").write_bytes(b"x" * 2 ** 20)
+
+    assert mut.main(["copy", str(source_dir), str(base_dir / "target"), "--stats"]) == 0
+
+    assert re.search(r"copied 1\.0 MiB in ", capsys.readouterr().err)
+
+
+def test_copy_with_corrupt_compressed_input(base_dir: Path, capsys):
+    source = base_dir.joinpath("source")
+    source.mkdir()
+    for codec, suffix in (("gzip", ".gz"), ("lzma", ".xz"), ("bz2", ".bz2")):
+        source.joinpath("file" + suffix).write_bytes(os.urandom(1000))
+        target = base_dir.joinpath(f"target_{codec}")
+        target.mkdir()
+
+        assert mut.main(["copy", "--children", "--decompress", codec, str(source), str(target)]) == 1
+
+        error_lines = capsys.readouterr().err.splitlines()
+        assert len(error_lines) == 1
+        assert error_lines[0].startswith("tjpy-file-util copy: ") and "can not be decompressed" in error_lines[0]
+        assert list(target.iterdir()) == []
+        source.joinpath("file" + suffix).unlink()
+
+
+def test_workers_must_be_positive(source_dir: Path, capsys):
+    for workers in ("0", "-2", "x"):
+        with raises(SystemExit):
+            mut.main(["tree", str(source_dir), "-j", workers])
+        assert "-j/--workers" in capsys.readouterr().err
+
+
+def test_tree(source_dir: Path, capsys):
+    assert mut.main(["tree", str(source_dir)]) == 0
+    assert capsys.readouterr().out.splitlines() == ["c.py", "dir", "dir/a.py", "dir/b.txt"]
+
+    assert mut.main(["tree", str(source_dir), "--glob", "**/*.py"]) == 0
+    assert capsys.readouterr().out.splitlines() == ["c.py", "dir/a.py"]
+
+
+def test_diff(base_dir: Path, source_dir: Path, capsys):
+    other_dir = base_dir.joinpath("other")
+    other_dir.mkdir()
+    create_file_tree(other_dir, {"dir": {"a.py": None, "new.txt": None}, "c.py": None})
+
+    assert mut.main(["diff", str(source_dir), str(other_dir), "--content"]) == 1
+    assert capsys.readouterr().out.splitlines() == ["M c.py", "- dir/b.txt", "+ dir/new.txt"]
+
+    assert mut.main(["diff", str(source_dir), str(other_dir), "--glob", "**/*.py"]) == 0
+
+
+def test_rm(base_dir: Path, source_dir: Path):
+    assert mut.main(["rm", str(source_dir / "dir"), str(source_dir / "c.py")]) == 0
+    assert list(source_dir.iterdir()) == []
+    assert mut.main(["rm", str(source_dir / "missing")]) == 1
+    assert mut.main(["rm", "-f", str(source_dir / "missing")]) == 0
+
+
+def test_startup_only_imports_the_needed_modules():
+    output = subprocess.run(
+        [sys.executable, "-c",
+         "import sys, tjpy_file_util.cli as cli; cli._create_parser(); "
+         "print(sorted(name for name in sys.modules if name.startswith('tjpy_file_util')))"],
+        stdout=subprocess.PIPE, check=True, universal_newlines=True).stdout
+    assert output.strip() == "['tjpy_file_util', 'tjpy_file_util.cli']"
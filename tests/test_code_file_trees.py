@@ -1,7 +1,12 @@
-from pytest import fixture
+import os
+from pathlib import PurePosixPath
+from typing import Any
+
+from pytest import fixture, raises
 
 import tjpy_file_util.code_file_trees as mut
 from tjpy_file_util.code_file_trees import read_children_as_file_tree
+from tjpy_file_util.io_scheduler import IoScheduler
 from tjpy_file_util.temporary import create_temp_directory
 
 
@@ -63,3 +68,247 @@ class TestCreateFileTreeAndReadChildrenAsFileTree:
         assert base_dir.joinpath("sub_dir").joinpath("sub_dir").joinpath("some_file.txt").is_file()
         assert base_dir.joinpath("sub_dir").joinpath("sub_dir").joinpath("some_file2.txt").is_file()
         assert file_tree == read_children_as_file_tree(base_dir)
+
+
+class TestScanFileTree:
+
+    def _create_tree(self, base_dir):
+        mut.create_file_tree(base_dir, {
+            "a.bin": None,
+            "sub_dir": {
+                "b.bin": None,
+                "sub_sub_dir": ["c.bin"],
+            },
+            "empty_dir": [],
+        })
+        base_dir.joinpath("a.bin").write_bytes(b"a" * 100)
+        base_dir.joinpath("sub_dir", "b.bin").write_bytes(b"b" * 300)
+        base_dir.joinpath("sub_dir", "sub_sub_dir", "c.bin").write_bytes(b"c" * 200)
+
+    def test_statistics(self, base_dir):
+        self._create_tree(base_dir)
+
+        scan = mut.scan_file_tree(base_dir, largest_files_count=2)
+
+        assert scan.hierarchy == read_children_as_file_tree(base_dir)
+        root = scan.statistics[PurePosixPath(".")]
+        assert root.file_count == 3
+        assert root.directory_count == 3
+        assert root.apparent_size == 600
+        assert root.newest_mtime == max(path.stat().st_mtime for path in base_dir.rglob("*.bin"))
+        assert root.largest_files == [(300, PurePosixPath("sub_dir/b.bin")),
+                                      (200, PurePosixPath("sub_dir/sub_sub_dir/c.bin"))]
+        sub_dir = scan.statistics[PurePosixPath("sub_dir")]
+        assert sub_dir.file_count == 2
+        assert sub_dir.apparent_size == 500
+        assert scan.statistics[PurePosixPath("empty_dir")].newest_mtime is None
+
+    def test_parallel_scan_matches_sequential_scan(self, base_dir):
+        self._create_tree(base_dir)
+
+        sequential = mut.scan_file_tree(base_dir)
+        parallel = mut.scan_file_tree(base_dir, max_workers=4)
+
+        assert parallel.hierarchy == sequential.hierarchy
+        assert {path: repr(statistics) for path, statistics in parallel.statistics.items()} == \
+            {path: repr(statistics) for path, statistics in sequential.statistics.items()}
+
+    def test_scan_with_scheduler_matches_sequential_scan(self, base_dir):
+        self._create_tree(base_dir)
+
+        sequential = mut.scan_file_tree(base_dir)
+        scheduled = mut.scan_file_tree(base_dir, scheduler=IoScheduler(4))
+
+        assert scheduled.hierarchy == sequential.hierarchy
+        assert {path: repr(statistics) for path, statistics in scheduled.statistics.items()} == \
+            {path: repr(statistics) for path, statistics in sequential.statistics.items()}
+
+    def test_symlinks_are_not_followed(self, base_dir):
+        self._create_tree(base_dir)
+        os.symlink(str(base_dir.joinpath("a.bin")), str(base_dir.joinpath("a_link.bin")))
+        os.symlink(str(base_dir), str(base_dir.joinpath("sub_dir", "cycle")))
+
+        for max_workers in (1, 4):
+            scan = mut.scan_file_tree(base_dir, max_workers=max_workers)
+
+            assert "a_link.bin" not in scan.hierarchy
+            sub_dir: Any = scan.hierarchy["sub_dir"]
+            assert "cycle" not in sub_dir
+            assert scan.statistics[PurePosixPath(".")].apparent_size == 600
+
+    def test_hardlinks_are_counted_once(self, base_dir):
+        self._create_tree(base_dir)
+        os.link(str(base_dir.joinpath("a.bin")), str(base_dir.joinpath("sub_dir", "a_link.bin")))
+
+        root = mut.scan_file_tree(base_dir).statistics[PurePosixPath(".")]
+
+        assert root.file_count == 4
+        assert root.apparent_size == 600
+
+
+class TestLiveFileTree:
+
+    def test_initial_hierarchy(self, base_dir):
+        file_tree = mut.create_file_tree(base_dir, {"sub_dir": ["some_file.txt"]})
+        with mut.LiveFileTree(base_dir) as live_tree:
+            assert live_tree.snapshot() == file_tree
+
+    def test_applies_created_and_deleted_items(self, base_dir):
+        mut.create_file_tree(base_dir, {"sub_dir": ["some_file.txt"]})
+        with mut.LiveFileTree(base_dir) as live_tree:
+            base_dir.joinpath("new_dir", "nested").mkdir(parents=True)
+            base_dir.joinpath("new_dir", "nested", "new_file.txt").touch()
+            base_dir.joinpath("sub_dir", "some_file.txt").unlink()
+
+            changes = live_tree.process_events(timeout=1)
+            while True:
+                more_changes = live_tree.process_events(timeout=0.05)
+                if not more_changes:
+                    break
+                changes += more_changes
+
+            assert live_tree.snapshot() == read_children_as_file_tree(base_dir)
+            assert mut.FileTreeChange(mut.FileTreeChangeType.deleted, PurePosixPath("sub_dir/some_file.txt"),
+                                      mut.FilesystemItemType.file) in changes
+            assert mut.FileTreeChange(mut.FileTreeChangeType.created, PurePosixPath("new_dir"),
+                                      mut.FilesystemItemType.directory) in changes
+
+    def test_moving_directory_out_of_tree(self, base_dir):
+        with create_temp_directory("outside") as outside_dir:
+            mut.create_file_tree(base_dir, {"sub_dir": ["some_file.txt"]})
+            with mut.LiveFileTree(base_dir) as live_tree:
+                base_dir.joinpath("sub_dir").rename(outside_dir.joinpath("sub_dir"))
+                live_tree.process_events(timeout=1)
+                outside_dir.joinpath("sub_dir", "ignored.txt").touch()
+                live_tree.process_events(timeout=0.05)
+
+                assert live_tree.snapshot() == {}
+
+    def test_moving_the_root_invalidates_the_tree(self, base_dir):
+        root = base_dir.joinpath("root")
+        root.mkdir()
+        mut.create_file_tree(root, {"sub_dir": ["some_file.txt"]})
+        with mut.LiveFileTree(root) as live_tree:
+            root.rename(base_dir.joinpath("moved"))
+            changes = live_tree.process_events(timeout=1)
+
+            assert not live_tree.valid
+            assert live_tree.snapshot() == {}
+            assert changes == [mut.FileTreeChange(mut.FileTreeChangeType.deleted, PurePosixPath("sub_dir"),
+                                                  mut.FilesystemItemType.directory)]
+
+    def test_fd_is_closed_if_initial_scan_fails(self, base_dir, monkeypatch):
+        def failing_rescan(*args, **kwargs):
+            raise OSError("scan failed")
+
+        monkeypatch.setattr(mut.LiveFileTree, "_rescan", failing_rescan)
+        open_fds = set(os.listdir("/proc/self/fd"))
+        with raises(OSError):
+            mut.LiveFileTree(base_dir)
+        assert set(os.listdir("/proc/self/fd")) == open_fds
+
+    def test_symlinks_are_not_followed(self, base_dir):
+        base_dir.joinpath("real").mkdir()
+        base_dir.joinpath("link").symlink_to("real")
+        base_dir.joinpath("loop").symlink_to(".")
+        with mut.LiveFileTree(base_dir) as live_tree:
+            base_dir.joinpath("real", "new.txt").touch()
+            base_dir.joinpath("file_link.txt").symlink_to("real/new.txt")
+            live_tree.process_events(timeout=1)
+            live_tree.process_events(timeout=0.05)
+
+            assert live_tree.snapshot() == {"real": {"new.txt": mut.FilesystemItemType.file}}
+
+    def test_changes_are_only_fed_if_requested(self, base_dir):
+        with mut.LiveFileTree(base_dir) as live_tree:
+            base_dir.joinpath("some_file.txt").touch()
+            assert live_tree.process_events(timeout=1)
+            assert live_tree.changes is None
+
+    def test_background_thread_feeds_changes(self, base_dir):
+        with mut.LiveFileTree(base_dir, feed_changes=True) as live_tree:
+            live_tree.start()
+            base_dir.joinpath("some_file.txt").write_text("content")
+
+            assert live_tree.changes is not None
+            created = live_tree.changes.get(timeout=1)
+            modified = live_tree.changes.get(timeout=1)
+
+            assert created == mut.FileTreeChange(mut.FileTreeChangeType.created, PurePosixPath("some_file.txt"),
+                                                 mut.FilesystemItemType.file)
+            assert modified.change_type == mut.FileTreeChangeType.modified
+
+
+class TestUnify:
+
+    def test_mixed_styles(self):
+        items: list = [
+            "a.txt",
+            ("b", ["c.txt", ("d", mut.FilesystemItemType.directory)]),
+            ("e", {"f.txt": None}),
+        ]
+        assert mut.unify(items) == {
+            "a.txt": mut.FilesystemItemType.file,
+            "b": {"c.txt": mut.FilesystemItemType.file, "d": {}},
+            "e": {"f.txt": mut.FilesystemItemType.file},
+        }
+
+    def test_deep_hierarchy(self):
+        hierarchy: dict = {}
+        node = hierarchy
+        for _ in range(5000):
+            node["d"] = {}
+            node = node["d"]
+        node["f"] = None
+
+        result: Any = mut.unify(hierarchy)
+
+        for _ in range(5000):
+            result = result["d"]
+        assert result == {"f": mut.FilesystemItemType.file}
+
+    def test_all_errors_are_reported_with_path(self):
+        with raises(mut.FileHierarchyException) as exception_info:
+            mut.unify({
+                "a": ["x", ("x", {"y": None})],
+                "b": {"c": "invalid"},
+                "d": [42],
+            })
+        assert exception_info.value.errors == [
+            "duplicate items found with name 'a/x'",
+            "invalid value for item 'b/c': 'invalid'",
+            "invalid item in 'd': '42'",
+        ]
+
+    def test_copies_by_default(self):
+        strict_subtree = {"f": mut.FilesystemItemType.file}
+        hierarchy: dict = {"strict": strict_subtree, "loose": {"g": None}}
+
+        result = mut.unify(hierarchy)
+
+        assert result["strict"] == strict_subtree
+        assert result["strict"] is not strict_subtree
+        assert hierarchy["loose"] == {"g": None}
+
+    def test_share_strict_subtrees(self):
+        strict_subtree = {"f": mut.FilesystemItemType.file}
+        loose_subtree = {"a": mut.FilesystemItemType.file, "g": None}
+        hierarchy: dict = {"strict": strict_subtree, "loose": loose_subtree}
+
+        result: dict = mut.unify(hierarchy, share_strict_subtrees=True)
+
+        assert result["strict"] is strict_subtree
+        assert result["loose"] == {"a": mut.FilesystemItemType.file, "g": mut.FilesystemItemType.file}
+        assert loose_subtree["g"] is None
+        assert result is not hierarchy
+        assert mut.unify(result, share_strict_subtrees=True) is result
+
+    def test_in_place(self):
+        loose_subtree: dict = {"g": None, "h": ["i"]}
+        hierarchy: dict = {"loose": loose_subtree}
+
+        result = mut.unify(hierarchy, in_place=True)
+
+        assert result is hierarchy
+        assert result["loose"] is loose_subtree
+        assert loose_subtree == {"g": mut.FilesystemItemType.file, "h": {"i": mut.FilesystemItemType.file}}
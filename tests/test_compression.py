@@ -0,0 +1,124 @@
+import gzip
+import lzma
+import os
+import stat
+from pathlib import Path
+
+from pytest import fixture, raises
+
+import tjpy_file_util.compression as mut
+from tjpy_file_util.copy import CopyException, copy, copy_children
+from tjpy_file_util.code_file_trees import create_file_tree, read_children_as_file_tree
+from tjpy_file_util.permissions import PermissionRule, PermissionRules
+from tjpy_file_util.temporary import create_temp_directory
+
+_COMPRESSIBLE = b"some very compressible content " * 1000
+
+
+@fixture
+def base_dir():
+    with create_temp_directory("base_dir") as base_dir:
+        yield base_dir
+
+
+@fixture(params=mut.available_codecs())
+def codec_name(request) -> str:
+    return request.param
+
+
+def test_unknown_codec():
+    with raises(ValueError):
+        mut.get_codec("unknown")
+
+
+def test_compress_and_decompress_copy_roundtrip(base_dir: Path, codec_name: str):
+    source_dir, compressed_dir, decompressed_dir = [base_dir.joinpath(name)
+                                                    for name in ("source", "compressed", "decompressed")]
+    for directory in (source_dir, compressed_dir, decompressed_dir):
+        directory.mkdir()
+    source_tree = create_file_tree(source_dir, {"dir": {"a.txt": None}, "b.txt": None, "empty.txt": None})
+    source_dir.joinpath("dir", "a.txt").write_bytes(_COMPRESSIBLE)
+    source_dir.joinpath("b.txt").write_bytes(_COMPRESSIBLE[:100])
+    suffix = mut.get_codec(codec_name).suffix
+
+    copy_children(source_dir, compressed_dir, compression=mut.Compression(codec_name), max_workers=2)
+
+    assert read_children_as_file_tree(compressed_dir) == _with_suffix(source_tree, suffix)
+    assert compressed_dir.joinpath("dir", "a.txt" + suffix).stat().st_size < len(_COMPRESSIBLE) / 10
+
+    copy_children(compressed_dir, decompressed_dir,
+                  compression=mut.Compression(codec_name, mode=mut.CompressionMode.decompress))
+
+    assert read_children_as_file_tree(decompressed_dir) == source_tree
+    assert decompressed_dir.joinpath("dir", "a.txt").read_bytes() == _COMPRESSIBLE
+    assert decompressed_dir.joinpath("b.txt").read_bytes() == _COMPRESSIBLE[:100]
+
+
+def _with_suffix(tree, suffix: str):
+    return {name if isinstance(value, dict) else name + suffix: _with_suffix(value, suffix)
+            if isinstance(value, dict) else value for name, value in tree.items()}
+
+
+def test_incompressible_file_is_copied_as_it_is(base_dir: Path):
+    random_content = os.urandom(100 * 1024)
+    base_dir.joinpath("random.bin").write_bytes(random_content)
+
+    copy(base_dir.joinpath("random.bin"), base_dir.joinpath("copy.bin"), compression=mut.Compression("gzip"))
+
+    assert base_dir.joinpath("copy.bin").read_bytes() == random_content
+    assert not base_dir.joinpath("copy.bin.gz").exists()
+
+    copy(base_dir.joinpath("random.bin"), base_dir.joinpath("forced.bin"),
+         compression=mut.Compression("gzip", incompressible_ratio=None))
+
+    assert gzip.decompress(base_dir.joinpath("forced.bin.gz").read_bytes()) == random_content
+
+
+def test_output_is_readable_by_stdlib(base_dir: Path):
+    base_dir.joinpath("file.txt").write_bytes(_COMPRESSIBLE)
+
+    copy(base_dir.joinpath("file.txt"), base_dir.joinpath("copy.txt"), compression=mut.Compression("lzma", level=1))
+
+    assert lzma.decompress(base_dir.joinpath("copy.txt.xz").read_bytes()) == _COMPRESSIBLE
+
+
+def test_decompress_multiple_gzip_members(base_dir: Path):
+    base_dir.joinpath("file.txt.gz").write_bytes(gzip.compress(b"first ") + gzip.compress(b"second"))
+
+    copy(base_dir.joinpath("file.txt.gz"), base_dir.joinpath("out.txt.gz"),
+         compression=mut.Compression("gzip", mode=mut.CompressionMode.decompress))
+
+    assert base_dir.joinpath("out.txt").read_bytes() == b"first second"
+
+
+def test_truncated_input_fails(base_dir: Path):
+    base_dir.joinpath("file.txt.gz").write_bytes(gzip.compress(_COMPRESSIBLE)[:100])
+
+    for _ in range(2):  # a failed copy does not leave a partial target behind which would let a retry fail early
+        with raises(CopyException, match="ended before the end of the stream"):
+            copy(base_dir.joinpath("file.txt.gz"), base_dir.joinpath("out.txt.gz"),
+                 compression=mut.Compression("gzip", mode=mut.CompressionMode.decompress))
+        assert not base_dir.joinpath("out.txt").exists()
+
+
+def test_sources_with_the_same_target_are_rejected(base_dir: Path):
+    source = base_dir.joinpath("source")
+    source.mkdir()
+    source.joinpath("a").write_bytes(_COMPRESSIBLE)
+    source.joinpath("a.gz").write_bytes(gzip.compress(_COMPRESSIBLE))
+
+    for max_workers in (1, 4):
+        target = base_dir.joinpath(f"target_{max_workers}")
+        target.mkdir()
+        with raises(CopyException):
+            copy_children(source, target, max_workers=max_workers,
+                          compression=mut.Compression("gzip", mode=mut.CompressionMode.decompress))
+
+
+def test_permission_rules_match_the_final_name(base_dir: Path):
+    base_dir.joinpath("file.txt").write_bytes(_COMPRESSIBLE)
+
+    copy(base_dir.joinpath("file.txt"), base_dir.joinpath("out.txt"), compression=mut.Compression("gzip"),
+         permissions=PermissionRules([PermissionRule("*.gz", mode="600")]))
+
+    assert stat.S_IMODE(base_dir.joinpath("out.txt.gz").stat().st_mode) == 0o600
@@ -1,9 +1,10 @@
 from pathlib import Path
 
-from pytest import fixture, fail
+from pytest import fixture, fail, raises
 
 import tjpy_file_util.copy as mut
 from tjpy_file_util.code_file_trees import create_file_tree, read_children_as_file_tree, unify
+from tjpy_file_util.io_scheduler import IoScheduler
 from tjpy_file_util.temporary import create_temp_directory
 
 
@@ -201,3 +202,89 @@ class TestCopyChildren:
         except mut.CopyException as ex:
             assert "target directory" in ex.args[0]
             assert "is_file" in ex.args[0]
+
+
+def test_reflink_file(source_dir: Path, target_dir: Path):
+    source_dir.joinpath("file.txt").write_text("content")
+
+    mut.reflink_file(source_dir.joinpath("file.txt"), target_dir.joinpath("file.txt"))
+
+    assert target_dir.joinpath("file.txt").read_text() == "content"
+
+
+def test_copy_file_content(source_dir: Path, target_dir: Path):
+    content = bytes(range(256)) * 10000
+    source_dir.joinpath("file.bin").write_bytes(content)
+
+    with source_dir.joinpath("file.bin").open("rb") as source, target_dir.joinpath("file.bin").open("wb") as target:
+        mut.copy_file_content(source.fileno(), target.fileno())
+
+    assert target_dir.joinpath("file.bin").read_bytes() == content
+
+
+def test_copy_file_content__without_kernel_copy(source_dir: Path, target_dir: Path, monkeypatch):
+    monkeypatch.setattr(mut, "try_reflink", lambda source_fd, target_fd: False)
+    monkeypatch.setattr(mut, "_copy_file_range", lambda source_fd, target_fd, size: False)
+    monkeypatch.setattr(mut, "_sendfile", lambda source_fd, target_fd, size: False)
+    source_dir.joinpath("file.bin").write_bytes(b"content")
+
+    with source_dir.joinpath("file.bin").open("rb") as source, target_dir.joinpath("file.bin").open("wb") as target:
+        mut.copy_file_content(source.fileno(), target.fileno())
+
+    assert target_dir.joinpath("file.bin").read_bytes() == b"content"
+
+
+class TestOverwriteDirectories:
+
+    def test_directory_replaces_directory(self, source_dir: Path, target_dir: Path):
+        create_file_tree(source_dir, {"dir": ["new.txt"]})
+        create_file_tree(target_dir, {"dir": ["old.txt"]})
+
+        mut.copy_children(source_dir, target_dir, merge_directories=False, overwrite_directories=True)
+
+        assert read_children_as_file_tree(target_dir) == unify({"dir": ["new.txt"]})
+
+    def test_file_replaces_directory(self, source_dir: Path, target_dir: Path):
+        create_file_tree(source_dir, {"a": None})
+        create_file_tree(target_dir, {"a": ["old.txt"]})
+
+        mut.copy_children(source_dir, target_dir, overwrite_directories=True)
+
+        assert read_children_as_file_tree(target_dir) == unify({"a": None})
+
+
+class TestParallelCopy:
+
+    def test_copy_children_with_workers(self, source_dir: Path, target_dir: Path):
+        source_tree = create_file_tree(source_dir, {
+            "dir": {f"file_{index}": None for index in range(20)},
+            "file": None,
+        })
+        source_dir.joinpath("file").write_text("content")
+
+        mut.copy_children(source_dir, target_dir, max_workers=4)
+
+        assert read_children_as_file_tree(target_dir) == source_tree
+        assert target_dir.joinpath("file").read_text() == "content"
+
+    def test_copy_with_scheduler_reports_conflicts(self, source_dir: Path, target_dir: Path):
+        create_file_tree(source_dir, {"dir": {"file": None}})
+        create_file_tree(target_dir, {"dir": {"file": None}})
+        scheduler = IoScheduler(2)
+
+        with raises(mut.CopyException):
+            mut.copy(source_dir.joinpath("dir"), target_dir.joinpath("dir"), scheduler=scheduler)
+
+    def test_target_is_checked_when_the_deferred_copy_runs(self, source_dir: Path, target_dir: Path):
+        source_dir.joinpath("file").write_text("new")
+
+        class CreatingScheduler(IoScheduler):
+            def run(self, tasks):
+                target_dir.joinpath("file").write_text("created after planning")
+                return super().run(tasks)
+
+        with raises(mut.CopyException):
+            mut.copy_children(source_dir, target_dir, scheduler=CreatingScheduler(2))
+        mut.copy_children(source_dir, target_dir, scheduler=CreatingScheduler(2), overwrite_files=True)
+
+        assert target_dir.joinpath("file").read_text() == "new"
@@ -0,0 +1,135 @@
+import os
+from pathlib import Path
+
+from pytest import fixture
+
+import tjpy_file_util.duplicates as mut
+from tjpy_file_util.code_file_trees import create_file_tree
+from tjpy_file_util.temporary import create_temp_directory
+
+
+@fixture
+def base_dir():
+    with create_temp_directory("duplicates") as base_dir:
+        yield base_dir
+
+
+def _create_files(base_dir: Path):
+    create_file_tree(base_dir, {
+        "a.bin": None,
+        "sub_dir": ["a_copy.bin", "same_edges.bin", "other.bin"],
+        "big.bin": None,
+        "empty.txt": None,
+        "empty2.txt": None,
+    })
+    base_dir.joinpath("a.bin").write_bytes(b"a" * 100)
+    base_dir.joinpath("sub_dir", "a_copy.bin").write_bytes(b"a" * 100)
+    base_dir.joinpath("sub_dir", "other.bin").write_bytes(b"b" * 100)
+    base_dir.joinpath("big.bin").write_bytes(b"x" * 10000 + b"1" + b"x" * 10000)
+    base_dir.joinpath("sub_dir", "same_edges.bin").write_bytes(b"x" * 10000 + b"2" + b"x" * 10000)
+
+
+def test_find_duplicates(base_dir: Path):
+    _create_files(base_dir)
+    base_dir.joinpath("big_copy.bin").write_bytes(base_dir.joinpath("big.bin").read_bytes())
+
+    duplicates = mut.find_duplicates([base_dir])
+
+    assert duplicates == [
+        [base_dir.joinpath("a.bin"), base_dir.joinpath("sub_dir", "a_copy.bin")],
+        [base_dir.joinpath("big.bin"), base_dir.joinpath("big_copy.bin")],
+    ]
+
+
+def test_find_duplicates__hardlinks_are_no_duplicates(base_dir: Path):
+    _create_files(base_dir)
+    os.link(str(base_dir.joinpath("big.bin")), str(base_dir.joinpath("big_link.bin")))
+
+    duplicates = mut.find_duplicates([base_dir], max_workers=1)
+
+    assert duplicates == [[base_dir.joinpath("a.bin"), base_dir.joinpath("sub_dir", "a_copy.bin")]]
+
+
+def test_find_duplicates__persistent_hash_cache(base_dir: Path, monkeypatch):
+    with create_temp_directory("cache_dir") as cache_dir:
+        _create_files(base_dir)
+        cache = mut.HashCache(cache_dir.joinpath("hashes.json"))
+        first_result = mut.find_duplicates([base_dir], hash_cache=cache)
+        cache.save()
+
+        hashed_files = []
+        original_hash_file = mut._hash_file
+
+        def hash_file(path: Path) -> str:
+            hashed_files.append(path)
+            return original_hash_file(path)
+
+        monkeypatch.setattr(mut, "_hash_file", hash_file)
+        base_dir.joinpath("sub_dir", "other.bin").write_bytes(b"a" * 99 + b"c")
+
+        second_result = mut.find_duplicates([base_dir], hash_cache=mut.HashCache(cache_dir.joinpath("hashes.json")))
+
+        assert second_result == first_result
+        assert hashed_files == [base_dir.joinpath("sub_dir", "other.bin")]
+
+
+def test_find_duplicates__hash_cache_with_other_edge_size(base_dir: Path):
+    content = b"x" * 20000
+    for name in ("a.bin", "b.bin"):
+        base_dir.joinpath(name).write_bytes(content)
+    cache = mut.HashCache()
+    mut.find_duplicates([base_dir], hash_cache=cache, edge_size=4096)
+    base_dir.joinpath("x.bin").write_bytes(content)
+
+    duplicates = mut.find_duplicates([base_dir], hash_cache=cache, edge_size=8192)
+
+    assert duplicates == [[base_dir.joinpath(name) for name in ("a.bin", "b.bin", "x.bin")]]
+
+
+def test_hash_cache__changed_files_replace_their_entry_and_unused_entries_are_pruned(base_dir: Path):
+    cache = mut.HashCache(base_dir.joinpath("hashes.json"))
+    cache.put("full", (1, 2, 10, 100), "old")
+    cache.put("full", (1, 2, 11, 200), "new")
+    cache.put("full", (1, 3, 10, 100), "deleted file")
+    cache.save()
+
+    assert len(cache) == 2
+    assert cache.get("full", (1, 2, 10, 100)) is None
+    loaded = mut.HashCache(base_dir.joinpath("hashes.json"))
+    assert loaded.get("full", (1, 2, 11, 200)) == "new"
+    assert loaded.prune() == 1
+    assert len(loaded) == 1
+
+
+def test_find_duplicates__unreadable_directories_and_vanished_files_are_skipped(base_dir: Path, monkeypatch):
+    _create_files(base_dir)
+    create_file_tree(base_dir, {"locked": ["a_locked.bin"]})
+    base_dir.joinpath("locked", "a_locked.bin").write_bytes(b"a" * 100)
+    base_dir.joinpath("big_copy.bin").write_bytes(base_dir.joinpath("big.bin").read_bytes())
+    original_scandir = mut.fs.scandir
+    original_group_files_by_size = mut._group_files_by_size
+
+    def scandir(path):
+        if path == str(base_dir.joinpath("locked")):
+            raise PermissionError(13, "Permission denied", path)
+        return original_scandir(path)
+
+    def group_files_by_size(directories, min_size):
+        files_by_size = original_group_files_by_size(directories, min_size)
+        base_dir.joinpath("big_copy.bin").unlink()
+        return files_by_size
+
+    monkeypatch.setattr(mut.fs, "scandir", scandir)
+    monkeypatch.setattr(mut, "_group_files_by_size", group_files_by_size)
+
+    duplicates = mut.find_duplicates([base_dir])
+
+    assert duplicates == [[base_dir.joinpath("a.bin"), base_dir.joinpath("sub_dir", "a_copy.bin")]]
+
+
+def test_hash_cache__corrupt_file_is_ignored(base_dir: Path):
+    base_dir.joinpath("hashes.json").write_text('{"version": 2, "hash', encoding="utf-8")
+
+    cache = mut.HashCache(base_dir.joinpath("hashes.json"))
+
+    assert len(cache) == 0
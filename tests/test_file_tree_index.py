@@ -0,0 +1,71 @@
+from pathlib import PurePosixPath
+
+from pytest import fixture, raises
+
+import tjpy_file_util.file_tree_index as mut
+from tjpy_file_util.code_file_trees import unify, create_file_tree, FilesystemItemType
+from tjpy_file_util.temporary import create_temp_directory
+
+
+@fixture
+def index() -> mut.FileTreeIndex:
+    return mut.FileTreeIndex(unify({
+        "lib": {
+            "libfoo.so": None,
+            "x86_64": ["libbar.so", "libbar.a"],
+        },
+        "bin": ["tool", "tool.so"],
+        "README.md": None,
+        "empty_dir": [],
+    }))
+
+
+def _paths(*paths: str):
+    return [PurePosixPath(path) for path in paths]
+
+
+class TestFileTreeIndex:
+
+    def test_exists(self, index: mut.FileTreeIndex):
+        assert index.exists("lib/x86_64/libbar.so")
+        assert index.exists("lib/x86_64")
+        assert not index.exists("lib/x86_64/missing.so")
+        assert not index.exists("README.md/child")
+        assert index.is_file("README.md")
+        assert index.is_dir("empty_dir")
+        assert not index.is_dir("README.md")
+
+    def test_glob_by_extension_with_prefix(self, index: mut.FileTreeIndex):
+        assert index.glob("lib/**/*.so") == _paths("lib/libfoo.so", "lib/x86_64/libbar.so")
+        assert index.glob("lib/*.so") == _paths("lib/libfoo.so")
+        assert index.glob("**/*.so") == _paths("bin/tool.so", "lib/libfoo.so", "lib/x86_64/libbar.so")
+
+    def test_glob_by_name_and_character_classes(self, index: mut.FileTreeIndex):
+        assert index.glob("**/tool") == _paths("bin/tool")
+        assert index.glob("lib/x86_64/libbar.[!s]*") == _paths("lib/x86_64/libbar.a")
+        assert index.glob("*/x86_64/*") == _paths("lib/x86_64/libbar.a", "lib/x86_64/libbar.so")
+        assert index.glob("missing/**") == []
+
+    def test_match(self, index: mut.FileTreeIndex):
+        assert index.match(r"lib/.*\.a") == _paths("lib/x86_64/libbar.a")
+
+    def test_add_and_remove(self, index: mut.FileTreeIndex):
+        index.add("lib/arm/libbaz.so")
+        assert index.is_dir("lib/arm")
+        assert index.glob("**/libbaz.so") == _paths("lib/arm/libbaz.so")
+
+        index.remove("lib")
+        assert not index.exists("lib/arm/libbaz.so")
+        assert index.glob("**/*.so") == _paths("bin/tool.so")
+
+        with raises(mut.FileTreeIndexException):
+            index.add("README.md/child")
+        with raises(mut.FileTreeIndexException):
+            index.remove("lib")
+
+    def test_from_directory(self):
+        with create_temp_directory("index_dir") as directory:
+            hierarchy = create_file_tree(directory, {"a": ["b.txt"], "c": FilesystemItemType.directory})
+            index = mut.FileTreeIndex.from_directory(directory)
+            assert index.to_hierarchy() == hierarchy
+            assert len(index) == 3
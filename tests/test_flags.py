@@ -1,5 +1,8 @@
+import stat
+
 import tjpy_file_util.flags as mut
-from tjpy_file_util.temporary import create_temp_file
+from tjpy_file_util.code_file_trees import create_file_tree
+from tjpy_file_util.temporary import create_temp_file, create_temp_directory
 
 
 def test_make_file_executable_if_necessary():
@@ -9,3 +12,46 @@ def test_make_file_executable_if_necessary():
         assert mut.is_executable(tmp_file)
         mut.make_file_executable_if_necessary(tmp_file)
         assert mut.is_executable(tmp_file)
+
+
+def _create_scripts(base_dir):
+    return create_file_tree(base_dir, {
+        "run.sh": None,
+        "data.txt": None,
+        "bin": ["tool.sh", "other"],
+    })
+
+
+def test_make_executable_tree():
+    with create_temp_directory("tree") as base_dir:
+        _create_scripts(base_dir)
+
+        assert mut.make_executable_tree(base_dir, pattern="*.sh") == 2
+
+        assert mut.is_executable(base_dir.joinpath("run.sh"))
+        assert mut.is_executable(base_dir.joinpath("bin", "tool.sh"))
+        assert not mut.is_executable(base_dir.joinpath("data.txt"))
+        assert not mut.is_executable(base_dir.joinpath("bin", "other"))
+        assert mut.make_executable_tree(base_dir, pattern="*.sh") == 0
+
+
+def test_make_executable_tree__parallel():
+    with create_temp_directory("tree") as base_dir:
+        _create_scripts(base_dir)
+
+        assert mut.make_executable_tree(base_dir, pattern="bin/*", max_workers=4) == 2
+
+        assert mut.is_executable(base_dir.joinpath("bin", "other"))
+        assert not mut.is_executable(base_dir.joinpath("run.sh"))
+
+
+def test_apply_modes():
+    with create_temp_directory("tree") as base_dir:
+        _create_scripts(base_dir)
+
+        mut.apply_modes(base_dir, lambda path, mode: mode & ~stat.S_IWGRP & ~stat.S_IWOTH | stat.S_IRGRP)
+
+        for path in [base_dir.joinpath("bin"), base_dir.joinpath("bin", "other"), base_dir.joinpath("data.txt")]:
+            assert path.stat().st_mode & stat.S_IRGRP
+            assert not path.stat().st_mode & stat.S_IWOTH
+        assert mut.apply_modes(base_dir, lambda path, mode: mode & ~stat.S_IWGRP & ~stat.S_IWOTH | stat.S_IRGRP) == 0
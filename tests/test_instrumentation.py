@@ -0,0 +1,69 @@
+import os
+from pathlib import Path
+
+from pytest import fixture
+
+import tjpy_file_util.instrumentation as mut
+from tjpy_file_util.code_file_trees import create_file_tree, read_children_as_file_tree, scan_file_tree
+from tjpy_file_util.copy import copy_children
+from tjpy_file_util.temporary import create_temp_directory
+
+
+@fixture
+def base_dir():
+    with create_temp_directory("base_dir") as base_dir:
+        yield base_dir
+
+
+def test_disabled_uses_plain_functions():
+    assert mut.fs.stat is os.stat
+    assert mut.fs.mkdir is os.mkdir
+    assert mut.active_metrics() is None
+
+
+def test_counts_operations_per_api_call(base_dir: Path):
+    source_dir = base_dir.joinpath("source")
+    target_dir = base_dir.joinpath("target")
+    source_dir.mkdir()
+    target_dir.mkdir()
+    create_file_tree(source_dir, {"dir": {"file_1": None, "file_2": None}, "file_3": None})
+
+    with mut.instrumentation() as metrics:
+        assert mut.fs.stat is not os.stat
+        copy_children(source_dir, target_dir)
+        read_children_as_file_tree(target_dir)
+
+    assert mut.fs.stat is os.stat
+    result = metrics.to_dict()
+    copy_metrics = result["api_calls"]["copy_children"]
+    assert copy_metrics["count"] == 1
+    assert copy_metrics["operations"]["mkdir"]["count"] == 1
+    assert copy_metrics["operations"]["copy"]["count"] == 3
+    assert copy_metrics["operations"]["open"]["count"] == 6
+    assert result["api_calls"]["read_children_as_file_tree"]["operations"]["list"]["count"] == 2
+    assert result["operations"]["copy"]["count"] == 3
+    assert result["operations"]["stat"]["seconds"] > 0
+
+
+def test_nested_and_parallel_api_calls_are_attributed_to_the_outermost_call(base_dir: Path):
+    create_file_tree(base_dir, {"a": {"file": None}, "b": {"file": None}})
+
+    with mut.instrumentation() as metrics:
+        scan_file_tree(base_dir, max_workers=2)
+        mut.api_call(read_children_as_file_tree)(base_dir)
+
+    api_calls = metrics.to_dict()["api_calls"]
+    assert set(api_calls) == {"scan_file_tree", "read_children_as_file_tree"}
+    assert api_calls["scan_file_tree"]["operations"]["list"]["count"] == 3
+    assert api_calls["read_children_as_file_tree"]["count"] == 1
+
+
+def test_to_prometheus(base_dir: Path):
+    with mut.instrumentation() as metrics:
+        create_file_tree(base_dir, {"dir": {}})
+
+    text = metrics.to_prometheus()
+    assert 'tjpy_file_util_fs_operations_total{operation="mkdir"} 1\n' in text
+    assert 'tjpy_file_util_api_calls_total{api="create_file_tree"} 1\n' in text
+    assert 'tjpy_file_util_api_fs_operations_total{api="create_file_tree",operation="mkdir"} 1\n' in text
+    assert "# TYPE tjpy_file_util_fs_operation_seconds_total counter\n" in text
@@ -0,0 +1,63 @@
+import functools
+import operator
+import os
+import threading
+import time
+from typing import List
+
+from pytest import raises
+
+import tjpy_file_util.io_scheduler as mut
+
+
+def test_run_returns_results_in_task_order():
+    scheduler = mut.IoScheduler(4, device_limits={1: 4, 2: 4})
+    tasks = [mut.IoTask((1 + index % 2,), 100 - index, functools.partial(operator.mul, index, 2))
+             for index in range(10)]
+    assert scheduler.run(tasks) == [index * 2 for index in range(10)]
+
+
+def test_tasks_of_a_device_run_in_inode_order():
+    scheduler = mut.IoScheduler(4, device_limits={1: 1})
+    order: List[int] = []
+    tasks = [mut.IoTask((1,), inode, functools.partial(order.append, inode)) for inode in (5, 3, 9, 1)]
+    scheduler.run(tasks)
+    assert order == [1, 3, 5, 9]
+
+
+def test_device_limit_is_enforced_across_groups():
+    scheduler = mut.IoScheduler(8, device_limits={1: 2, 2: 8, 3: 8})
+    lock = threading.Lock()
+    running = [0]
+    max_running = [0]
+
+    def task():
+        with lock:
+            running[0] += 1
+            max_running[0] = max(max_running[0], running[0])
+        time.sleep(0.01)
+        with lock:
+            running[0] -= 1
+
+    scheduler.run([mut.IoTask((1, 2 + index % 2), index, task) for index in range(12)])
+    assert max_running[0] == 2
+
+
+def test_no_tasks_are_started_after_the_first_error():
+    scheduler = mut.IoScheduler(4, device_limits={1: 1})
+    executed: List[int] = []
+
+    def failing():
+        raise ValueError("failed")
+
+    with raises(ValueError):
+        scheduler.run([mut.IoTask((1,), 1, failing)]
+                      + [mut.IoTask((1,), inode, functools.partial(executed.append, inode)) for inode in range(2, 10)])
+    assert executed == []
+
+
+def test_device_limit_is_detected_and_bounded_by_max_workers():
+    scheduler = mut.IoScheduler(3)
+    device = os.stat(".").st_dev
+    assert 1 <= scheduler.device_limit(device) <= 3
+    assert isinstance(mut.detect_device_kind(device), mut.DeviceKind)
@@ -0,0 +1,167 @@
+import os
+import stat
+import traceback
+from pathlib import Path
+from typing import Callable
+
+from pytest import fixture, raises
+
+import tjpy_file_util.permissions as mut
+from tjpy_file_util.code_file_trees import create_file_tree
+from tjpy_file_util.copy import copy, copy_children
+from tjpy_file_util.instrumentation import instrumentation
+from tjpy_file_util.remove import remove_tree
+from tjpy_file_util.temporary import create_temp_directory
+
+
+@fixture
+def base_dir():
+    with create_temp_directory("permissions") as base_dir:
+        yield base_dir
+
+
+def _mode(path: Path) -> int:
+    return stat.S_IMODE(path.stat().st_mode)
+
+
+class TestModeSpec:
+
+    def test_symbolic(self):
+        assert mut.ModeSpec("u+x,g-w").apply(0o664, is_directory=False) == 0o744
+        assert mut.ModeSpec("o=r").apply(0o777, is_directory=False) == 0o774
+        assert mut.ModeSpec("a-w").apply(0o666, is_directory=False) == 0o444
+        assert mut.ModeSpec("go=").apply(0o755, is_directory=False) == 0o700
+        assert mut.ModeSpec("u=rw,go=r").apply(0o777, is_directory=False) == 0o644
+        assert mut.ModeSpec("+t").apply(0o755, is_directory=True) == 0o1755
+        assert mut.ModeSpec("u+s").apply(0o755, is_directory=False) == 0o4755
+
+    def test_capital_x(self):
+        assert mut.ModeSpec("a+X").apply(0o644, is_directory=False) == 0o644
+        assert mut.ModeSpec("a+X").apply(0o744, is_directory=False) == 0o755
+        assert mut.ModeSpec("a+X").apply(0o644, is_directory=True) == 0o755
+
+    def test_octal_keeps_file_type(self):
+        assert mut.ModeSpec("750").apply(stat.S_IFREG | 0o644, is_directory=False) == stat.S_IFREG | 0o750
+
+    def test_invalid(self):
+        with raises(ValueError):
+            mut.ModeSpec("u+q")
+
+
+def test_apply_permissions(base_dir: Path):
+    create_file_tree(base_dir, {
+        "bin": ["run.sh", "data.txt"],
+        "secret.txt": None,
+    })
+    rules = [
+        mut.PermissionRule(mode="go-w"),
+        mut.PermissionRule("bin/*.sh", mode="u+x"),
+        mut.PermissionRule("secret.txt", mode="600"),
+        mut.PermissionRule(mode="a+rX", files=False),
+    ]
+
+    mut.apply_permissions(base_dir, rules)
+
+    assert _mode(base_dir.joinpath("bin", "run.sh")) & stat.S_IXUSR
+    assert not _mode(base_dir.joinpath("bin", "data.txt")) & stat.S_IXUSR
+    assert _mode(base_dir.joinpath("secret.txt")) == 0o600
+    assert _mode(base_dir.joinpath("bin")) & 0o555 == 0o555
+    assert mut.apply_permissions(base_dir, rules, max_workers=2) == 0
+
+
+def test_apply_permissions__ownership_is_unchanged_if_equal(base_dir: Path):
+    create_file_tree(base_dir, ["file.txt"])
+
+    calls = mut.apply_permissions(base_dir, [mut.PermissionRule(owner=os.getuid(), group=os.getgid())])
+
+    assert calls == 0
+
+
+def test_apply_permissions__entry_replaced_by_symlink_is_not_followed(base_dir: Path, monkeypatch):
+    create_file_tree(base_dir, {"tree": ["file.txt"], "outside.txt": None})
+    base_dir.joinpath("outside.txt").chmod(0o644)
+    original_desired = mut.PermissionRules.desired
+
+    def desired(rules: mut.PermissionRules, relative_path: str, current: mut.Permissions, is_directory: bool):
+        base_dir.joinpath("tree", "file.txt").unlink()
+        base_dir.joinpath("tree", "file.txt").symlink_to(base_dir.joinpath("outside.txt"))
+        return original_desired(rules, relative_path, current, is_directory)
+
+    monkeypatch.setattr(mut.PermissionRules, "desired", desired)
+
+    calls = mut.apply_permissions(base_dir.joinpath("tree"), [mut.PermissionRule(mode="600")])
+
+    assert calls == 0
+    assert _mode(base_dir.joinpath("outside.txt")) == 0o644
+
+
+def test_copy_with_permissions(base_dir: Path):
+    source = base_dir.joinpath("source")
+    target = base_dir.joinpath("target")
+    source.mkdir()
+    target.mkdir()
+    create_file_tree(source, {"bin": ["run.sh"], "file.txt": None})
+
+    copy_children(source, target, permissions=mut.PermissionRules([
+        mut.PermissionRule("bin/*.sh", mode="u+x"),
+        mut.PermissionRule("bin", mode="700"),
+        mut.PermissionRule("file.txt", mode="600"),
+    ]))
+
+    assert _mode(target.joinpath("bin", "run.sh")) & stat.S_IXUSR
+    assert _mode(target.joinpath("bin")) == 0o700
+    assert _mode(target.joinpath("file.txt")) == 0o600
+
+
+def test_copy_with_permissions__metadata_calls_are_instrumented(base_dir: Path):
+    source = base_dir.joinpath("source")
+    source.mkdir()
+    create_file_tree(source, ["file.txt"])
+    source.joinpath("file.txt").chmod(0o644)
+
+    with instrumentation() as metrics:
+        copy(source, base_dir.joinpath("target"),
+             permissions=mut.PermissionRules([mut.PermissionRule("target/file.txt", mode="600")]))
+
+    assert metrics.operations["chmod"].count == 1
+
+
+def _run_unprivileged(function: Callable[[], None]):
+    """Runs the function as user nobody if the tests run as root, as root ignores missing write permissions"""
+    if os.getuid() != 0:
+        function()
+        return
+    pid = os.fork()
+    if pid == 0:
+        exit_code = 1
+        try:
+            os.setgid(65534)
+            os.setuid(65534)
+            function()
+            exit_code = 0
+        except BaseException:
+            traceback.print_exc()
+        finally:
+            os._exit(exit_code)
+    assert os.waitpid(pid, 0)[1] == 0
+
+
+def test_copy_with_read_only_directory_mode(base_dir: Path):
+    base_dir.chmod(0o777)
+    source = base_dir.joinpath("src")
+    source.mkdir()
+    create_file_tree(source, {"bin": {"run.sh": None, "lib": ["tool.sh"]}})
+    rules = mut.PermissionRules([
+        mut.PermissionRule("dst/bin", mode="555"),
+        mut.PermissionRule("dst/bin/lib", mode="500"),
+    ])
+
+    for max_workers in (1, 4):
+        target = base_dir.joinpath("dst")
+        _run_unprivileged(lambda: copy(source, target, permissions=rules, max_workers=max_workers))
+
+        assert _mode(target.joinpath("bin")) == 0o555
+        assert _mode(target.joinpath("bin", "lib")) == 0o500
+        target.joinpath("bin").chmod(0o755)
+        target.joinpath("bin", "lib").chmod(0o755)
+        remove_tree(target)
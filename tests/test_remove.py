@@ -0,0 +1,114 @@
+import os
+from pathlib import Path
+from typing import List
+
+from pytest import fixture, raises
+
+import tjpy_file_util.remove as mut
+import tjpy_file_util.tree_walk as tree_walk
+from tjpy_file_util.code_file_trees import create_file_tree
+from tjpy_file_util.temporary import create_temp_directory
+
+
+@fixture
+def base_dir():
+    with create_temp_directory("remove") as base_dir:
+        yield base_dir
+
+
+def _create_tree(directory: Path):
+    directory.mkdir()
+    create_file_tree(directory, {
+        "a.txt": None,
+        "dir": {
+            "b.txt": None,
+            "sub_dir": ["c.txt", "d.txt"],
+            "empty_dir": [],
+        },
+        "dir2": ["e.txt"],
+    })
+
+
+def test_remove_tree(base_dir: Path):
+    tree = base_dir.joinpath("tree")
+    _create_tree(tree)
+
+    progress = mut.remove_tree(tree)
+
+    assert not tree.exists()
+    assert progress == mut.RemovalProgress(files_removed=5, directories_removed=5)
+
+
+def test_remove_tree__parallel_with_progress(base_dir: Path):
+    tree = base_dir.joinpath("tree")
+    _create_tree(tree)
+    reported: List[mut.RemovalProgress] = []
+
+    progress = mut.remove_tree(tree, max_workers=4, on_progress=reported.append)
+
+    assert not tree.exists()
+    assert progress == mut.RemovalProgress(files_removed=5, directories_removed=5)
+    assert reported[-1] == progress
+
+
+def test_remove_tree__keep_root(base_dir: Path):
+    tree = base_dir.joinpath("tree")
+    _create_tree(tree)
+
+    mut.remove_tree(tree, keep_root=True)
+
+    assert list(tree.iterdir()) == []
+
+
+def test_remove_tree__symlinks_are_not_followed(base_dir: Path):
+    outside = base_dir.joinpath("outside")
+    _create_tree(outside)
+    tree = base_dir.joinpath("tree")
+    tree.mkdir()
+    os.symlink(str(outside), str(tree.joinpath("link")))
+
+    mut.remove_tree(tree, max_workers=2)
+
+    assert not tree.exists()
+    assert outside.joinpath("dir", "sub_dir", "c.txt").is_file()
+
+
+def test_remove_tree__directory_swapped_for_symlink(base_dir: Path):
+    outside = base_dir.joinpath("outside")
+    _create_tree(outside)
+    tree = base_dir.joinpath("tree")
+    _create_tree(tree)
+
+    def swap_directory(progress: mut.RemovalProgress):
+        if not tree.joinpath("moved").exists():
+            tree.joinpath("dir").rename(tree.joinpath("moved"))
+            os.symlink(str(outside.joinpath("dir")), str(tree.joinpath("dir")))
+
+    with raises(OSError):
+        mut.remove_tree(tree, on_progress=swap_directory)
+
+    assert outside.joinpath("dir", "sub_dir", "c.txt").is_file()
+
+
+def test_remove_tree__without_dir_fd(base_dir: Path, monkeypatch):
+    monkeypatch.setattr(tree_walk, "DIR_FD_SUPPORTED", False)
+    monkeypatch.setattr(mut, "_DIR_FD_SUPPORTED", False)
+    tree = base_dir.joinpath("tree")
+    _create_tree(tree)
+    reported: List[mut.RemovalProgress] = []
+
+    progress = mut.remove_tree(tree, on_progress=reported.append)
+
+    assert not tree.exists()
+    assert progress == mut.RemovalProgress(files_removed=5, directories_removed=5)
+    assert reported[-1] == progress
+
+
+def test_remove_tree__file(base_dir: Path):
+    file = base_dir.joinpath("file.txt")
+    file.touch()
+
+    assert mut.remove_tree(file) == mut.RemovalProgress(files_removed=1, directories_removed=0)
+    assert not file.exists()
+    with raises(FileNotFoundError):
+        mut.remove_tree(file)
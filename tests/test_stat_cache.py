@@ -0,0 +1,75 @@
+import stat
+import threading
+from typing import List, Optional
+
+import tjpy_file_util.stat_cache as mut
+from tjpy_file_util.code_file_trees import create_file_tree, read_children_as_file_tree
+from tjpy_file_util.copy import copy_children
+from tjpy_file_util.flags import make_file_executable_if_necessary
+from tjpy_file_util.temporary import create_temp_directory, create_temp_file
+from tjpy_file_util.user_friendly_assertion import assert_path_is_file
+
+
+def test_stat_cache_hits_and_misses():
+    with create_temp_file("some_file") as tmp_file, mut.stat_cache() as cache:
+        assert_path_is_file(tmp_file)
+        assert_path_is_file(tmp_file)
+        assert mut.cached_stat(tmp_file.with_name("not_existing_file")) is None
+        assert not mut.path_exists(tmp_file.with_name("not_existing_file"))
+
+        assert cache.misses == 2
+        assert cache.hits == 2
+
+
+def test_stat_cache_is_only_active_in_context():
+    with mut.stat_cache() as cache:
+        with mut.stat_cache() as nested_cache:
+            assert nested_cache is cache
+        assert mut.active_stat_cache() is cache
+    assert mut.active_stat_cache() is None
+
+
+def test_modifications_by_the_library_invalidate_the_cache():
+    with create_temp_file("some_file") as tmp_file, mut.stat_cache():
+        assert not assert_path_is_file(tmp_file).st_mode & stat.S_IEXEC
+        make_file_executable_if_necessary(tmp_file)
+        assert assert_path_is_file(tmp_file).st_mode & stat.S_IEXEC
+
+
+def test_copy_with_stat_cache():
+    with create_temp_directory("source_dir") as source_dir, create_temp_directory("target_dir") as target_dir:
+        with mut.stat_cache() as cache:
+            source_tree = create_file_tree(source_dir, {"dir": ["file.txt"], "file2.txt": None})
+            copy_children(source_dir, target_dir)
+            assert read_children_as_file_tree(target_dir) == source_tree
+            assert cache.hits > 0
+
+
+def test_worker_threads_share_the_stat_cache():
+    with create_temp_directory("source_dir") as source_dir, create_temp_directory("target_dir") as target_dir:
+        create_file_tree(source_dir, {"dir": ["file.txt"], "file2.txt": None})
+        with mut.stat_cache() as cache:
+            assert not mut.path_exists(target_dir.joinpath("file2.txt"))
+
+            copy_children(source_dir, target_dir, max_workers=4)
+
+            assert mut.path_is_file(target_dir.joinpath("file2.txt"))
+            assert mut.path_is_file(target_dir.joinpath("dir", "file.txt"))
+
+            results: List[Optional[mut.StatCache]] = []
+            thread = threading.Thread(target=mut.with_active_stat_cache(
+                lambda: results.append(mut.active_stat_cache())))
+            thread.start()
+            thread.join()
+            assert results == [cache]
+
+
+def test_invalidate_recursive():
+    cache = mut.StatCache()
+    with create_temp_directory("some_directory") as directory:
+        directory.joinpath("file").touch()
+        assert cache.stat(directory.joinpath("file")) is not None
+        directory.joinpath("file").unlink()
+        assert cache.stat(directory.joinpath("file")) is not None
+        cache.invalidate(directory, recursive=True)
+        assert cache.stat(directory.joinpath("file")) is None
@@ -1,4 +1,12 @@
+import os
+import stat
+import threading
+import time
+
+from pytest import fixture, raises
+
 import tjpy_file_util.temporary as mut
+from tjpy_file_util.stat_cache import path_is_dir, path_is_file, stat_cache
 
 
 def test_create_temp_file():
@@ -15,6 +23,14 @@ def test_create_temp_file__no_cleanup():
     assert tmp_file.exists()
 
 
+def test_create_temp_file__removed_inside_stat_cache():
+    with stat_cache():
+        with mut.open_temp_file("some_temporary_file") as tmp_file:
+            assert path_is_file(tmp_file.path)
+            tmp_file.path.unlink()
+    assert not tmp_file.path.exists()
+
+
 def test_create_temp_file_for():
     with mut.create_temp_file("some_temporary_file") as some_file:
         file_content = "some text"
@@ -46,8 +62,311 @@ def test_create_temp_directory():
     assert not tmp_directory.is_dir()
 
 
+def test_create_temp_directory__removed_inside_stat_cache():
+    with stat_cache():
+        for cleanup in (True, mut.BACKGROUND_CLEANUP):
+            with mut.create_temp_directory("some_temporary_directory", cleanup=cleanup) as tmp_directory:
+                assert path_is_dir(tmp_directory)
+                tmp_directory.rmdir()
+            assert not tmp_directory.exists()
+
+
 def test_create_temp_directory__no_cleanup():
     with mut.create_temp_directory("some_temporary_directory", cleanup=False) as tmp_directory:
         assert tmp_directory.is_dir()
         assert "some_temporary_directory" in tmp_directory.name
     assert tmp_directory.is_dir()
+
+
+def test_temp_directory_pool():
+    with mut.TempDirectoryPool(size=2, max_size=2) as pool:
+        with pool.create_temp_directory("some_temporary_directory") as tmp_directory:
+            assert tmp_directory.is_dir()
+            assert "some_temporary_directory" in tmp_directory.name
+            assert list(tmp_directory.iterdir()) == []
+            tmp_directory.joinpath("sub_dir").mkdir()
+            tmp_directory.joinpath("sub_dir", "some_file").touch()
+            tmp_directory.joinpath("some_file").touch()
+        assert not tmp_directory.exists()
+
+        with pool.create_temp_directory("other") as first, pool.create_temp_directory("other") as second:
+            assert first != second
+            assert list(first.iterdir()) == []
+        assert pool.idle_count() <= 2
+    assert not pool.directory.exists()
+
+
+def test_temp_directory_pool__close_keeps_handed_out_directories():
+    pool = mut.TempDirectoryPool(size=1)
+    with pool.create_temp_directory("handed_out") as tmp_directory:
+        pool.close()
+        assert tmp_directory.is_dir()
+        tmp_directory.joinpath("some_file").touch()
+    assert not pool.directory.exists()
+
+
+def test_temp_directory_pool__concurrent_releases_do_not_exceed_max_size(monkeypatch):
+    original_remove_tree = mut.remove_tree
+
+    def slow_remove_tree(path, **kwargs):
+        time.sleep(0.2)
+        original_remove_tree(path, **kwargs)
+
+    with mut.TempDirectoryPool(size=0, max_size=1) as pool:
+        first = pool.create_temp_directory("first")
+        second = pool.create_temp_directory("second")
+        first.__enter__()
+        second.__enter__()
+        monkeypatch.setattr(mut, "remove_tree", slow_remove_tree)
+        threads = [threading.Thread(target=context.__exit__, args=(None, None, None)) for context in (first, second)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert pool.idle_count() == 1
+
+
+def test_temp_directory_pool__no_cleanup():
+    with mut.TempDirectoryPool(size=1) as pool:
+        with pool.create_temp_directory("some_temporary_directory", cleanup=False) as tmp_directory:
+            pass
+    try:
+        assert tmp_directory.is_dir()
+    finally:
+        tmp_directory.rmdir()
+
+
+def _create_directory_with_file(base_directory):
+    source = base_directory.joinpath("source")
+    source.joinpath("sub_dir").mkdir(parents=True)
+    source.joinpath("sub_dir", "some_file").write_text("content")
+    return source
+
+
+def test_create_temp_directory_for__strategies():
+    with mut.create_temp_directory("some_temporary_directory") as base_directory:
+        source = _create_directory_with_file(base_directory)
+        for strategy in mut.TempCopyStrategy:
+            with mut.create_temp_directory_for(source, strategy=strategy) as tmp_copy:
+                assert tmp_copy.joinpath("sub_dir", "some_file").read_text() == "content"
+                assert "source" in tmp_copy.name
+            assert not tmp_copy.exists()
+            assert source.joinpath("sub_dir", "some_file").read_text() == "content"
+
+
+def test_create_temp_directory_for__hardlink_strategy_break_hardlink():
+    with mut.create_temp_directory("some_temporary_directory") as base_directory:
+        source = _create_directory_with_file(base_directory)
+        with mut.create_temp_directory_for(source, strategy=mut.TempCopyStrategy.hardlink) as tmp_copy:
+            copied_file = tmp_copy.joinpath("sub_dir", "some_file")
+            assert copied_file.stat().st_nlink == 2
+            mut.break_hardlink(copied_file)
+            copied_file.write_text("changed")
+            assert copied_file.stat().st_nlink == 1
+        assert source.joinpath("sub_dir", "some_file").read_text() == "content"
+
+
+def test_open_temp_file():
+    with mut.open_temp_file("some_temporary_file") as tmp_file:
+        assert tmp_file.path.is_file()
+        tmp_file.file.write(b"content")
+        tmp_file.file.flush()
+        assert tmp_file.path.read_bytes() == b"content"
+    assert tmp_file.file.closed
+    assert not tmp_file.path.exists()
+
+
+def test_open_temp_file_for():
+    with mut.create_temp_file("some_temporary_file") as some_file:
+        file_content = b"some bytes" * 100000
+        some_file.write_bytes(file_content)
+        with mut.open_temp_file_for(some_file) as tmp_copy:
+            assert tmp_copy.path != some_file
+            assert tmp_copy.file.read() == file_content
+            assert tmp_copy.path.read_bytes() == file_content
+        assert not tmp_copy.path.exists()
+
+
+def test_create_temp_file__does_not_leak_descriptors():
+    descriptors_before = len(os.listdir("/proc/self/fd"))
+    with mut.create_temp_file("some_temporary_file") as some_file:
+        for _ in range(10):
+            with mut.create_temp_file("some_temporary_file", cleanup=True):
+                pass
+        assert some_file.is_file()
+    assert len(os.listdir("/proc/self/fd")) == descriptors_before
+
+
+def test_temp_placement_policy():
+    with mut.create_temp_directory("memory") as memory_directory, \
+            mut.create_temp_directory("disk") as disk_directory:
+        placement = mut.TempPlacementPolicy(memory_directory=memory_directory, disk_directory=disk_directory,
+                                            max_memory_item_size=1000)
+
+        with mut.create_temp_file("small", size_hint=100, placement=placement) as small_file, \
+                mut.create_temp_directory("unknown_size", placement=placement) as unknown_size_directory, \
+                mut.create_temp_file("big", size_hint=2000, placement=placement) as big_file:
+            assert small_file.parent == memory_directory
+            assert unknown_size_directory.parent == disk_directory
+            assert big_file.parent == disk_directory
+            assert placement.reserved_bytes() == {memory_directory: 100, disk_directory: 2000}
+        assert placement.reserved_bytes() == {memory_directory: 0, disk_directory: 0}
+
+
+def test_temp_placement_policy__memory_budget_exhausted():
+    with mut.create_temp_directory("memory") as memory_directory:
+        placement = mut.TempPlacementPolicy(memory_directory=memory_directory, memory_budget_fraction=0.0)
+
+        with mut.create_temp_file("small", size_hint=1, placement=placement) as small_file:
+            assert small_file.parent != memory_directory
+
+
+def test_create_temp_file_for__placement():
+    with mut.create_temp_directory("memory") as memory_directory, mut.create_temp_file("some_file") as some_file:
+        some_file.write_text("content")
+        placement = mut.TempPlacementPolicy(memory_directory=memory_directory)
+        with mut.create_temp_file_for(some_file, placement=placement) as tmp_copy:
+            assert tmp_copy.parent == memory_directory
+            assert tmp_copy.read_text() == "content"
+            assert placement.reserved_bytes() == {memory_directory: len("content")}
+
+
+def test_create_temp_directory_for__placement():
+    with mut.create_temp_directory("memory") as memory_directory, mut.create_temp_directory("source") as source:
+        source.joinpath("some_file").write_text("content")
+        placement = mut.TempPlacementPolicy(memory_directory=memory_directory)
+        with mut.create_temp_directory_for(source, placement=placement) as tmp_copy:
+            assert tmp_copy.parent == memory_directory
+            assert tmp_copy.joinpath("some_file").read_text() == "content"
+            assert placement.reserved_bytes() == {memory_directory: len("content")}
+        assert placement.reserved_bytes() == {memory_directory: 0}
+
+
+def test_temp_placement_policy__released_without_cleanup():
+    with mut.create_temp_directory("memory") as memory_directory:
+        placement = mut.TempPlacementPolicy(memory_directory=memory_directory)
+        with mut.create_temp_file("kept", cleanup=False, size_hint=100, placement=placement) as kept_file:
+            assert placement.reserved_bytes() == {memory_directory: 100}
+        try:
+            assert placement.reserved_bytes() == {memory_directory: 0}
+        finally:
+            kept_file.unlink()
+            mut.temp_space_registry._unregister(kept_file)
+
+
+def test_create_temp_directory__background_cleanup():
+    with mut.create_temp_directory("some_temporary_directory", cleanup=mut.BACKGROUND_CLEANUP) as tmp_directory:
+        tmp_directory.joinpath("sub_dir").mkdir()
+        tmp_directory.joinpath("sub_dir", "some_file").touch()
+    assert not tmp_directory.exists()
+    assert mut.flush_background_cleanup(timeout=10)
+    trash_directory = mut._background_cleaner.trash_directory(tmp_directory.parent)
+    assert not trash_directory.exists() \
+        or not any(entry.name.endswith(tmp_directory.name) for entry in trash_directory.iterdir())
+
+
+def test_background_cleanup__sweeps_orphans_of_dead_processes():
+    with mut.create_temp_directory("base") as base_directory:
+        trash_directory = mut._background_cleaner.trash_directory(base_directory)
+        orphan = trash_directory.joinpath("999999999_0_orphan")
+        orphan.joinpath("sub_dir").mkdir(parents=True)
+        temp_directory = base_directory.joinpath("temp")
+        temp_directory.mkdir()
+
+        mut._background_cleaner.remove(temp_directory)
+
+        assert mut.flush_background_cleanup(timeout=10)
+        assert not trash_directory.exists()
+
+
+def test_background_cleanup__trash_directory_is_private():
+    with mut.create_temp_directory("base") as base_directory:
+        trash_directory = mut._background_cleaner.trash_directory(base_directory)
+        trash_directory.mkdir()
+        trash_directory.chmod(0o777)
+
+        mut._create_private_directory(trash_directory)
+
+        assert stat.S_IMODE(trash_directory.lstat().st_mode) == 0o700
+
+
+def test_background_cleanup__removes_synchronously_if_trash_directory_is_a_symlink():
+    with mut.create_temp_directory("base") as base_directory:
+        foreign_directory = base_directory.joinpath("foreign")
+        foreign_directory.mkdir()
+        os.symlink(str(foreign_directory), str(mut._background_cleaner.trash_directory(base_directory)))
+        temp_directory = base_directory.joinpath("temp")
+        temp_directory.joinpath("sub_dir").mkdir(parents=True)
+
+        mut._background_cleaner.remove(temp_directory)
+
+        assert not temp_directory.exists()
+        assert list(foreign_directory.iterdir()) == []
+
+
+@fixture
+def registry(monkeypatch):
+    """Registry only tracking the paths of the test, so quotas and evictions do not affect other tests"""
+    isolated_registry = mut.TempSpaceRegistry()
+    monkeypatch.setattr(mut, "temp_space_registry", isolated_registry)
+    return isolated_registry
+
+
+def test_temp_space_registry(registry: mut.TempSpaceRegistry):
+    with mut.create_temp_directory("some_temporary_directory") as tmp_directory:
+        tracked = {entry.path: entry for entry in registry.entries()}
+        assert tracked[tmp_directory].is_directory
+        assert not tracked[tmp_directory].released
+    assert registry.entries() == []
+
+    with mut.create_temp_file("some_temporary_file", cleanup=False) as leaked_file:
+        leaked_file.write_bytes(b"x" * 100)
+    try:
+        tracked = {entry.path: entry for entry in registry.entries()}
+        assert tracked[leaked_file].released
+        assert tracked[leaked_file].size() == leaked_file.stat().st_blocks * 512
+        assert registry.metrics()["temp_paths_released"] == 1
+        assert registry.metrics(include_sizes=True)["temp_paths_bytes"] == leaked_file.stat().st_blocks * 512
+    finally:
+        leaked_file.unlink()
+
+
+def test_temp_space_registry__pooled_directories_are_tracked(registry: mut.TempSpaceRegistry):
+    with mut.TempDirectoryPool(size=1) as pool:
+        with pool.create_temp_directory("pooled") as tmp_directory:
+            assert [entry.path for entry in registry.entries()] == [tmp_directory]
+        assert registry.entries() == []
+
+
+def test_temp_space_registry__quota(registry: mut.TempSpaceRegistry):
+    with mut.create_temp_file("some_temporary_file", cleanup=False) as leaked_file:
+        leaked_file.write_bytes(b"x" * 10000)
+    try:
+        registry.set_quota(registry.total_size() + 500, size_max_age=0)
+        with raises(mut.TempSpaceQuotaExceeded):
+            with mut.create_temp_file("rejected_file", size_hint=600):
+                pass
+        assert leaked_file.exists()
+        assert [entry.path for entry in registry.entries()] == [leaked_file]
+
+        registry.set_quota(registry.total_size() + 500, evict_released=True, size_max_age=0)
+        with mut.create_temp_file("some_temporary_file", size_hint=600) as tmp_file:
+            assert tmp_file.is_file()
+        assert not leaked_file.exists()
+    finally:
+        if leaked_file.exists():
+            leaked_file.unlink()
+
+
+def test_temp_space_registry__size_hints_of_tracked_paths_count(registry: mut.TempSpaceRegistry):
+    with mut.create_temp_directory("base") as base_directory:
+        placement = mut.TempPlacementPolicy(memory_directory=base_directory.joinpath("missing"),
+                                            disk_directory=base_directory)
+        registry.set_quota(registry.total_size() + 1000, size_max_age=0)
+        with mut.create_temp_directory("first", size_hint=600, placement=placement) as first_directory:
+            with raises(mut.TempSpaceQuotaExceeded):
+                with mut.create_temp_directory("second", size_hint=600, placement=placement):
+                    pass
+            assert [entry.path for entry in registry.entries()] == [base_directory, first_directory]
+            assert list(base_directory.iterdir()) == [first_directory]
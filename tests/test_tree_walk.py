@@ -0,0 +1,56 @@
+import os
+from pathlib import Path
+from typing import List
+
+from pytest import fixture, raises
+
+import tjpy_file_util.tree_walk as mut
+from tjpy_file_util.code_file_trees import create_file_tree
+from tjpy_file_util.temporary import create_temp_directory
+
+
+@fixture
+def base_dir():
+    with create_temp_directory("tree_walk") as base_dir:
+        create_file_tree(base_dir, {
+            "a": {"b": {"c": []}, "d": []},
+            "e": ["f.txt"],
+        })
+        yield base_dir
+
+
+def _list_subdirectories(directory: mut.WalkedDirectory) -> List[str]:
+    with os.scandir(directory.fd if directory.fd is not None else directory.path) as entries:
+        return sorted(entry.name for entry in entries if entry.is_dir(follow_symlinks=False))
+
+
+def test_walk_directories__subdirectories_are_finished_first(base_dir: Path):
+    for max_workers in (1, 4):
+        finished: List[str] = []
+
+        def finish(directory: mut.WalkedDirectory):
+            assert directory.parent is None or directory.parent.fd is not None or not mut.DIR_FD_SUPPORTED
+            finished.append(directory.relative_path)
+
+        mut.walk_directories(str(base_dir), _list_subdirectories, finish, max_workers=max_workers)
+
+        assert sorted(finished) == ["", "a", "a/b", "a/b/c", "a/d", "e"]
+        assert finished.index("a/b/c") < finished.index("a/b") < finished.index("a") < finished.index("")
+
+
+def test_walk_directories__stops_at_first_error_and_closes_descriptors(base_dir: Path):
+    descriptors_before = len(os.listdir("/proc/self/fd"))
+    visited: List[str] = []
+
+    def visit(directory: mut.WalkedDirectory) -> List[str]:
+        visited.append(directory.relative_path)
+        if directory.relative_path == "a/b":
+            raise ValueError("failed")
+        return _list_subdirectories(directory)
+
+    for max_workers in (1, 4):
+        with raises(ValueError):
+            mut.walk_directories(str(base_dir), visit, max_workers=max_workers)
+
+    assert "a/b/c" not in visited
+    assert len(os.listdir("/proc/self/fd")) == descriptors_before
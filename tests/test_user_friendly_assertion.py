@@ -1,5 +1,10 @@
+import os
+
+from pytest import raises
+
 import tjpy_file_util.user_friendly_assertion as mut
-from tjpy_file_util.temporary import create_temp_file
+from tjpy_file_util.instrumentation import instrumentation
+from tjpy_file_util.temporary import create_temp_file, create_temp_directory
 
 
 def test_assert_path_exists__success():
@@ -10,3 +15,76 @@ def test_assert_path_exists__success():
 def assert_path_is_file__success():
     with create_temp_file("some_file") as tmp_file:
         mut.assert_path_is_file(tmp_file)
+
+
+def test_assert_paths_are_files__success():
+    with create_temp_directory("some_directory") as directory:
+        files = [directory.joinpath(f"file_{index}") for index in range(20)]
+        for file in files:
+            file.touch()
+        mut.assert_paths_are_files(files)
+        mut.assert_paths_exist(files + [directory])
+        mut.assert_paths_are_directories([directory])
+
+
+def test_assert_paths_are_files__all_failures_are_reported():
+    with create_temp_directory("some_directory") as directory:
+        files = [directory.joinpath(f"file_{index}") for index in range(20)]
+        for file in files[2:]:
+            file.touch()
+        directory.joinpath("sub_dir").mkdir()
+        checked = files + [directory.joinpath("sub_dir"), directory.joinpath("missing", "file")]
+
+        with raises(mut.PathAssertionError) as exception_info:
+            mut.assert_paths_are_files(checked, max_workers=2)
+
+        assert exception_info.value.failures == [
+            (files[0], "does not exist"),
+            (files[1], "does not exist"),
+            (directory.joinpath("sub_dir"), "exists but must be a file"),
+            (directory.joinpath("missing", "file"), "does not exist"),
+        ]
+        assert isinstance(exception_info.value, FileNotFoundError)
+
+
+def test_assert_paths_are_directories__few_paths():
+    with create_temp_file("some_file") as tmp_file:
+        with raises(mut.PathAssertionError) as exception_info:
+            mut.assert_paths_are_directories([tmp_file])
+        assert exception_info.value.failures == [(tmp_file, "exists but must be a directory")]
+
+
+def test_assert_paths__result_does_not_depend_on_the_group_size():
+    with create_temp_directory("some_directory") as directory:
+        directory.joinpath("file").touch()
+        sub_dir = directory.joinpath("sub_dir")
+        sub_dir.mkdir()
+        os.symlink(str(sub_dir.joinpath("missing")), str(sub_dir.joinpath("dangling_link")))
+        os.symlink(str(directory.joinpath("file")), str(sub_dir.joinpath("file_link")))
+        for paths_in_group in (3, 11):
+            fillers = [sub_dir.joinpath(f"filler_{index}") for index in range(paths_in_group - 3)]
+            for filler in fillers:
+                filler.touch()
+
+            with raises(mut.PathAssertionError) as exception_info:
+                mut.assert_paths_are_files(fillers + [
+                    sub_dir.joinpath("dangling_link"),
+                    sub_dir.joinpath("file_link"),
+                    sub_dir.joinpath(".."),
+                ])
+            assert exception_info.value.failures == [
+                (sub_dir.joinpath("dangling_link"), "does not exist"),
+                (sub_dir.joinpath(".."), "exists but must be a file"),
+            ]
+
+
+def test_assert_paths_are_files__directory_reads_are_instrumented():
+    with create_temp_directory("some_directory") as directory:
+        files = [directory.joinpath(f"file_{index}") for index in range(20)]
+        for file in files:
+            file.touch()
+
+        with instrumentation() as metrics:
+            mut.assert_paths_are_files(files)
+
+        assert metrics.operations["list"].count == 1
@@ -0,0 +1,220 @@
+"""
+Command line interface (tjpy-file-util).
+Modules are imported within the subcommands, so starting the CLI only costs what the subcommand needs.
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence
+
+_OVERWRITE_MODES = ("none", "files", "all")
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    arguments = _create_parser().parse_args(argv)
+    if arguments.command is None:
+        _create_parser().print_help(sys.stderr)
+        return 2
+    started = time.perf_counter()
+    if not arguments.stats:
+        return arguments.function(arguments)
+    from tjpy_file_util.instrumentation import instrumentation
+    with instrumentation() as metrics:
+        exit_code = arguments.function(arguments)
+    seconds = max(time.perf_counter() - started, 1e-9)
+    _print_operation_stats(metrics.to_dict(), seconds)
+    if arguments.command == "copy" and exit_code == 0:
+        size = metrics.copied_bytes
+        print(f"copied {size / 2 ** 20:.1f} MiB in {seconds:.3f}s ({size / 2 ** 20 / seconds:.1f} MiB/s)",
+              file=sys.stderr)
+    return exit_code
+
+
+def _create_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="tjpy-file-util", description="Utilities related to files")
+    subparsers = parser.add_subparsers(dest="command", metavar="command")
+
+    def add_common_arguments(subparser: argparse.ArgumentParser):
+        subparser.add_argument("-j", "--workers", type=_positive_int, default=1,
+                               help="amount of worker threads (default: 1)")
+        subparser.add_argument("--stats", action="store_true",
+                               help="print a summary of the filesystem operations and the throughput to stderr")
+
+    copy_parser = subparsers.add_parser("copy", help="copy a file or directory tree")
+    copy_parser.add_argument("source", type=Path)
+    copy_parser.add_argument("target", type=Path)
+    copy_parser.add_argument("--children", action="store_true",
+                             help="copy the children of the source directory into the existing target directory")
+    copy_parser.add_argument("--no-merge", action="store_true",
+                             help="fail instead of merging into existing directories")
+    copy_parser.add_argument("--overwrite", choices=_OVERWRITE_MODES, default="none",
+                             help="existing targets to replace: none (fail on conflicts, default), files, "
+                                  "all (also directories conflicting with a file or not merged)")
+    compression_group = copy_parser.add_mutually_exclusive_group()
+    compression_group.add_argument("--compress", metavar="CODEC", help="compress every file (gzip, bz2, lzma, zstd)")
+    compression_group.add_argument("--decompress", metavar="CODEC", help="decompress every file with the suffix")
+    add_common_arguments(copy_parser)
+    copy_parser.set_defaults(function=_copy_command)
+
+    tree_parser = subparsers.add_parser("tree", help="list a directory tree, optionally with disk usage")
+    tree_parser.add_argument("directory", type=Path)
+    tree_parser.add_argument("-g", "--glob", help="only list paths matching the glob (e.g. '**/*.py')")
+    tree_parser.add_argument("--du", action="store_true",
+                             help="print file count and size of every directory instead of the paths")
+    add_common_arguments(tree_parser)
+    tree_parser.set_defaults(function=_tree_command)
+
+    diff_parser = subparsers.add_parser("diff", help="compare two directory trees (exit code 1 if they differ)")
+    diff_parser.add_argument("left", type=Path)
+    diff_parser.add_argument("right", type=Path)
+    diff_parser.add_argument("-g", "--glob", help="only compare paths matching the glob")
+    diff_parser.add_argument("--content", action="store_true", help="also compare the content of files")
+    add_common_arguments(diff_parser)
+    diff_parser.set_defaults(function=_diff_command)
+
+    remove_parser = subparsers.add_parser("rm", help="remove files and directory trees")
+    remove_parser.add_argument("paths", type=Path, nargs="+")
+    remove_parser.add_argument("--keep-root", action="store_true", help="only remove the content of directories")
+    remove_parser.add_argument("-f", "--force", action="store_true", help="ignore paths which do not exist")
+    add_common_arguments(remove_parser)
+    remove_parser.set_defaults(function=_remove_command)
+    return parser
+
+
+def _positive_int(value: str) -> int:
+    try:
+        number = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid int value: '{value}'")
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1: '{value}'")
+    return number
+
+
+def _copy_command(arguments: argparse.Namespace) -> int:
+    from tjpy_file_util.copy import CopyException, copy, copy_children
+    from tjpy_file_util.compression import Compression, CompressionMode
+    compression = None
+    if arguments.compress is not None:
+        compression = Compression(arguments.compress)
+    elif arguments.decompress is not None:
+        compression = Compression(arguments.decompress, mode=CompressionMode.decompress)
+    options: Dict[str, Any] = dict(
+        merge_directories=not arguments.no_merge,
+        overwrite_files=arguments.overwrite in ("files", "all"),
+        overwrite_directories=arguments.overwrite == "all",
+        max_workers=arguments.workers,
+        compression=compression,
+    )
+    try:
+        if arguments.children:
+            copy_children(arguments.source, arguments.target, **options)
+        else:
+            copy(arguments.source, arguments.target, **options)
+    except (CopyException, ValueError, OSError) as ex:
+        print(f"tjpy-file-util copy: {ex}", file=sys.stderr)
+        return 1
+    return 0
+
+
+def _tree_command(arguments: argparse.Namespace) -> int:
+    from tjpy_file_util.code_file_trees import scan_file_tree
+    if not arguments.directory.is_dir():
+        print(f"tjpy-file-util tree: '{arguments.directory}' is no directory", file=sys.stderr)
+        return 1
+    scan = scan_file_tree(arguments.directory, max_workers=arguments.workers)
+    if arguments.du:
+        for directory, statistics in sorted(scan.statistics.items()):
+            print(f"{statistics.apparent_size}\t{statistics.file_count}\t{directory}")
+        return 0
+    for path in _select_paths(scan.hierarchy, arguments.glob):
+        print(path)
+    return 0
+
+
+def _diff_command(arguments: argparse.Namespace) -> int:
+    import filecmp
+    from tjpy_file_util.code_file_trees import FilesystemItemType, scan_file_tree
+    for directory in (arguments.left, arguments.right):
+        if not directory.is_dir():
+            print(f"tjpy-file-util diff: '{directory}' is no directory", file=sys.stderr)
+            return 2
+    left_hierarchy = scan_file_tree(arguments.left, max_workers=arguments.workers).hierarchy
+    right_hierarchy = scan_file_tree(arguments.right, max_workers=arguments.workers).hierarchy
+    left = _flatten(left_hierarchy)
+    right = _flatten(right_hierarchy)
+    if arguments.glob is not None:
+        selected = set(_select_paths(left_hierarchy, arguments.glob)) \
+            | set(_select_paths(right_hierarchy, arguments.glob))
+        left = {path: item_type for path, item_type in left.items() if path in selected}
+        right = {path: item_type for path, item_type in right.items() if path in selected}
+    differences = 0
+    for path in sorted(set(left) | set(right)):
+        if path not in right:
+            print(f"- {path}")
+        elif path not in left:
+            print(f"+ {path}")
+        elif left[path] != right[path]:
+            print(f"! {path} ({left[path].name} / {right[path].name})")
+        elif arguments.content and left[path] == FilesystemItemType.file \
+                and not filecmp.cmp(str(arguments.left / path), str(arguments.right / path), shallow=False):
+            print(f"M {path}")
+        else:
+            continue
+        differences += 1
+    return 1 if differences else 0
+
+
+def _remove_command(arguments: argparse.Namespace) -> int:
+    from tjpy_file_util.remove import remove_tree
+    exit_code = 0
+    for path in arguments.paths:
+        try:
+            remove_tree(path, max_workers=arguments.workers, keep_root=arguments.keep_root)
+        except FileNotFoundError:
+            if not arguments.force:
+                print(f"tjpy-file-util rm: '{path}' does not exist", file=sys.stderr)
+                exit_code = 1
+        except OSError as ex:
+            print(f"tjpy-file-util rm: {ex}", file=sys.stderr)
+            exit_code = 1
+    return exit_code
+
+
+def _flatten(hierarchy: Dict[str, Any]) -> Dict[str, Any]:
+    """:return: item type by relative posix path"""
+    from tjpy_file_util.code_file_trees import FilesystemItemType
+    items: Dict[str, Any] = dict()
+    stack = [("", hierarchy)]
+    while stack:
+        prefix, node = stack.pop()
+        for name, value in node.items():
+            if isinstance(value, dict):
+                items[prefix + name] = FilesystemItemType.directory
+                stack.append((prefix + name + "/", value))
+            else:
+                items[prefix + name] = value
+    return items
+
+
+def _select_paths(hierarchy: Dict[str, Any], glob: Optional[str]) -> List[str]:
+    if glob is None:
+        return sorted(_flatten(hierarchy))
+    from tjpy_file_util.file_tree_index import FileTreeIndex
+    return sorted(str(path) for path in FileTreeIndex(hierarchy).glob(glob))
+
+
+def _print_operation_stats(metrics: Dict[str, Any], seconds: float):
+    files = sum(metrics["operations"].get(operation, {"count": 0})["count"]
+                for operation in ("copy", "compress", "decompress"))
+    print(f"finished in {seconds:.3f}s", file=sys.stderr)
+    if files and seconds > 0:
+        print(f"{files / seconds:.1f} files/s", file=sys.stderr)
+    for operation, operation_metrics in metrics["operations"].items():
+        print(f"{operation:>12}: {operation_metrics['count']:>8} calls, {operation_metrics['seconds']:.3f}s",
+              file=sys.stderr)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
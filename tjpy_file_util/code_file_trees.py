@@ -1,7 +1,22 @@
+import ctypes
+import ctypes.util
+import functools
+import heapq
 import logging
+import os
+import queue
+import select
+import stat
+import struct
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from enum import unique, Enum
-from pathlib import Path
-from typing import Dict, Union, List, Tuple, cast, Any
+from pathlib import Path, PurePosixPath
+from typing import Dict, Union, List, Tuple, cast, Any, Optional, Set, NamedTuple
+
+from tjpy_file_util.instrumentation import api_call, fs
+from tjpy_file_util.io_scheduler import IoScheduler, IoTask
+from tjpy_file_util.stat_cache import cached_stat, invalidate, path_is_dir
 
 _logger = logging.getLogger(__name__)
 
@@ -27,6 +42,7 @@ StrictDictFileHierarchy = Dict[str, _StrictDictFileHierarchyItemValue]
 FileHierarchy = Union[DictFileHierarchy, ListFileHierarchy]  # unable to add StrictDictFileHierarchy cos of mypy bug
 
 
+@api_call
 def create_file_tree(directory: Path, hierarchy: FileHierarchy) -> StrictDictFileHierarchy:
     """
     Creates a file hierarchy in the specified directory.
@@ -55,7 +71,7 @@ def create_file_tree(directory: Path, hierarchy: FileHierarchy) -> StrictDictFil
     :param hierarchy: directories and files
     :return:
     """
-    assert directory.is_dir()
+    assert path_is_dir(directory)
     dict_hierarchy = unify(hierarchy)
     _create_file_tree(directory, dict_hierarchy)
     return dict_hierarchy
@@ -65,73 +81,575 @@ def _create_file_tree(directory: Path, dict_hierarchy: StrictDictFileHierarchy):
     for key, value in dict_hierarchy.items():
         sub_item = directory.joinpath(key)
         if isinstance(value, dict):
-            sub_item.mkdir(exist_ok=False)
+            fs.mkdir(str(sub_item))
+            invalidate(sub_item)
             _create_file_tree(sub_item, cast(StrictDictFileHierarchy, value))
         elif isinstance(value, FilesystemItemType):
             if value == FilesystemItemType.file:
-                sub_item.touch(exist_ok=False)
+                os.close(fs.open(str(sub_item), os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666))
             elif value == FilesystemItemType.directory:
-                sub_item.mkdir(exist_ok=False)
+                fs.mkdir(str(sub_item))
+            invalidate(sub_item)
         else:
             raise Exception(f"invalid value for item with key '{key}': '{value}'")
 
 
-def unify(hierarchy: FileHierarchy) -> StrictDictFileHierarchy:
-    if isinstance(hierarchy, list):
-        return _convert_to_strict_dict_hierarchy(cast(ListFileHierarchy, hierarchy))
-    else:
-        dict_hierarchy = cast(DictFileHierarchy, hierarchy)
-        corrected_dict_hierarchy: StrictDictFileHierarchy = dict()
-        for key, value in dict_hierarchy.items():
-            corrected_value: _StrictDictFileHierarchyItemValue
-            if isinstance(value, list):
-                corrected_value = _convert_to_strict_dict_hierarchy(cast(ListFileHierarchy, value))
-            elif isinstance(value, dict):
-                corrected_value = unify(cast(DictFileHierarchy, value))
-            elif value is None:
-                corrected_value = FilesystemItemType.file
-            elif isinstance(value, FilesystemItemType):
-                if value == FilesystemItemType.file:
-                    corrected_value = FilesystemItemType.file
-                elif value == FilesystemItemType.directory:
-                    corrected_value = dict()
-                else:
-                    raise Exception(f"invalid value for item with key '{key}': '{value}'")
+class FileHierarchyException(Exception):
+
+    def __init__(self, errors: List[str]):
+        super().__init__("invalid file hierarchy:\n" + "\n".join(errors))
+        self.errors = errors
+
+
+def unify(hierarchy: FileHierarchy,
+          *,
+          in_place: bool = False,
+          share_strict_subtrees: bool = False) -> StrictDictFileHierarchy:
+    """
+    Converts any supported hierarchy style (see create_file_tree) to a strict dict hierarchy.
+    The hierarchy is validated and converted in a single iterative pass, so arbitrarily deep hierarchies are supported.
+    All validation errors are collected and raised together as FileHierarchyException, each with its full path.
+    :param hierarchy: hierarchy to convert
+    :param in_place: modify the dicts of the hierarchy instead of copying them (lists are always replaced by dicts)
+    :param share_strict_subtrees: return already strict dicts as they are instead of copying them.
+        The result may then share dicts with the passed hierarchy and should be treated as read-only.
+    :return: strict dict hierarchy
+    """
+    errors: List[str] = []
+    stack = [_UnifyFrame(hierarchy, "", "", in_place, share_strict_subtrees, errors)]
+    result: Optional[StrictDictFileHierarchy] = None
+    while stack:
+        frame = stack[-1]
+        if frame.index == len(frame.entries):
+            stack.pop()
+            if stack:
+                stack[-1].set(frame.name, frame.result(), frame.changed)
             else:
-                raise Exception(f"invalid value for item with key '{key}': '{value}'")
-            corrected_dict_hierarchy[key] = corrected_value
-        return corrected_dict_hierarchy
+                result = frame.result()
+            continue
+        name, value = frame.entries[frame.index]
+        frame.index += 1
+        path = frame.path + "/" + name if frame.path else name
+        if isinstance(value, (dict, list)):
+            stack.append(_UnifyFrame(value, name, path, in_place, share_strict_subtrees, errors))
+        elif value is FilesystemItemType.file or value is None:
+            frame.set(name, FilesystemItemType.file, value is None)
+        elif value is FilesystemItemType.directory:
+            frame.set(name, dict(), True)
+        else:
+            errors.append(f"invalid value for item '{path}': '{value}'")
+    if errors:
+        raise FileHierarchyException(errors)
+    assert result is not None
+    return result
 
 
-def _convert_to_strict_dict_hierarchy(list_hierarchy: ListFileHierarchy) -> StrictDictFileHierarchy:
-    dict_hierarchy: StrictDictFileHierarchy = dict()
+class _UnifyFrame:
+    """State of a single (dict or list) node while it is being unified"""
+    __slots__ = ("source", "name", "path", "entries", "index", "target", "changed")
+
+    def __init__(self, source: Union[Dict[Any, Any], List[Any]], name: str, path: str,
+                 in_place: bool, share_strict_subtrees: bool, errors: List[str]):
+        self.source = source
+        self.name = name
+        self.path = path
+        self.index = 0
+        self.target: Optional[StrictDictFileHierarchy]
+        self.entries: List[Tuple[str, Any]]
+        if isinstance(source, list):
+            self.entries = _list_hierarchy_entries(source, path, errors)
+            self.target = dict()
+            self.changed = True
+        else:
+            self.entries = list(source.items())
+            if not all(isinstance(key, str) for key, _ in self.entries):
+                errors.extend(f"invalid name '{key}' in '{path}'"
+                              for key, _ in self.entries if not isinstance(key, str))
+                self.entries = [(key, value) for key, value in self.entries if isinstance(key, str)]
+            if in_place:
+                self.target = cast(StrictDictFileHierarchy, source)
+            elif share_strict_subtrees:
+                self.target = None  # only created once the first item differs from the source
+            else:
+                self.target = dict()
+            self.changed = False
+
+    def set(self, name: str, value: _StrictDictFileHierarchyItemValue, changed: bool):
+        if changed and not self.changed:
+            self.changed = True
+            if self.target is None:
+                # all previous entries are strict already
+                self.target = dict(self.entries[:self.index - 1])
+        if self.target is not None:
+            self.target[name] = value
+
+    def result(self) -> StrictDictFileHierarchy:
+        return self.target if self.target is not None else cast(StrictDictFileHierarchy, self.source)
+
+
+def _list_hierarchy_entries(list_hierarchy: List[Any], path: str, errors: List[str]) -> List[Tuple[str, Any]]:
+    entries: List[Tuple[str, Any]] = []
+    names: Set[str] = set()
     for item in list_hierarchy:
         if isinstance(item, str):
-            file_name = item
-            if dict_hierarchy.get(file_name) is not None:
-                raise Exception(f"duplicate items found with name {file_name}")
-            dict_hierarchy[file_name] = FilesystemItemType.file
-        elif isinstance(item, tuple):
-            item_name = item[0]
-            item_content: Union[DictFileHierarchy, FilesystemItemType] = item[1]
-            if isinstance(item_content, dict):
-                dict_hierarchy[item_name] = unify(cast(DictFileHierarchy, item_content))
-            elif isinstance(item_content, FilesystemItemType):
-                dict_hierarchy[item_name] = item_content
-            else:
-                raise Exception(f"unknown item content {item_content}")
-    return dict_hierarchy
+            name, value = item, FilesystemItemType.file
+        elif isinstance(item, tuple) and len(item) == 2 and isinstance(item[0], str):
+            name, value = item
+        else:
+            errors.append(f"invalid item in '{path}': '{item}'")
+            continue
+        if name in names:
+            errors.append(f"duplicate items found with name '{path + '/' + name if path else name}'")
+            continue
+        names.add(name)
+        entries.append((name, value))
+    return entries
 
 
+@api_call
 def read_children_as_file_tree(directory: Path) -> StrictDictFileHierarchy:
-    assert directory.is_dir()
+    assert path_is_dir(directory)
+    return _read_children_as_file_tree(directory)
+
+
+def _read_children_as_file_tree(directory: Path) -> StrictDictFileHierarchy:
     dict_hierarchy: StrictDictFileHierarchy = dict()
-    for item in directory.iterdir():
-        if item.is_file():
-            dict_hierarchy[item.name] = FilesystemItemType.file
-        elif item.is_dir():
-            dict_hierarchy[item.name] = read_children_as_file_tree(item)
+    for name in fs.listdir(str(directory)):
+        item = directory.joinpath(name)
+        item_stat = cached_stat(item)
+        if item_stat is not None and stat.S_ISREG(item_stat.st_mode):
+            dict_hierarchy[name] = FilesystemItemType.file
+        elif item_stat is not None and stat.S_ISDIR(item_stat.st_mode):
+            dict_hierarchy[name] = _read_children_as_file_tree(item)
         else:
-            _logger.debug(f"{read_children_as_file_tree.__name__}: Ignoring {item} because it is "
-                          f"neither a file nor a directory")
+            _logger.debug("%s: Ignoring %s because it is neither a file nor a directory",
+                          read_children_as_file_tree.__name__, item)
     return dict_hierarchy
+
+
+class DirectoryStatistics:
+    """
+    Aggregated statistics of a directory including all of its descendants.
+    Sizes of hardlinked files are only counted once per scan (de-duplicated by device and inode).
+    """
+
+    def __init__(self):
+        self.file_count = 0
+        self.directory_count = 0
+        self.apparent_size = 0
+        self.allocated_size = 0
+        self.newest_mtime: Optional[float] = None
+        self._largest_files: List[Tuple[int, PurePosixPath]] = []  # min-heap
+
+    def _add_file(self, path: PurePosixPath, stat_result: os.stat_result, count_size: bool,
+                  largest_files_count: int):
+        self.file_count += 1
+        if count_size:
+            self.apparent_size += stat_result.st_size
+            self.allocated_size += getattr(stat_result, "st_blocks", 0) * 512
+        if self.newest_mtime is None or stat_result.st_mtime > self.newest_mtime:
+            self.newest_mtime = stat_result.st_mtime
+        if largest_files_count > 0:
+            if len(self._largest_files) < largest_files_count:
+                heapq.heappush(self._largest_files, (stat_result.st_size, path))
+            else:
+                heapq.heappushpop(self._largest_files, (stat_result.st_size, path))
+
+    def _add_subdirectory(self, other: 'DirectoryStatistics', largest_files_count: int):
+        self.file_count += other.file_count
+        self.directory_count += other.directory_count + 1
+        self.apparent_size += other.apparent_size
+        self.allocated_size += other.allocated_size
+        if other.newest_mtime is not None and (self.newest_mtime is None or other.newest_mtime > self.newest_mtime):
+            self.newest_mtime = other.newest_mtime
+        self._largest_files = _merge_largest_files(self._largest_files, other._largest_files, largest_files_count)
+
+    @property
+    def largest_files(self) -> List[Tuple[int, PurePosixPath]]:
+        """(size, path) of the largest files, sorted by size in descending order"""
+        return sorted(self._largest_files, reverse=True)
+
+    def __repr__(self):
+        return (f"DirectoryStatistics(file_count={self.file_count}, directory_count={self.directory_count}, "
+                f"apparent_size={self.apparent_size}, allocated_size={self.allocated_size}, "
+                f"newest_mtime={self.newest_mtime})")
+
+
+class FileTreeScan(NamedTuple):
+    hierarchy: StrictDictFileHierarchy
+    # keys are paths relative to the scanned directory, the scanned directory itself is PurePosixPath(".")
+    statistics: Dict[PurePosixPath, DirectoryStatistics]
+
+
+@api_call
+def scan_file_tree(directory: Path,
+                   *,
+                   max_workers: int = 1,
+                   largest_files_count: int = 10,
+                   scheduler: Optional[IoScheduler] = None) -> FileTreeScan:
+    """
+    Reads the children of the directory like read_children_as_file_tree but additionally gathers
+    du-style statistics per directory (file count, apparent and allocated size, newest mtime, largest files)
+    in the same scandir pass.
+    Like du, symlinks are not followed (neither symlinked files nor symlinked directories are part of the result).
+    :param directory: directory to scan
+    :param max_workers: subdirectories of the scanned directory are scanned in parallel if this is bigger than 1
+    :param largest_files_count: amount of largest files to keep per directory
+    :param scheduler: scans the subdirectories of the scanned directory with the scheduler instead
+        (limited per device, in inode order), overrides max_workers
+    :return: hierarchy and statistics of each directory
+    """
+    assert path_is_dir(directory)
+    scanner = _StatisticsScanner(largest_files_count)
+    root = PurePosixPath(".")
+    if max_workers <= 1 and scheduler is None:
+        hierarchy, root_statistics = scanner.scan(str(directory), root)
+    else:
+        hierarchy = dict()
+        root_statistics = DirectoryStatistics()
+        subdirectories: List[os.DirEntry] = []
+        with fs.scandir(str(directory)) as entries:
+            for entry in entries:
+                if entry.is_file(follow_symlinks=False):
+                    hierarchy[entry.name] = FilesystemItemType.file
+                    scanner.add_file(root_statistics, root / entry.name, entry.stat(follow_symlinks=False))
+                elif entry.is_dir(follow_symlinks=False):
+                    subdirectories.append(entry)
+                else:
+                    _log_ignored_entry(entry)
+        if scheduler is not None:
+            results = scheduler.run(
+                IoTask((entry.stat(follow_symlinks=False).st_dev,), entry.inode(),
+                       functools.partial(scanner.scan, entry.path, root / entry.name))
+                for entry in subdirectories)
+        else:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                futures = [executor.submit(scanner.scan, entry.path, root / entry.name) for entry in subdirectories]
+                results = [future.result() for future in futures]
+        for entry, (sub_hierarchy, sub_statistics) in zip(subdirectories, results):
+            hierarchy[entry.name] = sub_hierarchy
+            root_statistics._add_subdirectory(sub_statistics, largest_files_count)
+    scanner.statistics[root] = root_statistics
+    return FileTreeScan(hierarchy, scanner.statistics)
+
+
+class _StatisticsScanner:
+
+    def __init__(self, largest_files_count: int):
+        self.largest_files_count = largest_files_count
+        self.statistics: Dict[PurePosixPath, DirectoryStatistics] = dict()
+        self._seen_inodes: Set[Tuple[int, int]] = set()
+        self._seen_inodes_lock = threading.Lock()
+
+    def scan(self, path: str, relative_path: PurePosixPath) -> Tuple[StrictDictFileHierarchy, DirectoryStatistics]:
+        hierarchy: StrictDictFileHierarchy = dict()
+        statistics = DirectoryStatistics()
+        with fs.scandir(path) as entries:
+            for entry in entries:
+                if entry.is_file(follow_symlinks=False):
+                    hierarchy[entry.name] = FilesystemItemType.file
+                    self.add_file(statistics, relative_path / entry.name, entry.stat(follow_symlinks=False))
+                elif entry.is_dir(follow_symlinks=False):
+                    child_relative_path = relative_path / entry.name
+                    hierarchy[entry.name], child_statistics = self.scan(entry.path, child_relative_path)
+                    statistics._add_subdirectory(child_statistics, self.largest_files_count)
+                else:
+                    _log_ignored_entry(entry)
+        if relative_path != PurePosixPath("."):
+            self.statistics[relative_path] = statistics
+        return hierarchy, statistics
+
+    def add_file(self, statistics: DirectoryStatistics, relative_path: PurePosixPath, stat_result: os.stat_result):
+        count_size = True
+        if stat_result.st_nlink > 1:
+            key = (stat_result.st_dev, stat_result.st_ino)
+            with self._seen_inodes_lock:
+                count_size = key not in self._seen_inodes
+                self._seen_inodes.add(key)
+        statistics._add_file(relative_path, stat_result, count_size, self.largest_files_count)
+
+
+def _log_ignored_entry(entry: os.DirEntry):
+    _logger.debug("%s: Ignoring %s because it is neither a file nor a directory (symlinks are not followed)",
+                  scan_file_tree.__name__, entry.path)
+
+
+def _merge_largest_files(first: List[Tuple[int, PurePosixPath]],
+                         second: List[Tuple[int, PurePosixPath]],
+                         count: int) -> List[Tuple[int, PurePosixPath]]:
+    merged = heapq.nlargest(count, first + second)
+    heapq.heapify(merged)
+    return merged
+
+
+@unique
+class FileTreeChangeType(Enum):
+    created = 1
+    deleted = 2
+    modified = 3
+
+
+class FileTreeChange(NamedTuple):
+    change_type: FileTreeChangeType
+    # relative to the watched directory
+    path: PurePosixPath
+    item_type: FilesystemItemType
+
+
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_FROM = 0x00000040
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_DELETE = 0x00000200
+_IN_DELETE_SELF = 0x00000400
+_IN_MOVE_SELF = 0x00000800
+_IN_Q_OVERFLOW = 0x00004000
+_IN_IGNORED = 0x00008000
+_IN_ONLYDIR = 0x01000000
+_IN_DONT_FOLLOW = 0x02000000
+_IN_ISDIR = 0x40000000
+_IN_NONBLOCK = 0o4000
+_IN_CLOEXEC = 0o2000000
+_WATCH_MASK = (_IN_CLOSE_WRITE | _IN_MOVED_FROM | _IN_MOVED_TO | _IN_CREATE | _IN_DELETE
+               | _IN_DELETE_SELF | _IN_MOVE_SELF | _IN_ONLYDIR)
+_EVENT_HEADER = struct.Struct("iIII")
+
+
+class LiveFileTree:
+    """
+    File hierarchy of a directory (like read_children_as_file_tree) which is kept in sync using inotify (Linux only).
+    The directory is scanned once, afterwards only inotify events are applied to the in-memory hierarchy.
+    Symlinks are not followed and not part of the hierarchy (like in scan_file_tree).
+    If feed_changes is set, every applied change is also put into the `changes` queue, which must then be consumed.
+    If the kernel event queue overflows, the whole directory is rescanned and the differences are reported.
+    If the directory itself is deleted or moved, all items are reported as deleted and `valid` becomes False,
+    the tree is not updated anymore afterwards.
+    Events are either processed explicitly via process_events or by a background thread via start.
+    """
+
+    def __init__(self, directory: Path, feed_changes: bool = False):
+        assert path_is_dir(directory)
+        self.directory = directory
+        self.changes: Optional['queue.Queue[FileTreeChange]'] = queue.Queue() if feed_changes else None
+        self._lock = threading.RLock()
+        self._libc = _load_inotify_libc()
+        self._fd = self._libc.inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC)
+        if self._fd < 0:
+            _raise_errno("inotify_init1")
+        self._watch_paths: Dict[int, PurePosixPath] = dict()
+        self._hierarchy: StrictDictFileHierarchy = dict()
+        self._thread: Optional[threading.Thread] = None
+        self._stop_pipe: Optional[Tuple[int, int]] = None
+        self.valid = True
+        try:
+            self._rescan(PurePosixPath("."), report_changes=False)
+        except BaseException:
+            self.close()
+            raise
+
+    def __enter__(self) -> 'LiveFileTree':
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def snapshot(self) -> StrictDictFileHierarchy:
+        """Returns a copy of the current hierarchy"""
+        with self._lock:
+            return _copy_strict_hierarchy(self._hierarchy)
+
+    def process_events(self, timeout: Optional[float] = 0) -> List[FileTreeChange]:
+        """
+        Applies all pending inotify events and returns the resulting changes.
+        :param timeout: seconds to wait for the first event, None waits forever
+        """
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+        if not readable:
+            return []
+        return self._read_and_apply_events()
+
+    def start(self):
+        """Processes events in a background thread until close is called."""
+        assert self._thread is None
+        self._stop_pipe = os.pipe()
+        self._thread = threading.Thread(target=self._run, name=f"LiveFileTree({self.directory})", daemon=True)
+        self._thread.start()
+
+    def close(self):
+        if self._thread is not None and self._stop_pipe is not None:
+            os.write(self._stop_pipe[1], b"x")
+            self._thread.join()
+            for fd in self._stop_pipe:
+                os.close(fd)
+            self._thread = None
+            self._stop_pipe = None
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+    def _run(self):
+        assert self._stop_pipe is not None
+        while True:
+            readable, _, _ = select.select([self._fd, self._stop_pipe[0]], [], [])
+            if self._stop_pipe[0] in readable:
+                return
+            try:
+                self._read_and_apply_events()
+            except Exception:
+                _logger.exception("Failed to apply file system events of %s", self.directory)
+
+    def _read_and_apply_events(self) -> List[FileTreeChange]:
+        changes: List[FileTreeChange] = []
+        with self._lock:
+            while True:
+                try:
+                    buffer = os.read(self._fd, 64 * 1024)
+                except BlockingIOError:
+                    break
+                offset = 0
+                while offset < len(buffer):
+                    watch_descriptor, mask, _cookie, name_length = _EVENT_HEADER.unpack_from(buffer, offset)
+                    offset += _EVENT_HEADER.size
+                    name = os.fsdecode(buffer[offset:offset + name_length].rstrip(b"\0"))
+                    offset += name_length
+                    self._apply_event(watch_descriptor, mask, name, changes)
+        if self.changes is not None:
+            for change in changes:
+                self.changes.put(change)
+        return changes
+
+    def _apply_event(self, watch_descriptor: int, mask: int, name: str, changes: List[FileTreeChange]):
+        if mask & _IN_Q_OVERFLOW:
+            _logger.debug("inotify queue overflow for %s, rescanning", self.directory)
+            changes.extend(self._rescan(PurePosixPath(".")))
+            return
+        directory = self._watch_paths.get(watch_descriptor)
+        if mask & _IN_IGNORED:
+            self._watch_paths.pop(watch_descriptor, None)
+            return
+        if mask & (_IN_DELETE_SELF | _IN_MOVE_SELF) and directory == PurePosixPath("."):
+            self._invalidate(changes)
+            return
+        if directory is None or not name:
+            return  # event of a removed watch or of the watched directory itself
+        path = directory / name
+        parent = self._node(directory)
+        if parent is None:
+            return
+        item_type = FilesystemItemType.directory if mask & _IN_ISDIR else FilesystemItemType.file
+        if mask & (_IN_CREATE | _IN_MOVED_TO):
+            if item_type == FilesystemItemType.directory:
+                if not isinstance(parent.get(name), dict):
+                    parent[name] = dict()
+                    changes.append(FileTreeChange(FileTreeChangeType.created, path, item_type))
+                # items may have been created in the directory before the watch was added
+                changes.extend(self._rescan(path))
+            elif parent.get(name) is not FilesystemItemType.file \
+                    and _is_regular_file(os.path.join(str(self.directory), str(path))):
+                parent[name] = FilesystemItemType.file
+                changes.append(FileTreeChange(FileTreeChangeType.created, path, item_type))
+        elif mask & (_IN_DELETE | _IN_MOVED_FROM):
+            if parent.pop(name, None) is not None:
+                self._remove_watches_below(path)
+                changes.append(FileTreeChange(FileTreeChangeType.deleted, path, item_type))
+        elif mask & _IN_CLOSE_WRITE:
+            if parent.get(name) is FilesystemItemType.file:
+                changes.append(FileTreeChange(FileTreeChangeType.modified, path, item_type))
+
+    def _invalidate(self, changes: List[FileTreeChange]):
+        _logger.debug("%s was deleted or moved, it is not kept in sync anymore", self.directory)
+        for name, value in self._hierarchy.items():
+            changes.append(FileTreeChange(FileTreeChangeType.deleted, PurePosixPath(name),
+                                          FilesystemItemType.directory if isinstance(value, dict)
+                                          else FilesystemItemType.file))
+        self._hierarchy.clear()
+        self._remove_watches_below(PurePosixPath("."))
+        self.valid = False
+
+    def _rescan(self, relative_directory: PurePosixPath, report_changes: bool = True) -> List[FileTreeChange]:
+        """Rescans a directory (which must already be part of the hierarchy), adding missing watches"""
+        changes: List[FileTreeChange] = []
+        stack = [relative_directory]
+        while stack:
+            current = stack.pop()
+            node = self._node(current)
+            if node is None:
+                continue
+            self._add_watch(current)
+            try:
+                entries = list(os.scandir(os.path.join(str(self.directory), str(current))))
+            except FileNotFoundError:
+                continue  # removed in the meantime, the deletion event is still pending
+            actual_names = set()
+            for entry in entries:
+                actual_names.add(entry.name)
+                existing = node.get(entry.name)
+                if entry.is_dir(follow_symlinks=False):
+                    if not isinstance(existing, dict):
+                        node[entry.name] = dict()
+                        changes.append(FileTreeChange(FileTreeChangeType.created, current / entry.name,
+                                                      FilesystemItemType.directory))
+                    stack.append(current / entry.name)
+                elif entry.is_file(follow_symlinks=False):
+                    if existing is not FilesystemItemType.file:
+                        node[entry.name] = FilesystemItemType.file
+                        changes.append(FileTreeChange(FileTreeChangeType.created, current / entry.name,
+                                                      FilesystemItemType.file))
+            for name in [name for name in node if name not in actual_names]:
+                removed = node.pop(name)
+                self._remove_watches_below(current / name)
+                changes.append(FileTreeChange(FileTreeChangeType.deleted, current / name,
+                                              FilesystemItemType.directory if isinstance(removed, dict)
+                                              else FilesystemItemType.file))
+        return changes if report_changes else []
+
+    def _node(self, relative_directory: PurePosixPath) -> Optional[Dict[str, Any]]:
+        node: Any = self._hierarchy
+        for part in relative_directory.parts:
+            node = node.get(part)
+            if not isinstance(node, dict):
+                return None
+        return node
+
+    def _add_watch(self, relative_directory: PurePosixPath):
+        path = os.path.join(str(self.directory), str(relative_directory))
+        # the root may be a symlink, a subdirectory replaced by a symlink must not share the watch of its target
+        mask = _WATCH_MASK if relative_directory == PurePosixPath(".") else _WATCH_MASK | _IN_DONT_FOLLOW
+        watch_descriptor = self._libc.inotify_add_watch(self._fd, os.fsencode(path), mask)
+        if watch_descriptor < 0:
+            if ctypes.get_errno() in (2, 20):  # ENOENT, ENOTDIR: removed or replaced in the meantime
+                return
+            _raise_errno("inotify_add_watch")
+        self._watch_paths[watch_descriptor] = relative_directory
+
+    def _remove_watches_below(self, relative_path: PurePosixPath):
+        for watch_descriptor, path in list(self._watch_paths.items()):
+            if path == relative_path or relative_path in path.parents:
+                del self._watch_paths[watch_descriptor]
+                self._libc.inotify_rm_watch(self._fd, watch_descriptor)
+
+
+def _is_regular_file(path: str) -> bool:
+    try:
+        return stat.S_ISREG(os.lstat(path).st_mode)
+    except FileNotFoundError:
+        return False
+
+
+def _load_inotify_libc():
+    libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+    if not hasattr(libc, "inotify_init1"):
+        raise OSError("inotify is not available on this platform")
+    libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+    libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+    return libc
+
+
+def _raise_errno(function_name: str):
+    errno = ctypes.get_errno()
+    raise OSError(errno, f"{function_name} failed: {os.strerror(errno)}")
+
+
+def _copy_strict_hierarchy(hierarchy: StrictDictFileHierarchy) -> StrictDictFileHierarchy:
+    return {name: _copy_strict_hierarchy(cast(StrictDictFileHierarchy, value)) if isinstance(value, dict) else value
+            for name, value in hierarchy.items()}
@@ -0,0 +1,137 @@
+import bz2
+import lzma
+import os
+import zlib
+from enum import unique, Enum
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple, Type
+
+from tjpy_file_util.instrumentation import fs
+
+try:
+    import zstandard
+except ImportError:  # optional dependency (pip install tjpy_file_util[zstd])
+    zstandard = None  # type: ignore
+
+_CHUNK_SIZE = 1024 * 1024
+# raised by the decompressors for data which is corrupt or of another format (bz2 raises OSError)
+_DECOMPRESSION_ERRORS: Tuple[Type[BaseException], ...] = (zlib.error, lzma.LZMAError, OSError, EOFError)
+if zstandard is not None:
+    _DECOMPRESSION_ERRORS += (zstandard.ZstdError,)
+
+
+class InvalidCompressedData(Exception):
+    """The data to decompress is corrupt, truncated or not compressed with the codec"""
+
+
+@unique
+class CompressionMode(Enum):
+    compress = 1
+    decompress = 2
+
+
+class Compression(NamedTuple):
+    """Compression option for copy and copy_children, every copied file is (de)compressed while streaming"""
+    # name of the codec, see available_codecs
+    codec: str
+    mode: CompressionMode = CompressionMode.compress
+    # compression level of the codec, None for its default level
+    level: Optional[int] = None
+    # files are copied as they are (without suffix) if a sample of them compresses worse than this ratio,
+    # None to compress all files
+    incompressible_ratio: Optional[float] = 0.95
+    sample_size: int = 64 * 1024
+
+
+class Codec(NamedTuple):
+    name: str
+    # appended to the file name when compressing, removed when decompressing
+    suffix: str
+    default_level: int
+    # receives the level and returns an object with compress(data) and flush()
+    compressor: Callable[[int], Any]
+    # returns an object with decompress(data), eof and unused_data
+    decompressor: Callable[[], Any]
+
+
+_CODECS: Dict[str, Codec] = {
+    "gzip": Codec("gzip", ".gz", 6,
+                  lambda level: zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS),
+                  lambda: zlib.decompressobj(16 + zlib.MAX_WBITS)),
+    "bz2": Codec("bz2", ".bz2", 9, bz2.BZ2Compressor, bz2.BZ2Decompressor),
+    "lzma": Codec("lzma", ".xz", 6, lambda level: lzma.LZMACompressor(preset=level), lzma.LZMADecompressor),
+}
+if zstandard is not None:
+    _CODECS["zstd"] = Codec("zstd", ".zst", 3,
+                            lambda level: zstandard.ZstdCompressor(level=level).compressobj(),
+                            lambda: zstandard.ZstdDecompressor().decompressobj())
+
+
+def available_codecs() -> List[str]:
+    return sorted(_CODECS)
+
+
+def get_codec(name: str) -> Codec:
+    codec = _CODECS.get(name)
+    if codec is None:
+        if name == "zstd":
+            raise ValueError("the codec zstd requires the package zstandard")
+        raise ValueError(f"unknown codec '{name}', available codecs: {', '.join(available_codecs())}")
+    return codec
+
+
+def compress_file_content(source_fd: int, target_fd: int, codec: Codec, level: Optional[int] = None):
+    """Compresses the source file (from its current offset) into the target file chunk by chunk"""
+    compressor = codec.compressor(level if level is not None else codec.default_level)
+    chunk = os.read(source_fd, _CHUNK_SIZE)
+    while chunk:
+        _write_all(target_fd, compressor.compress(chunk))
+        chunk = os.read(source_fd, _CHUNK_SIZE)
+    _write_all(target_fd, compressor.flush())
+
+
+def decompress_file_content(source_fd: int, target_fd: int, codec: Codec):
+    """
+    Decompresses the source file (from its current offset) into the target file, supports multiple streams.
+    Raises InvalidCompressedData if the content is corrupt, truncated or not compressed with the codec.
+    """
+    decompressor = codec.decompressor()
+    chunk = os.read(source_fd, _CHUNK_SIZE)
+    while chunk:
+        if getattr(decompressor, "eof", False):  # the previous stream ended, another one follows
+            decompressor = codec.decompressor()
+        try:
+            data = decompressor.decompress(chunk)
+        except _DECOMPRESSION_ERRORS as ex:
+            raise InvalidCompressedData(f"invalid {codec.name} data: {ex}") from ex
+        _write_all(target_fd, data)
+        if getattr(decompressor, "eof", False) and decompressor.unused_data:
+            chunk = decompressor.unused_data
+        else:
+            chunk = os.read(source_fd, _CHUNK_SIZE)
+    if not getattr(decompressor, "eof", True):
+        raise InvalidCompressedData(f"compressed {codec.name} data ended before the end of the stream was reached")
+
+
+fs.register("compress", "compress_file_content", compress_file_content)
+fs.register("decompress", "decompress_file_content", decompress_file_content)
+
+
+def is_incompressible(fd: int, sample_size: int, max_ratio: float) -> bool:
+    """
+    Estimates with fast zlib compression of the start of the file whether compressing it is worthwhile.
+    The file offset is not changed.
+    """
+    if hasattr(os, "pread"):
+        sample = os.pread(fd, sample_size, 0)
+    else:  # windows
+        sample = os.read(fd, sample_size)
+        os.lseek(fd, 0, os.SEEK_SET)
+    if not sample:
+        return False
+    return len(zlib.compress(sample, 1)) > len(sample) * max_ratio
+
+
+def _write_all(fd: int, data: bytes):
+    view = memoryview(data)
+    while view:
+        view = view[os.write(fd, view):]
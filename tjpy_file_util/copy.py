@@ -1,73 +1,388 @@
+import errno
+import functools
 import logging
-import shutil
+import os
+import stat
+import threading
 from pathlib import Path
+from typing import Dict, Set, Tuple, NamedTuple, Optional, List, Callable, TYPE_CHECKING
+
+from tjpy_file_util.compression import Compression, CompressionMode, InvalidCompressedData, get_codec, is_incompressible
+from tjpy_file_util.instrumentation import active_metrics, api_call, fs
+from tjpy_file_util.io_scheduler import IoScheduler, IoTask
+from tjpy_file_util.remove import remove_tree
+from tjpy_file_util.stat_cache import cached_stat, invalidate
+
+if TYPE_CHECKING:
+    from tjpy_file_util.permissions import PermissionRules
+
+try:
+    import fcntl
+except ImportError:  # not available on windows
+    fcntl = None  # type: ignore
 
 _logger = logging.getLogger(__name__)
 
+_FICLONE = 0x40049409  # linux ioctl for cloning a whole file (reflink), supported e.g. by btrfs and xfs
+_REFLINK_UNSUPPORTED_ERRNOS = {errno.EOPNOTSUPP, errno.ENOTTY, errno.EXDEV, errno.EINVAL, errno.EBADF}
+_KERNEL_COPY_UNSUPPORTED_ERRNOS = {errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTSUP}
+_COPY_CHUNK_SIZE = 8 * 1024 * 1024
+# (source device, target device) combinations for which reflinks already failed, to not try them again
+_reflink_unsupported_devices: Set[Tuple[int, int]] = set()
+
 
 class CopyException(Exception):
     pass
 
 
+class _CopyOptions(NamedTuple):
+    merge_directories: bool
+    overwrite_files: bool
+    overwrite_directories: bool
+    permissions: Optional['PermissionRules']
+    # file copies collected for the scheduler instead of being executed immediately (if not None)
+    deferred_files: Optional[List[IoTask]]
+    compression: Optional[Compression]
+    # (directory, relative path) whose permissions are applied after the deferred files were copied, deepest first
+    deferred_directories: Optional[List[Tuple[Path, str]]]
+    # targets of (de)compressed files, as multiple sources can map to the same target (e.g. "a" and "a.gz")
+    compression_targets: Optional['_TargetClaims']
+
+
+class _TargetClaims:
+
+    def __init__(self):
+        self._sources: Dict[Path, Path] = dict()
+        self._lock = threading.Lock()
+
+    def claim(self, target: Path, source: Path):
+        with self._lock:
+            other_source = self._sources.setdefault(target, source)
+        if other_source != source:
+            raise CopyException(f"The files '{other_source}' and '{source}' can not both be copied to '{target}'.")
+
+
+@api_call
 def copy_children(source_dir: Path,
                   target_dir: Path,
                   *,
                   merge_directories: bool = True,
-                  overwrite_files: bool = False):
-    """Low performance function for copying tree of files but providing some additional options"""
-    if not source_dir.exists():
+                  overwrite_files: bool = False,
+                  overwrite_directories: bool = False,
+                  permissions: Optional['PermissionRules'] = None,
+                  max_workers: int = 1,
+                  scheduler: Optional[IoScheduler] = None,
+                  compression: Optional[Compression] = None):
+    """
+    Copies the children of source_dir into target_dir, providing some additional options compared to shutil.
+    See copy for the options, permission rules are matched against the paths relative to target_dir.
+    """
+    options = _create_options(merge_directories, overwrite_files, overwrite_directories, permissions,
+                              max_workers, scheduler, compression)
+    _copy_children(source_dir, target_dir, options, "")
+    _copy_deferred_files(options, max_workers, scheduler)
+    _apply_deferred_directory_permissions(options)
+
+
+def _copy_children(source_dir: Path, target_dir: Path, options: _CopyOptions, relative_path: str):
+    source_dir_stat = cached_stat(source_dir)
+    if source_dir_stat is None:
         raise CopyException(f"The source directory '{source_dir}' must exist.")
-    if not source_dir.is_dir():
+    if not stat.S_ISDIR(source_dir_stat.st_mode):
         raise CopyException(f"The provided source directory path '{source_dir}' exists but is no directory.")
-    if not target_dir.exists():
+    target_dir_stat = cached_stat(target_dir)
+    if target_dir_stat is None:
         raise CopyException(f"The target directory '{target_dir}' must exist.")
-    if not target_dir.is_dir():
+    if not stat.S_ISDIR(target_dir_stat.st_mode):
         raise CopyException(f"The provided target directory path '{target_dir}' exists but is no directory.")
-    for source_child in source_dir.iterdir():
-        target_path_for_child = target_dir.joinpath(source_child.name)
-        copy(source_child, target_path_for_child,
-             merge_directories=merge_directories, overwrite_files=overwrite_files)
+    for name in fs.listdir(str(source_dir)):
+        child_relative_path = relative_path + "/" + name if relative_path else name
+        _copy(source_dir.joinpath(name), target_dir.joinpath(name), options, child_relative_path)
 
 
+@api_call
 def copy(source: Path,
          target: Path,
          *,
          merge_directories: bool = True,
-         overwrite_files: bool = False):
+         overwrite_files: bool = False,
+         overwrite_directories: bool = False,
+         permissions: Optional['PermissionRules'] = None,
+         max_workers: int = 1,
+         scheduler: Optional[IoScheduler] = None,
+         compression: Optional[Compression] = None):
     """
     Copy source file or directory to target path.
-    Use shutil.copytree or rsync for higher performance.
+    See benchmarks/test_copy_benchmark.py for a comparison with shutil.copytree (run it with `make benchmark`).
     :param source:
     :param target:
     :param merge_directories:
     :param overwrite_files:
+    :param overwrite_directories: remove existing target directories (with all of their content) instead of failing
+        if they conflict with a source file or can not be merged because merging directories is disabled
+    :param permissions: rules (see tjpy_file_util.permissions) applied to every copied file and created directory,
+        matched against the path relative to the parent of target. They are applied on the open descriptor
+        of the freshly written file, so no second pass over the copied tree is necessary.
+        Directories get their permissions after their content was copied, so e.g. read-only modes are possible.
+    :param max_workers: if bigger than 1, the directories are created first and the files are copied in parallel
+        by an IoScheduler with this amount of workers (limited per device, in inode order)
+    :param scheduler: scheduler used for copying the files in parallel (overrides max_workers),
+        e.g. with explicit per-device limits
+    :param compression: compresses or decompresses every file while copying it (see Compression).
+        Compressed files get the suffix of the codec (e.g. ".gz") unless a sample of them turns out incompressible,
+        in which case they are copied as they are. When decompressing, only files with the suffix are decompressed
+        (and the suffix removed), other files are copied as they are.
+        Use max_workers to (de)compress multiple files in parallel.
+        Permission rules are matched against the final name (with or without the suffix).
+        Sources which would end up with the same name (e.g. "a" and "a.gz" when decompressing) raise a CopyException.
     :return:
     """
-    if source.is_dir():
-        if target.exists() and not target.is_dir():
+    options = _create_options(merge_directories, overwrite_files, overwrite_directories, permissions,
+                              max_workers, scheduler, compression)
+    _copy(source, target, options, target.name)
+    _copy_deferred_files(options, max_workers, scheduler)
+    _apply_deferred_directory_permissions(options)
+
+
+def _create_options(merge_directories: bool,
+                    overwrite_files: bool,
+                    overwrite_directories: bool,
+                    permissions: Optional['PermissionRules'],
+                    max_workers: int,
+                    scheduler: Optional[IoScheduler],
+                    compression: Optional[Compression]) -> _CopyOptions:
+    if compression is not None:
+        get_codec(compression.codec)  # fail early for unknown codecs
+    parallel = max_workers > 1 or scheduler is not None
+    return _CopyOptions(merge_directories, overwrite_files, overwrite_directories, permissions,
+                        [] if parallel else None, compression, [] if parallel else None,
+                        _TargetClaims() if compression is not None else None)
+
+
+def _copy_deferred_files(options: _CopyOptions, max_workers: int, scheduler: Optional[IoScheduler]):
+    if not options.deferred_files:
+        return
+    # the tasks share the stat cache of this thread and invalidate the files they write themselves
+    (scheduler if scheduler is not None else IoScheduler(max_workers)).run(options.deferred_files)
+
+
+def _apply_deferred_directory_permissions(options: _CopyOptions):
+    if options.permissions is None or not options.deferred_directories:
+        return
+    # directories are recorded after their children, so a restrictive mode of a parent (e.g. without x)
+    # can not prevent applying the permissions of its children
+    for directory, relative_path in options.deferred_directories:
+        _apply_permissions_to_path(directory, options.permissions, relative_path)
+
+
+def _copy(source: Path, target: Path, options: _CopyOptions, relative_path: str):
+    source_stat = cached_stat(source)
+    target_stat = cached_stat(target)
+    if source_stat is not None and stat.S_ISDIR(source_stat.st_mode):
+        if target_stat is not None and not stat.S_ISDIR(target_stat.st_mode):
             raise CopyException(
                 f"The source directory '{source}' can not be copied to '{target}' "
                 f"because the target path already exists but is no directory.")
-        if not merge_directories and target.exists():
-
-            raise CopyException(f"The source directory '{source}' can not be copied to '{target}' "
-                                f"because the target directory does already exist and merging directories is disabled")
-        _logger.debug(f"Copying directory {source} to {target}")
-        target.mkdir(exist_ok=merge_directories)
-        copy_children(source, target,
-                      merge_directories=merge_directories,
-                      overwrite_files=overwrite_files)
+        if not options.merge_directories and target_stat is not None:
+            if not options.overwrite_directories:
+                raise CopyException(f"The source directory '{source}' can not be copied to '{target}' "
+                                    f"because the target directory does already exist "
+                                    f"and merging directories is disabled")
+            _logger.debug("Deleting directory %s to overwrite it with %s", target, source)
+            remove_tree(target)
+        _logger.debug("Copying directory %s to %s", source, target)
+        try:
+            fs.mkdir(str(target))
+        except FileExistsError:
+            if not options.merge_directories:
+                raise
+        invalidate(target)
+        _copy_children(source, target, options, relative_path)
+        if options.permissions is not None:
+            if options.deferred_directories is not None:
+                options.deferred_directories.append((target, relative_path))
+            else:
+                _apply_permissions_to_path(target, options.permissions, relative_path)
         # shutil.copytree(child, target_path_for_child, ) # not used because not configurable enough
+    elif options.deferred_files is not None and source_stat is not None:
+        target_parent_stat = cached_stat(target.parent)
+        target_device = target_parent_stat.st_dev if target_parent_stat is not None else source_stat.st_dev
+        options.deferred_files.append(IoTask(
+            (source_stat.st_dev, target_device), source_stat.st_ino,
+            functools.partial(_copy_deferred_file, source, target, options, relative_path)))
     else:
-        if target.exists():
-            if target.exists() and not target.is_file():
+        _copy_file(source, target, target_stat, options, relative_path)
+
+
+def _copy_deferred_file(source: Path, target: Path, options: _CopyOptions, relative_path: str):
+    """The target is stat'ed when the copy runs, as other tasks may have created it since the copy was planned"""
+    _copy_file(source, target, cached_stat(target), options, relative_path)
+
+
+def _copy_file(source: Path,
+               target: Path,
+               target_stat: Optional[os.stat_result],
+               options: _CopyOptions,
+               relative_path: str):
+    source_fd = fs.open(str(source), os.O_RDONLY)
+    try:
+        copy_content: Callable[[int, int], None] = fs.copy_file_content
+        if options.compression is not None:
+            compressed_target, compressed_copy_content = _plan_compression(source, target, source_fd,
+                                                                           options.compression)
+            if compressed_target != target:
+                relative_path = relative_path[:len(relative_path) - len(target.name)] + compressed_target.name
+                target, target_stat, copy_content = compressed_target, cached_stat(compressed_target), \
+                    compressed_copy_content
+            if options.compression_targets is not None:
+                options.compression_targets.claim(target, source)
+        if target_stat is not None and stat.S_ISDIR(target_stat.st_mode) and options.overwrite_directories:
+            _logger.debug("Deleting directory %s to overwrite it with %s", target, source)
+            remove_tree(target)
+        elif target_stat is not None:
+            if not stat.S_ISREG(target_stat.st_mode):
                 raise CopyException(f"The file '{source}' can not be copied to '{target}' "
                                     f"because the target already exists and is no file.")
-            if not overwrite_files:
+            if not options.overwrite_files:
                 raise CopyException(f"The file '{source}' can not be copied to '{target}' "
                                     f"because the target file already exists and overwriting files is disabled.")
             else:
-                _logger.debug(f"Deleting {target} to overwrite it with {source}")
-                target.unlink()
-        _logger.debug(f"Copying file {source} to {target}")
-        shutil.copyfile(str(source), str(target))
+                _logger.debug("Deleting %s to overwrite it with %s", target, source)
+                fs.unlink(str(target))
+        _logger.debug("Copying file %s to %s", source, target)
+        try:
+            target_fd = fs.open(str(target), os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+            try:
+                try:
+                    try:
+                        copy_content(source_fd, target_fd)
+                    except InvalidCompressedData as ex:
+                        raise CopyException(f"The file '{source}' can not be decompressed: {ex}") from ex
+                    metrics = active_metrics()
+                    if metrics is not None:
+                        metrics.record_copied_bytes(os.fstat(source_fd).st_size)
+                    if options.permissions is not None:
+                        options.permissions.apply_to_fd(target_fd, relative_path)
+                finally:
+                    os.close(target_fd)
+            except BaseException:
+                # a partial target would let a retry fail because the target already exists
+                fs.unlink(str(target))
+                raise
+        finally:
+            invalidate(target)
+    finally:
+        os.close(source_fd)
+
+
+def _plan_compression(source: Path,
+                      target: Path,
+                      source_fd: int,
+                      compression: Compression) -> Tuple[Path, Callable[[int, int], None]]:
+    """:return: the target path and the function copying the content (the unchanged target for plain copies)"""
+    codec = get_codec(compression.codec)
+    if compression.mode == CompressionMode.decompress:
+        if not source.name.endswith(codec.suffix) or len(source.name) == len(codec.suffix):
+            return target, fs.copy_file_content
+        return target.with_name(target.name[:-len(codec.suffix)]), \
+            lambda source_fd, target_fd: fs.decompress_file_content(source_fd, target_fd, codec)
+    if compression.incompressible_ratio is not None \
+            and is_incompressible(source_fd, compression.sample_size, compression.incompressible_ratio):
+        _logger.debug("Copying %s without compression because it is incompressible", source)
+        return target, fs.copy_file_content
+    return target.with_name(target.name + codec.suffix), \
+        lambda source_fd, target_fd: fs.compress_file_content(source_fd, target_fd, codec, compression.level)
+
+
+def _apply_permissions_to_path(path: Path, permissions: 'PermissionRules', relative_path: str):
+    fd = fs.open(str(path), os.O_RDONLY)
+    try:
+        permissions.apply_to_fd(fd, relative_path)
+    finally:
+        os.close(fd)
+
+
+def reflink_file(source: Path, target: Path) -> bool:
+    """
+    Creates the target file as copy-on-write clone of the source file if the file system supports it.
+    Falls back to a regular copy otherwise.
+    :return: whether a reflink was created
+    """
+    with source.open("rb") as source_file, target.open("wb") as target_file:
+        if try_reflink(source_file.fileno(), target_file.fileno()):
+            return True
+        _copy_file_content_without_reflink(source_file.fileno(), target_file.fileno())
+        return False
+
+
+def try_reflink(source_fd: int, target_fd: int) -> bool:
+    """Clones the content of the source file into the (empty) target file, returns False if not supported"""
+    if fcntl is None:
+        return False
+    devices = (os.fstat(source_fd).st_dev, os.fstat(target_fd).st_dev)
+    if devices in _reflink_unsupported_devices:
+        return False
+    try:
+        fcntl.ioctl(target_fd, _FICLONE, source_fd)
+        return True
+    except OSError as ex:
+        if ex.errno not in _REFLINK_UNSUPPORTED_ERRNOS:
+            raise
+        _reflink_unsupported_devices.add(devices)
+        return False
+
+
+def copy_file_content(source_fd: int, target_fd: int):
+    """
+    Copies the whole content of the source file into the empty target file without reading it into memory.
+    Uses (in order of preference) a reflink, copy_file_range, sendfile or a buffered read/write loop.
+    The file offsets of both descriptors are undefined afterwards.
+    """
+    if not try_reflink(source_fd, target_fd):
+        _copy_file_content_without_reflink(source_fd, target_fd)
+
+
+fs.register("copy", "copy_file_content", copy_file_content)
+
+
+def _copy_file_content_without_reflink(source_fd: int, target_fd: int):
+    size = os.fstat(source_fd).st_size
+    for kernel_copy in (_copy_file_range, _sendfile):
+        try:
+            if kernel_copy(source_fd, target_fd, size):
+                return
+        except OSError as ex:
+            if ex.errno not in _KERNEL_COPY_UNSUPPORTED_ERRNOS:
+                raise
+            os.ftruncate(target_fd, 0)
+    os.lseek(source_fd, 0, os.SEEK_SET)
+    os.lseek(target_fd, 0, os.SEEK_SET)
+    chunk = os.read(source_fd, _COPY_CHUNK_SIZE)
+    while chunk:
+        view = memoryview(chunk)
+        while view:
+            view = view[os.write(target_fd, view):]
+        chunk = os.read(source_fd, _COPY_CHUNK_SIZE)
+
+
+def _copy_file_range(source_fd: int, target_fd: int, size: int) -> bool:
+    if not hasattr(os, "copy_file_range"):  # python < 3.8
+        return False
+    offset = 0
+    while True:
+        copied = os.copy_file_range(source_fd, target_fd, max(size - offset, _COPY_CHUNK_SIZE), offset, offset)
+        if copied == 0:  # end of file (also handles files changing their size while copying)
+            return True
+        offset += copied
+
+
+def _sendfile(source_fd: int, target_fd: int, size: int) -> bool:
+    if not hasattr(os, "sendfile"):
+        return False
+    os.lseek(target_fd, 0, os.SEEK_SET)
+    offset = 0
+    while True:
+        copied = os.sendfile(target_fd, source_fd, offset, max(size - offset, _COPY_CHUNK_SIZE))
+        if copied == 0:
+            return True
+        offset += copied
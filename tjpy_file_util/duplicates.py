@@ -0,0 +1,210 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Iterable, Optional, Set, Tuple, Callable, TypeVar, Hashable
+
+from tjpy_file_util.instrumentation import api_call, fs
+
+_logger = logging.getLogger(__name__)
+
+_CHUNK_SIZE = 1024 * 1024
+
+_FileKey = Tuple[int, int, int, int]  # device, inode, size, mtime in nanoseconds
+_K = TypeVar('_K', bound=Hashable)
+_CACHE_FORMAT_VERSION = 2
+
+
+class HashCache:
+    """
+    Cache of file hashes so unchanged files do not have to be hashed again.
+    Entries are stored per (kind, device, inode) together with the size and mtime the hash belongs to,
+    so the entry of a changed file is replaced instead of accumulating stale entries.
+    If a path is provided, the cache is loaded from and can be saved to that JSON file
+    (files written by an older version or which are corrupt are ignored).
+    """
+
+    def __init__(self, path: Optional[Path] = None):
+        self.path = path
+        # "kind:device:inode" -> [size, mtime in nanoseconds, digest]
+        self._hashes: Dict[str, List] = dict()
+        self._used: Set[str] = set()
+        self._lock = threading.Lock()
+        if path is not None and path.is_file():
+            try:
+                content = json.loads(path.read_text(encoding="utf-8"))
+            except ValueError as ex:
+                _logger.warning("ignoring corrupt hash cache %s: %s", path, ex)
+                return
+            if isinstance(content, dict) and content.get("version") == _CACHE_FORMAT_VERSION \
+                    and isinstance(content.get("hashes"), dict):
+                self._hashes = content["hashes"]
+            else:
+                _logger.debug("ignoring hash cache %s of an older version", path)
+
+    def __len__(self) -> int:
+        return len(self._hashes)
+
+    def get(self, kind: str, key: _FileKey) -> Optional[str]:
+        cache_key = _format_key(kind, key)
+        with self._lock:
+            entry = self._hashes.get(cache_key)
+            if entry is None or entry[0] != key[2] or entry[1] != key[3]:
+                return None
+            self._used.add(cache_key)
+            return entry[2]
+
+    def put(self, kind: str, key: _FileKey, digest: str):
+        cache_key = _format_key(kind, key)
+        with self._lock:
+            self._hashes[cache_key] = [key[2], key[3], digest]
+            self._used.add(cache_key)
+
+    def prune(self) -> int:
+        """
+        Removes all entries which were neither read nor written since the cache was created (e.g. of deleted files).
+        Only call this after runs covering all files the cache is used for.
+        :return: amount of removed entries
+        """
+        with self._lock:
+            unused = [cache_key for cache_key in self._hashes if cache_key not in self._used]
+            for cache_key in unused:
+                del self._hashes[cache_key]
+        return len(unused)
+
+    def save(self):
+        assert self.path is not None, "the hash cache has no path to save to"
+        with self._lock:
+            content = json.dumps({"version": _CACHE_FORMAT_VERSION, "hashes": self._hashes})
+        temp_path = self.path.with_name(self.path.name + ".tmp")
+        temp_path.write_text(content, encoding="utf-8")
+        os.replace(str(temp_path), str(self.path))
+
+
+@api_call
+def find_duplicates(directories: Iterable[Path],
+                    *,
+                    max_workers: int = 4,
+                    hash_cache: Optional[HashCache] = None,
+                    min_size: int = 1,
+                    edge_size: int = 4096) -> List[List[Path]]:
+    """
+    Finds files with identical content in the directories (recursively, symlinks are not followed).
+    The candidates are narrowed down in stages, so only files which can not be told apart otherwise are read fully:
+    1. group by size (from the directory scan)
+    2. group by hash of the first and last `edge_size` bytes
+    3. group by hash of the full content
+    Hardlinks of the same file are reported only once because they do not occupy additional space.
+    Subdirectories and files which can not be read or which are deleted during the search are skipped (and logged).
+    :param directories: directories to search in
+    :param max_workers: amount of threads used for hashing
+    :param hash_cache: cache for hashes, pass the same (persistent) cache to subsequent runs to skip unchanged files
+        (see HashCache.prune for removing entries of deleted files before saving it)
+    :param min_size: files smaller than this are ignored
+    :param edge_size: amount of bytes read from the start and end of a file in the second stage
+    :return: groups of duplicate files, each group sorted and containing at least two paths
+    """
+    cache = hash_cache if hash_cache is not None else HashCache()
+    files_by_size = _group_files_by_size(directories, min_size)
+    candidates = [files for files in files_by_size.values() if len(files) > 1]
+    _logger.debug("%s: %d size groups with duplicate candidates", find_duplicates.__name__, len(candidates))
+
+    duplicates: List[List[Path]] = []
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        def regroup(groups: List[List[Tuple[Path, _FileKey]]],
+                    kind: str,
+                    hash_function: Callable[[Path, int], str]) -> List[List[Tuple[Path, _FileKey]]]:
+            def hash_file(file: Tuple[Path, _FileKey]) -> Optional[str]:
+                path, key = file
+                digest = cache.get(kind, key)
+                if digest is None:
+                    try:
+                        digest = hash_function(path, key[2])
+                    except (PermissionError, FileNotFoundError) as ex:
+                        _logger.warning("%s: skipping %s: %s", find_duplicates.__name__, path, ex)
+                        return None
+                    cache.put(kind, key, digest)
+                return digest
+
+            flat_files = [file for group in groups for file in group]
+            hashed_files = [(digest, file) for digest, file in zip(executor.map(hash_file, flat_files), flat_files)
+                            if digest is not None]
+            return [files for files in _group(hashed_files).values() if len(files) > 1]
+
+        small_candidates = [group for group in candidates if group[0][1][2] <= 2 * edge_size]
+        large_candidates = [group for group in candidates if group[0][1][2] > 2 * edge_size]
+        # the edge hashes depend on edge_size, so it is part of the kind
+        large_candidates = regroup(large_candidates, f"edges{edge_size}",
+                                   lambda path, size: _hash_edges(path, size, edge_size))
+        for group in regroup(small_candidates + large_candidates, "full", lambda path, size: _hash_file(path)):
+            duplicates.append(sorted(path for path, _ in group))
+    return sorted(duplicates)
+
+
+def _group_files_by_size(directories: Iterable[Path], min_size: int) -> Dict[int, List[Tuple[Path, _FileKey]]]:
+    files_by_size: Dict[int, List[Tuple[Path, _FileKey]]] = dict()
+    seen_inodes = set()
+    roots = [str(directory) for directory in directories]
+    # the given directories must be readable, unreadable or vanished subdirectories are skipped
+    stack = [(root, True) for root in reversed(roots)]
+    while stack:
+        directory, is_root = stack.pop()
+        try:
+            with fs.scandir(directory) as iterator:
+                entries = list(iterator)
+        except (PermissionError, FileNotFoundError) as ex:
+            if is_root:
+                raise
+            _logger.warning("%s: skipping %s: %s", find_duplicates.__name__, directory, ex)
+            continue
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                stack.append((entry.path, False))
+            elif entry.is_file(follow_symlinks=False):
+                try:
+                    stat_result = entry.stat(follow_symlinks=False)
+                except FileNotFoundError:
+                    continue  # deleted since the directory was read
+                if stat_result.st_size < min_size:
+                    continue
+                inode = (stat_result.st_dev, stat_result.st_ino)
+                if inode in seen_inodes:
+                    continue
+                seen_inodes.add(inode)
+                key = (stat_result.st_dev, stat_result.st_ino, stat_result.st_size, stat_result.st_mtime_ns)
+                files_by_size.setdefault(stat_result.st_size, []).append((Path(entry.path), key))
+    return files_by_size
+
+
+def _group(items: Iterable[Tuple[_K, Tuple[Path, _FileKey]]]) -> Dict[Tuple[int, _K], List[Tuple[Path, _FileKey]]]:
+    groups: Dict[Tuple[int, _K], List[Tuple[Path, _FileKey]]] = dict()
+    for digest, file in items:
+        # the size is part of the group key to never mix files of different size groups
+        groups.setdefault((file[1][2], digest), []).append(file)
+    return groups
+
+
+def _hash_edges(path: Path, size: int, edge_size: int) -> str:
+    digest = hashlib.sha256()
+    with path.open("rb") as file:
+        digest.update(file.read(edge_size))
+        file.seek(size - edge_size)
+        digest.update(file.read(edge_size))
+    return digest.hexdigest()
+
+
+def _hash_file(path: Path) -> str:
+    digest = hashlib.sha256()
+    with path.open("rb") as file:
+        chunk = file.read(_CHUNK_SIZE)
+        while chunk:
+            digest.update(chunk)
+            chunk = file.read(_CHUNK_SIZE)
+    return digest.hexdigest()
+
+
+def _format_key(kind: str, key: _FileKey) -> str:
+    return f"{kind}:{key[0]}:{key[1]}"
@@ -0,0 +1,245 @@
+import logging
+import os
+import re
+from pathlib import Path, PurePosixPath
+from typing import Dict, Set, List, Optional, Union, Iterable, Iterator, Tuple, Pattern, cast, Any
+
+from tjpy_file_util.code_file_trees import FilesystemItemType, StrictDictFileHierarchy, read_children_as_file_tree
+
+_logger = logging.getLogger(__name__)
+
+IndexPath = Union[str, PurePosixPath]
+
+_MAGIC_CHARACTERS = re.compile(r"[*?\[]")
+
+
+class FileTreeIndexException(Exception):
+    pass
+
+
+class FileTreeIndex:
+    """
+    Queryable index over a file hierarchy (as returned by read_children_as_file_tree).
+    All paths are relative posix paths like "lib/x86_64/libfoo.so".
+    The index consists of a path trie (for existence checks in O(depth) and subtree walks)
+    and indexes by basename and extension (for answering glob queries without walking the whole tree).
+    The index holds its own copy of the hierarchy and can be updated via add and remove.
+    """
+
+    def __init__(self, hierarchy: Optional[StrictDictFileHierarchy] = None):
+        self._root: Dict[str, Any] = dict()
+        self._by_name: Dict[str, Set[str]] = dict()
+        self._by_extension: Dict[str, Set[str]] = dict()
+        if hierarchy is not None:
+            self._insert_hierarchy(self._root, "", hierarchy)
+
+    @staticmethod
+    def from_directory(directory: Path) -> 'FileTreeIndex':
+        return FileTreeIndex(read_children_as_file_tree(directory))
+
+    def __len__(self) -> int:
+        return sum(len(paths) for paths in self._by_name.values())
+
+    def exists(self, path: IndexPath) -> bool:
+        return self._lookup(_split(path)) is not None
+
+    def is_file(self, path: IndexPath) -> bool:
+        return self._lookup(_split(path)) is FilesystemItemType.file
+
+    def is_dir(self, path: IndexPath) -> bool:
+        return isinstance(self._lookup(_split(path)), dict)
+
+    def add(self, path: IndexPath, item_type: FilesystemItemType = FilesystemItemType.file):
+        """
+        Adds a file or directory to the index. Missing parent directories are added as well.
+        Adding an already existing item of the same type is a no-op.
+        """
+        parts = _split(path)
+        if not parts:
+            raise FileTreeIndexException("The root of the index can not be added")
+        node = self._root
+        for depth, part in enumerate(parts[:-1]):
+            child = node.get(part)
+            if child is None:
+                child = dict()
+                node[part] = child
+                self._index_item("/".join(parts[:depth + 1]))
+            elif not isinstance(child, dict):
+                raise FileTreeIndexException(f"Can not add '{_join(parts)}' because "
+                                             f"'{_join(parts[:depth + 1])}' is a file")
+            node = child
+        name = parts[-1]
+        existing = node.get(name)
+        if existing is not None:
+            if (item_type == FilesystemItemType.file) != (existing is FilesystemItemType.file):
+                raise FileTreeIndexException(f"Can not add '{_join(parts)}' as {item_type.name} "
+                                             f"because it already exists with a different type")
+            return
+        node[name] = FilesystemItemType.file if item_type == FilesystemItemType.file else dict()
+        self._index_item(_join(parts))
+
+    def remove(self, path: IndexPath):
+        """Removes a file or a directory including all of its descendants from the index."""
+        parts = _split(path)
+        if not parts:
+            raise FileTreeIndexException("The root of the index can not be removed")
+        parent = self._lookup(parts[:-1])
+        if not isinstance(parent, dict) or parts[-1] not in parent:
+            raise FileTreeIndexException(f"The path '{_join(parts)}' does not exist in the index")
+        removed = parent.pop(parts[-1])
+        removed_path = _join(parts)
+        self._unindex_item(removed_path)
+        if isinstance(removed, dict):
+            for descendant_path, _ in _walk(removed, removed_path):
+                self._unindex_item(descendant_path)
+
+    def glob(self, pattern: str) -> List[PurePosixPath]:
+        """
+        Returns all paths matching the glob pattern (sorted).
+        Supported syntax is '*', '?', '[...]' within a path segment and '**' as a whole segment
+        matching any number of directories.
+        The candidates are taken from the basename or extension index if the last segment allows it,
+        otherwise only the subtree below the literal prefix of the pattern is walked.
+        """
+        parts = _split(pattern)
+        if not parts:
+            return []
+        literal_prefix: List[str] = []
+        for part in parts[:-1]:
+            if _MAGIC_CHARACTERS.search(part):
+                break
+            literal_prefix.append(part)
+        regex = _compile_glob(parts)
+        indexed_candidates = self._indexed_candidates(parts[-1])
+        candidates: Iterable[str]
+        if indexed_candidates is None:
+            subtree = self._lookup(literal_prefix)
+            if not isinstance(subtree, dict):
+                return []
+            candidates = (path for path, _ in _walk(subtree, _join(literal_prefix)))
+        else:
+            prefix = _join(literal_prefix) + "/" if literal_prefix else ""
+            candidates = (path for path in indexed_candidates if path.startswith(prefix))
+        return sorted(PurePosixPath(path) for path in candidates if regex.match(path))
+
+    def match(self, regex: Union[str, Pattern]) -> List[PurePosixPath]:
+        """Returns all paths (sorted) for which the regex matches the whole relative posix path."""
+        compiled = re.compile(regex) if isinstance(regex, str) else regex
+        return sorted(PurePosixPath(path) for path, _ in _walk(self._root, "") if compiled.fullmatch(path))
+
+    def to_hierarchy(self) -> StrictDictFileHierarchy:
+        return _copy_hierarchy(self._root)
+
+    def _lookup(self, parts: List[str]) -> Optional[Any]:
+        node: Any = self._root
+        for part in parts:
+            if not isinstance(node, dict):
+                return None
+            node = node.get(part)
+            if node is None:
+                return None
+        return node
+
+    def _indexed_candidates(self, last_part: str) -> Optional[Set[str]]:
+        if not _MAGIC_CHARACTERS.search(last_part):
+            return self._by_name.get(last_part, set())
+        rest = last_part[1:]
+        if last_part.startswith("*.") and not _MAGIC_CHARACTERS.search(rest):
+            extension = os.path.splitext("x" + rest)[1]
+            # '*' also matches the empty string, so a hidden file named exactly like the rest matches too
+            return self._by_extension.get(extension, set()) | self._by_name.get(rest, set())
+        return None
+
+    def _insert_hierarchy(self, node: Dict[str, Any], path: str, hierarchy: StrictDictFileHierarchy):
+        for name, value in hierarchy.items():
+            child_path = path + "/" + name if path else name
+            self._index_item(child_path)
+            if isinstance(value, dict):
+                child: Dict[str, Any] = dict()
+                node[name] = child
+                self._insert_hierarchy(child, child_path, cast(StrictDictFileHierarchy, value))
+            elif value == FilesystemItemType.file:
+                node[name] = FilesystemItemType.file
+            else:
+                raise FileTreeIndexException(f"invalid value for item '{child_path}': '{value}'")
+
+    def _index_item(self, path: str):
+        name = path.rsplit("/", 1)[-1]
+        self._by_name.setdefault(name, set()).add(path)
+        extension = os.path.splitext(name)[1]
+        if extension:
+            self._by_extension.setdefault(extension, set()).add(path)
+
+    def _unindex_item(self, path: str):
+        name = path.rsplit("/", 1)[-1]
+        _discard(self._by_name, name, path)
+        extension = os.path.splitext(name)[1]
+        if extension:
+            _discard(self._by_extension, extension, path)
+
+
+def _discard(index: Dict[str, Set[str]], key: str, path: str):
+    paths = index.get(key)
+    if paths is not None:
+        paths.discard(path)
+        if not paths:
+            del index[key]
+
+
+def _walk(node: Dict[str, Any], path: str) -> Iterator[Tuple[str, Any]]:
+    stack = [(node, path)]
+    while stack:
+        current, current_path = stack.pop()
+        for name, value in current.items():
+            child_path = current_path + "/" + name if current_path else name
+            yield child_path, value
+            if isinstance(value, dict):
+                stack.append((value, child_path))
+
+
+def _copy_hierarchy(node: Dict[str, Any]) -> StrictDictFileHierarchy:
+    return {name: _copy_hierarchy(value) if isinstance(value, dict) else value for name, value in node.items()}
+
+
+def _split(path: IndexPath) -> List[str]:
+    return [part for part in str(path).split("/") if part and part != "."]
+
+
+def _join(parts: List[str]) -> str:
+    return "/".join(parts)
+
+
+def _compile_glob(parts: List[str]) -> Pattern:
+    regex = ""
+    for index, part in enumerate(parts):
+        is_last = index == len(parts) - 1
+        if part == "**":
+            regex += ".+" if is_last else "(?:[^/]+/)*"
+        else:
+            regex += _translate_glob_segment(part) + ("" if is_last else "/")
+    return re.compile(regex + r"\Z")
+
+
+def _translate_glob_segment(segment: str) -> str:
+    result = ""
+    index = 0
+    while index < len(segment):
+        character = segment[index]
+        index += 1
+        if character == "*":
+            result += "[^/]*"
+        elif character == "?":
+            result += "[^/]"
+        elif character == "[":
+            end = segment.find("]", index + 1 if segment[index:index + 1] in ("!", "]") else index)
+            if end < 0:
+                result += re.escape(character)
+            else:
+                content = segment[index:end].replace("\\", "\\\\")
+                if content.startswith("!"):
+                    content = "^" + content[1:]
+                result += "[" + content + "]"
+                index = end + 1
+        else:
+            result += re.escape(character)
+    return result
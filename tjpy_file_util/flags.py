@@ -1,21 +1,137 @@
+import fnmatch
 import logging
 import os
 import stat
+import threading
 from pathlib import Path
+from typing import Callable, List, Optional
 
+from tjpy_file_util.instrumentation import api_call, fs
+from tjpy_file_util.stat_cache import invalidate, path_is_dir
+from tjpy_file_util.tree_walk import WalkedDirectory, walk_directories
 from tjpy_file_util.user_friendly_assertion import assert_path_is_file
 
 _logger = logging.getLogger(__name__)
 
+# receives the relative posix path, the current mode (from stat) and returns the desired mode
+ModeFunction = Callable[[str, int], int]
 
+
+@api_call
 def make_file_executable_if_necessary(file: Path):
-    assert_path_is_file(file)
+    """Makes the file executable for its owner, the mode is only changed if the current user can not execute it yet"""
+    mode = assert_path_is_file(file).st_mode
     if not is_executable(file):
-        mode = file.stat().st_mode
-        new_mode = mode | stat.S_IEXEC
-        _logger.debug(f"Making file {file} executable")
-        file.chmod(new_mode)
+        _logger.debug("Making file %s executable", file)
+        fs.chmod(str(file), stat.S_IMODE(mode) | stat.S_IEXEC)
+        invalidate(file)
 
 
 def is_executable(file: Path) -> bool:
     return os.access(str(file), os.X_OK)
+
+
+@api_call
+def make_executable_tree(directory: Path,
+                         *,
+                         pattern: Optional[str] = None,
+                         max_workers: int = 1) -> int:
+    """
+    Makes all files in the directory tree executable for their owner.
+    :param directory: root of the tree
+    :param pattern: only files whose relative posix path matches this fnmatch pattern (e.g. "*.sh", "bin/*")
+    :param max_workers: amount of threads, subdirectories are processed in parallel if bigger than 1
+    :return: amount of files whose mode was changed
+    """
+    def executable_mode(relative_path: str, mode: int) -> int:
+        if not stat.S_ISREG(mode) or (pattern is not None and not fnmatch.fnmatchcase(relative_path, pattern)):
+            return mode
+        return mode | stat.S_IEXEC
+
+    return apply_modes(directory, executable_mode, max_workers=max_workers)
+
+
+@api_call
+def apply_modes(directory: Path,
+                mode_function: ModeFunction,
+                *,
+                max_workers: int = 1) -> int:
+    """
+    Walks the directory tree once and sets the mode returned by mode_function for every file and directory.
+    The current mode is taken from the stat of the walk and chmod is only called if the mode actually changes
+    (relative to the open parent directory if supported). Symlinks are neither followed nor changed.
+    :param directory: root of the tree (its own mode is not changed)
+    :param mode_function: receives the relative posix path and the current st_mode and returns the new st_mode
+    :param max_workers: amount of threads, subdirectories are processed in parallel if bigger than 1
+    :return: amount of changed files and directories
+    """
+    def apply_mode(directory_fd: Optional[int], directory_path: str, name: str, relative_path: str,
+                   stat_result: os.stat_result) -> int:
+        mode = stat_result.st_mode
+        new_mode = mode_function(relative_path, mode)
+        if stat.S_IMODE(new_mode) == stat.S_IMODE(mode):
+            return 0
+        _logger.debug("Changing mode of %s from %o to %o", relative_path, stat.S_IMODE(mode), stat.S_IMODE(new_mode))
+        if directory_fd is not None:
+            fs.chmod(name, stat.S_IMODE(new_mode), dir_fd=directory_fd)
+        else:
+            fs.chmod(os.path.join(directory_path, name), stat.S_IMODE(new_mode))
+        return 1
+
+    return apply_to_tree(directory, apply_mode, max_workers=max_workers)
+
+
+# receives the descriptor (None if dir_fd is not supported) and path of the parent directory, the name,
+# the relative posix path and the lstat result of an entry and returns the amount of changes made
+EntryFunction = Callable[[Optional[int], str, str, str, os.stat_result], int]
+
+# the walk only provides descriptors if the platform supports them
+DIR_FD_SUPPORTED = os.chmod in os.supports_dir_fd
+
+
+def apply_to_tree(directory: Path,
+                  entry_function: EntryFunction,
+                  *,
+                  max_workers: int = 1) -> int:
+    """
+    Walks the directory tree once with scandir (see walk_directories) and calls entry_function for every file and
+    directory (symlinks are skipped), passing the open parent directory descriptor for dir_fd-relative system calls.
+    :param directory: root of the tree (entry_function is not called for it)
+    :param max_workers: amount of threads, subdirectories are processed in parallel if bigger than 1
+    :return: sum of the changes reported by entry_function
+    """
+    assert path_is_dir(directory)
+    walker = _TreeWalker(entry_function)
+    try:
+        walk_directories(str(directory), walker.apply, max_workers=max_workers)
+    finally:
+        if walker.changed:
+            invalidate(directory, recursive=True)
+    return walker.changed
+
+
+class _TreeWalker:
+
+    def __init__(self, entry_function: EntryFunction):
+        self._entry_function = entry_function
+        self._lock = threading.Lock()
+        self.changed = 0
+
+    def apply(self, directory: WalkedDirectory) -> List[str]:
+        """Calls the entry function for the entries of a directory and returns the names of its subdirectories"""
+        subdirectories = []
+        changed = 0
+        fd = directory.fd if DIR_FD_SUPPORTED else None
+        with fs.scandir(directory.fd if directory.fd is not None else directory.path) as entries:
+            for entry in entries:
+                entry_relative_path = directory.relative_path + "/" + entry.name if directory.relative_path \
+                    else entry.name
+                stat_result = entry.stat(follow_symlinks=False)
+                if stat.S_ISLNK(stat_result.st_mode):
+                    continue
+                if stat.S_ISDIR(stat_result.st_mode):
+                    subdirectories.append(entry.name)
+                changed += self._entry_function(fd, directory.path, entry.name, entry_relative_path, stat_result)
+        with self._lock:
+            self.changed += changed
+        return subdirectories
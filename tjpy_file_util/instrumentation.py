@@ -0,0 +1,262 @@
+import functools
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, TypeVar, cast
+
+_FunctionType = TypeVar("_FunctionType", bound=Callable[..., Any])
+
+UNATTRIBUTED = "unattributed"
+
+
+class OperationMetrics:
+    """Amount of calls and accumulated latency of one kind of operation"""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+    def to_dict(self) -> Dict[str, float]:
+        return {"count": self.count, "seconds": self.seconds}
+
+
+class ApiCallMetrics(OperationMetrics):
+    """Amount of calls and latency of a top-level API function, including the filesystem operations it made"""
+
+    def __init__(self):
+        super().__init__()
+        self.operations: Dict[str, OperationMetrics] = dict()
+
+    def to_dict(self) -> Dict[str, Any]:
+        result: Dict[str, Any] = super().to_dict()
+        result["operations"] = {name: operation.to_dict() for name, operation in sorted(self.operations.items())}
+        return result
+
+
+class FilesystemMetrics:
+    """
+    Filesystem operations (stat, list, mkdir, open, unlink, rmdir, chmod, chown, copy, compress, decompress)
+    made by this library while instrumentation is enabled, in total and per top-level API call.
+    Operations made by worker threads of parallel functions are attributed to the API call running at that time
+    (or to "unattributed" if multiple API calls run concurrently).
+    Additionally, the size of the source files copied (also compressed or decompressed) by copy and copy_children
+    is counted in copied_bytes.
+    """
+
+    def __init__(self):
+        self.operations: Dict[str, OperationMetrics] = dict()
+        self.api_calls: Dict[str, ApiCallMetrics] = dict()
+        self.copied_bytes = 0
+        self._lock = threading.Lock()
+        self._running_api_calls: List[str] = []
+
+    def record_operation(self, operation: str, seconds: float):
+        api = getattr(_current_api_call, "name", None)
+        with self._lock:
+            if api is None:
+                api = self._running_api_calls[0] if len(self._running_api_calls) == 1 else UNATTRIBUTED
+            _add(self.operations, operation, seconds)
+            api_metrics = self.api_calls.get(api)
+            if api_metrics is None:
+                api_metrics = self.api_calls[api] = ApiCallMetrics()
+            _add(api_metrics.operations, operation, seconds)
+
+    def record_copied_bytes(self, count: int):
+        with self._lock:
+            self.copied_bytes += count
+
+    def _start_api_call(self, api: str):
+        with self._lock:
+            self._running_api_calls.append(api)
+
+    def _finish_api_call(self, api: str, seconds: float):
+        with self._lock:
+            self._running_api_calls.remove(api)
+            api_metrics = self.api_calls.get(api)
+            if api_metrics is None:
+                api_metrics = self.api_calls[api] = ApiCallMetrics()
+            api_metrics.count += 1
+            api_metrics.seconds += seconds
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "operations": {name: operation.to_dict() for name, operation in sorted(self.operations.items())},
+                "api_calls": {name: api_call.to_dict() for name, api_call in sorted(self.api_calls.items())},
+                "copied_bytes": self.copied_bytes,
+            }
+
+    def to_prometheus(self, prefix: str = "tjpy_file_util") -> str:
+        """Prometheus text exposition format"""
+        metrics = self.to_dict()
+        lines = [
+            f"# HELP {prefix}_fs_operations_total Filesystem operations by type",
+            f"# TYPE {prefix}_fs_operations_total counter",
+        ]
+        lines += [f'{prefix}_fs_operations_total{{operation="{name}"}} {operation["count"]}'
+                  for name, operation in metrics["operations"].items()]
+        lines += [
+            f"# HELP {prefix}_fs_operation_seconds_total Accumulated latency of filesystem operations by type",
+            f"# TYPE {prefix}_fs_operation_seconds_total counter",
+        ]
+        lines += [f'{prefix}_fs_operation_seconds_total{{operation="{name}"}} {operation["seconds"]}'
+                  for name, operation in metrics["operations"].items()]
+        lines += [
+            f"# HELP {prefix}_api_calls_total Calls of top-level API functions",
+            f"# TYPE {prefix}_api_calls_total counter",
+        ]
+        lines += [f'{prefix}_api_calls_total{{api="{name}"}} {api_call["count"]}'
+                  for name, api_call in metrics["api_calls"].items()]
+        lines += [
+            f"# HELP {prefix}_api_call_seconds_total Accumulated duration of top-level API functions",
+            f"# TYPE {prefix}_api_call_seconds_total counter",
+        ]
+        lines += [f'{prefix}_api_call_seconds_total{{api="{name}"}} {api_call["seconds"]}'
+                  for name, api_call in metrics["api_calls"].items()]
+        lines += [
+            f"# HELP {prefix}_api_fs_operations_total Filesystem operations by top-level API function and type",
+            f"# TYPE {prefix}_api_fs_operations_total counter",
+        ]
+        lines += [f'{prefix}_api_fs_operations_total{{api="{api}",operation="{name}"}} {operation["count"]}'
+                  for api, api_call in metrics["api_calls"].items()
+                  for name, operation in api_call["operations"].items()]
+        lines += [
+            f"# HELP {prefix}_api_fs_operation_seconds_total "
+            f"Accumulated latency of filesystem operations by top-level API function and type",
+            f"# TYPE {prefix}_api_fs_operation_seconds_total counter",
+        ]
+        lines += [f'{prefix}_api_fs_operation_seconds_total{{api="{api}",operation="{name}"}} {operation["seconds"]}'
+                  for api, api_call in metrics["api_calls"].items()
+                  for name, operation in api_call["operations"].items()]
+        lines += [
+            f"# HELP {prefix}_copied_bytes_total Size of the source files copied by copy and copy_children",
+            f"# TYPE {prefix}_copied_bytes_total counter",
+            f"{prefix}_copied_bytes_total {metrics['copied_bytes']}",
+        ]
+        return "\n".join(lines) + "\n"
+
+
+def _add(operations: Dict[str, OperationMetrics], operation: str, seconds: float):
+    operation_metrics = operations.get(operation)
+    if operation_metrics is None:
+        operation_metrics = operations[operation] = OperationMetrics()
+    operation_metrics.count += 1
+    operation_metrics.seconds += seconds
+
+
+class _Filesystem:
+    """
+    Filesystem functions used by this library.
+    While instrumentation is disabled the attributes are the plain functions (e.g. fs.stat is os.stat),
+    so calling them through this namespace costs nothing but the attribute lookup.
+    While enabled they are replaced by wrappers measuring every call.
+    """
+    stat: Callable[..., os.stat_result]
+    lstat: Callable[..., os.stat_result]
+    scandir: Callable[..., Any]
+    listdir: Callable[..., List[str]]
+    mkdir: Callable[..., None]
+    open: Callable[..., int]
+    unlink: Callable[..., None]
+    rmdir: Callable[..., None]
+    chmod: Callable[..., None]
+    fchmod: Callable[..., None]
+    chown: Callable[..., None]
+    fchown: Callable[..., None]
+    copy_file_content: Callable[[int, int], None]
+    compress_file_content: Callable[..., None]
+    decompress_file_content: Callable[..., None]
+
+    def __init__(self):
+        # attribute -> (operation, plain function)
+        self._functions: Dict[str, Any] = dict()
+
+    def register(self, operation: str, attribute: str, function: Callable[..., Any]):
+        self._functions[attribute] = (operation, function)
+        setattr(self, attribute, function if _active_metrics is None else _measured(operation, function))
+
+    def _install(self, measured: bool):
+        for attribute, (operation, function) in self._functions.items():
+            setattr(self, attribute, _measured(operation, function) if measured else function)
+
+
+def _measured(operation: str, function: Callable[..., Any]) -> Callable[..., Any]:
+    @functools.wraps(function)
+    def measured(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            metrics = _active_metrics
+            if metrics is not None:
+                metrics.record_operation(operation, time.perf_counter() - start)
+    return measured
+
+
+_active_metrics: Optional[FilesystemMetrics] = None
+_activation_lock = threading.Lock()
+_current_api_call = threading.local()
+
+fs = _Filesystem()
+fs.register("stat", "stat", os.stat)
+fs.register("stat", "lstat", os.lstat)
+fs.register("list", "scandir", os.scandir)
+fs.register("list", "listdir", os.listdir)
+fs.register("mkdir", "mkdir", os.mkdir)
+fs.register("open", "open", os.open)
+fs.register("unlink", "unlink", os.unlink)
+fs.register("rmdir", "rmdir", os.rmdir)
+fs.register("chmod", "chmod", os.chmod)
+if hasattr(os, "fchmod"):  # not available on windows
+    fs.register("chmod", "fchmod", os.fchmod)
+if hasattr(os, "chown"):
+    fs.register("chown", "chown", os.chown)
+    fs.register("chown", "fchown", os.fchown)
+
+
+@contextmanager
+def instrumentation(metrics: Optional[FilesystemMetrics] = None) -> Iterator[FilesystemMetrics]:
+    """
+    Enables instrumentation for all threads while active. Nested usages without explicit metrics reuse the outer ones.
+    Usage:
+        with instrumentation() as metrics:
+            copy_children(source, target)
+        print(metrics.to_prometheus())
+    """
+    global _active_metrics
+    with _activation_lock:
+        previous = _active_metrics
+        active = metrics if metrics is not None else (previous if previous is not None else FilesystemMetrics())
+        _active_metrics = active
+        fs._install(measured=True)
+    try:
+        yield active
+    finally:
+        with _activation_lock:
+            _active_metrics = previous
+            fs._install(measured=previous is not None)
+
+
+def active_metrics() -> Optional[FilesystemMetrics]:
+    return _active_metrics
+
+
+def api_call(function: _FunctionType) -> _FunctionType:
+    """Decorator for top-level API functions, nested API calls are attributed to the outermost one"""
+    name = function.__name__
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        metrics = _active_metrics
+        if metrics is None or getattr(_current_api_call, "name", None) is not None:
+            return function(*args, **kwargs)
+        _current_api_call.name = name
+        metrics._start_api_call(name)
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            metrics._finish_api_call(name, time.perf_counter() - start)
+            _current_api_call.name = None
+    return cast(_FunctionType, wrapper)
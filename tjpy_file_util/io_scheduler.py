@@ -0,0 +1,157 @@
+import collections
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from enum import unique, Enum
+from typing import Any, Callable, Deque, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from tjpy_file_util.stat_cache import with_active_stat_cache
+
+_logger = logging.getLogger(__name__)
+
+
+@unique
+class DeviceKind(Enum):
+    ssd = 1
+    hdd = 2
+    network = 3
+    memory = 4
+    unknown = 5
+
+
+DEFAULT_CONCURRENCY: Dict[DeviceKind, int] = {
+    DeviceKind.ssd: 16,
+    DeviceKind.hdd: 2,
+    DeviceKind.network: 16,
+    DeviceKind.memory: 16,
+    DeviceKind.unknown: 4,
+}
+
+_NETWORK_FILESYSTEMS = {"nfs", "nfs4", "cifs", "smb3", "smbfs", "ceph", "fuse.sshfs", "9p", "glusterfs", "lustre"}
+_MEMORY_FILESYSTEMS = {"tmpfs", "ramfs"}
+
+
+class IoTask(NamedTuple):
+    # devices (st_dev) touched by the task, e.g. (source device, target device) for a copy
+    devices: Tuple[int, ...]
+    # tasks of the same devices are executed in ascending inode order to reduce seeks
+    inode: int
+    function: Callable[[], Any]
+
+
+class IoScheduler:
+    """
+    Executes I/O tasks with a concurrency limit per device instead of a single limit for everything,
+    so e.g. a copy between multiple disks keeps every disk busy without oversubscribing a spinning one.
+    Tasks are grouped by their devices, every group is worked off in inode order by as many lanes as the
+    lowest limit of its devices allows. Limits are additionally enforced per device across groups.
+    The limit of a device is taken from device_limits or derived from its detected kind (see detect_device_kind).
+    """
+
+    def __init__(self,
+                 max_workers: int = 16,
+                 *,
+                 concurrency: Optional[Dict[DeviceKind, int]] = None,
+                 device_limits: Optional[Dict[int, int]] = None):
+        self.max_workers = max_workers
+        self.concurrency = dict(DEFAULT_CONCURRENCY)
+        if concurrency is not None:
+            self.concurrency.update(concurrency)
+        self._device_limits: Dict[int, int] = dict(device_limits) if device_limits is not None else dict()
+        self._lock = threading.Lock()
+
+    def device_limit(self, device: int) -> int:
+        with self._lock:
+            limit = self._device_limits.get(device)
+        if limit is None:
+            kind = detect_device_kind(device)
+            limit = max(1, min(self.concurrency[kind], self.max_workers))
+            _logger.debug("using concurrency %d for device %d:%d (%s)",
+                          limit, os.major(device), os.minor(device), kind.name)
+            with self._lock:
+                limit = self._device_limits.setdefault(device, limit)
+        return limit
+
+    def run(self, tasks: Iterable[IoTask]) -> List[Any]:
+        """
+        Executes all tasks and waits for them.
+        After a task raised an exception, no further tasks are started.
+        :return: results in the order of the tasks
+        :raises: the first exception raised by a task (after the tasks running at that time finished)
+        """
+        task_list = list(tasks)
+        results: List[Any] = [None] * len(task_list)
+        if not task_list:
+            return results
+        groups: Dict[Tuple[int, ...], List[int]] = dict()
+        for index, task in enumerate(task_list):
+            groups.setdefault(tuple(sorted(set(task.devices))), []).append(index)
+        semaphores = {device: threading.BoundedSemaphore(self.device_limit(device))
+                      for devices in groups for device in devices}
+        errors: List[BaseException] = []
+
+        def lane(queue: Deque[int], devices: Tuple[int, ...]):
+            while not errors:
+                try:
+                    index = queue.popleft()
+                except IndexError:
+                    return
+                for device in devices:  # always acquired in sorted order, so lanes can not deadlock
+                    semaphores[device].acquire()
+                try:
+                    if not errors:  # another lane may have failed while this one was waiting for the devices
+                        results[index] = task_list[index].function()
+                except BaseException as ex:
+                    errors.append(ex)
+                finally:
+                    for device in devices:
+                        semaphores[device].release()
+
+        # the tasks share the stat cache of the calling thread
+        lane = with_active_stat_cache(lane)
+        with ThreadPoolExecutor(max_workers=max(1, self.max_workers)) as executor:
+            for devices, indices in groups.items():
+                queue = collections.deque(sorted(indices, key=lambda index: task_list[index].inode))
+                lanes = min([self.device_limit(device) for device in devices] + [len(indices)])
+                for _ in range(lanes):
+                    executor.submit(lane, queue, devices)
+        if errors:
+            raise errors[0]
+        return results
+
+
+def detect_device_kind(device: int) -> DeviceKind:
+    """Detects the kind of a device (st_dev) via /proc/self/mountinfo and /sys/dev/block (linux only)"""
+    major, minor = os.major(device), os.minor(device)
+    filesystem_type = _mounted_filesystem_types().get((major, minor))
+    if filesystem_type is not None:
+        if filesystem_type in _NETWORK_FILESYSTEMS:
+            return DeviceKind.network
+        if filesystem_type in _MEMORY_FILESYSTEMS:
+            return DeviceKind.memory
+    block_device = f"/sys/dev/block/{major}:{minor}"
+    # partitions have no queue of their own, it belongs to the parent device
+    for rotational_file in (os.path.join(block_device, "queue", "rotational"),
+                            os.path.join(block_device, "..", "queue", "rotational")):
+        try:
+            with open(rotational_file) as file:
+                return DeviceKind.hdd if file.read().strip() == "1" else DeviceKind.ssd
+        except OSError:
+            continue
+    return DeviceKind.unknown
+
+
+def _mounted_filesystem_types() -> Dict[Tuple[int, int], str]:
+    filesystem_types: Dict[Tuple[int, int], str] = dict()
+    try:
+        with open("/proc/self/mountinfo") as file:
+            lines = file.readlines()
+    except OSError:
+        return filesystem_types
+    for line in lines:
+        # e.g. "36 35 98:0 /mnt1 /mnt2 rw,noatime master:1 - ext3 /dev/root rw,errors=continue"
+        fields, _, filesystem_fields = line.partition(" - ")
+        major_minor = fields.split()[2].split(":")
+        filesystem_types[(int(major_minor[0]), int(major_minor[1]))] = filesystem_fields.split()[0]
+    return filesystem_types
@@ -0,0 +1,228 @@
+import fnmatch
+import logging
+import os
+import re
+import stat
+from pathlib import Path
+from typing import List, NamedTuple, Optional, Sequence, Tuple, Union
+
+from tjpy_file_util.flags import apply_to_tree
+from tjpy_file_util.instrumentation import api_call, fs
+
+try:
+    import grp
+    import pwd
+except ImportError:  # not available on windows
+    grp = None  # type: ignore
+    pwd = None  # type: ignore
+
+_logger = logging.getLogger(__name__)
+
+_WHO_BITS = {
+    "u": stat.S_IRWXU | stat.S_ISUID,
+    "g": stat.S_IRWXG | stat.S_ISGID,
+    "o": stat.S_IRWXO | stat.S_ISVTX,
+}
+_PERMISSION_BITS = {
+    "r": stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH,
+    "w": stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH,
+    "x": stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH,
+    "s": stat.S_ISUID | stat.S_ISGID,
+    "t": stat.S_ISVTX,
+}
+# chmod follows symlinks on some platforms (e.g. Linux), the entry is then checked right before changing its mode
+_CHMOD_NOFOLLOW_SUPPORTED = os.chmod in os.supports_follow_symlinks
+_ALL_EXECUTE_BITS = stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH
+_CLAUSE = re.compile(r"([ugoa]*)((?:[-+=][rwxXst]*)+)")
+_OPERATION = re.compile(r"([-+=])([rwxXst]*)")
+
+
+class ModeSpec:
+    """
+    chmod style mode specification, either symbolic (e.g. "u+x,g-w,o=r", "a+X") or octal (e.g. "755").
+    Like chmod, "X" sets execute permissions only for directories and files which are already executable by anyone.
+    In contrast to chmod an empty "who" always means "a" (the umask is not taken into account).
+    """
+
+    def __init__(self, spec: str):
+        self.spec = spec
+        self._absolute: Optional[int] = None
+        self._operations: List[Tuple[int, str, str]] = []  # (who mask, operator, permissions)
+        if re.fullmatch(r"[0-7]{1,4}", spec):
+            self._absolute = int(spec, 8)
+            return
+        for clause in spec.split(","):
+            match = _CLAUSE.fullmatch(clause)
+            if match is None:
+                raise ValueError(f"invalid mode spec '{spec}' (clause '{clause}')")
+            who = match.group(1).replace("a", "ugo") or "ugo"
+            who_mask = 0
+            for character in who:
+                who_mask |= _WHO_BITS[character]
+            for operator, permissions in _OPERATION.findall(match.group(2)):
+                self._operations.append((who_mask, operator, permissions))
+
+    def apply(self, mode: int, is_directory: bool) -> int:
+        """Returns the mode (including the file type bits of the passed mode) after applying this spec"""
+        file_type = stat.S_IFMT(mode)
+        if self._absolute is not None:
+            return file_type | self._absolute
+        permissions = stat.S_IMODE(mode)
+        for who_mask, operator, permission_characters in self._operations:
+            bits = 0
+            for character in permission_characters:
+                if character == "X":
+                    if is_directory or permissions & _ALL_EXECUTE_BITS:
+                        bits |= _PERMISSION_BITS["x"]
+                else:
+                    bits |= _PERMISSION_BITS[character]
+            bits &= who_mask
+            if operator == "+":
+                permissions |= bits
+            elif operator == "-":
+                permissions &= ~bits
+            else:
+                permissions = (permissions & ~who_mask) | bits
+        return file_type | permissions
+
+    def __repr__(self):
+        return f"ModeSpec('{self.spec}')"
+
+
+class PermissionRule:
+    """
+    Mode and/or ownership for all paths matching an fnmatch pattern (relative posix paths, "*" matches everything).
+    """
+
+    def __init__(self,
+                 pattern: str = "*",
+                 *,
+                 mode: Union[str, ModeSpec, None] = None,
+                 owner: Union[str, int, None] = None,
+                 group: Union[str, int, None] = None,
+                 directories: bool = True,
+                 files: bool = True):
+        self.pattern = pattern
+        self.mode = ModeSpec(mode) if isinstance(mode, str) else mode
+        self.uid = _resolve_user(owner)
+        self.gid = _resolve_group(group)
+        self.directories = directories
+        self.files = files
+
+    def matches(self, relative_path: str, is_directory: bool) -> bool:
+        if not (self.directories if is_directory else self.files):
+            return False
+        return self.pattern == "*" or fnmatch.fnmatchcase(relative_path, self.pattern)
+
+
+class Permissions(NamedTuple):
+    mode: int
+    uid: int
+    gid: int
+
+
+class PermissionRules:
+    """Ordered rules, all matching rules are applied in order (so later rules override earlier ones)"""
+
+    def __init__(self, rules: Sequence[PermissionRule]):
+        self.rules = list(rules)
+
+    def desired(self, relative_path: str, current: Permissions, is_directory: bool) -> Permissions:
+        mode, uid, gid = current
+        for rule in self.rules:
+            if rule.matches(relative_path, is_directory):
+                if rule.mode is not None:
+                    mode = rule.mode.apply(mode, is_directory)
+                if rule.uid is not None:
+                    uid = rule.uid
+                if rule.gid is not None:
+                    gid = rule.gid
+        return Permissions(mode, uid, gid)
+
+    def apply_to_fd(self, fd: int, relative_path: str) -> int:
+        """
+        Applies the rules to an open file or directory (e.g. a freshly written copy) using fchown and fchmod.
+        :return: amount of system calls needed
+        """
+        stat_result = os.fstat(fd)
+        current = Permissions(stat_result.st_mode, stat_result.st_uid, stat_result.st_gid)
+        desired = self.desired(relative_path, current, stat.S_ISDIR(stat_result.st_mode))
+        calls = 0
+        if (desired.uid, desired.gid) != (current.uid, current.gid):
+            fs.fchown(fd, desired.uid, desired.gid)
+            calls += 1
+        if _mode_change_needed(desired.mode, current.mode, owner_changed=calls > 0):
+            fs.fchmod(fd, stat.S_IMODE(desired.mode))
+            calls += 1
+        return calls
+
+
+@api_call
+def apply_permissions(directory: Path,
+                      rules: Union[PermissionRules, Sequence[PermissionRule]],
+                      *,
+                      max_workers: int = 1) -> int:
+    """
+    Applies the permission rules to all files and directories in the tree in a single pass.
+    The current permissions are taken from the stat of the walk, so chown and chmod are only called where
+    the permissions actually change. Symlinks are skipped.
+    :param directory: root of the tree (its own permissions are not changed)
+    :param rules: rules applied in order to the relative posix path of every entry
+    :param max_workers: amount of threads, subdirectories are processed in parallel if bigger than 1
+    :return: amount of chown and chmod calls made
+    """
+    permission_rules = rules if isinstance(rules, PermissionRules) else PermissionRules(rules)
+
+    def apply_entry(directory_fd: Optional[int], directory_path: str, name: str, relative_path: str,
+                    stat_result: os.stat_result) -> int:
+        current = Permissions(stat_result.st_mode, stat_result.st_uid, stat_result.st_gid)
+        desired = permission_rules.desired(relative_path, current, stat.S_ISDIR(stat_result.st_mode))
+        path = name if directory_fd is not None else os.path.join(directory_path, name)
+        dir_fd_argument = {"dir_fd": directory_fd} if directory_fd is not None else {}
+        calls = 0
+        if (desired.uid, desired.gid) != (current.uid, current.gid):
+            _logger.debug("Changing ownership of %s to %d:%d", relative_path, desired.uid, desired.gid)
+            fs.chown(path, desired.uid, desired.gid, follow_symlinks=False, **dir_fd_argument)
+            calls += 1
+        if _mode_change_needed(desired.mode, current.mode, owner_changed=calls > 0):
+            if _CHMOD_NOFOLLOW_SUPPORTED:
+                _logger.debug("Changing mode of %s to %o", relative_path, stat.S_IMODE(desired.mode))
+                fs.chmod(path, stat.S_IMODE(desired.mode), follow_symlinks=False, **dir_fd_argument)
+            elif _is_same_file(fs.lstat(path, **dir_fd_argument), stat_result):
+                _logger.debug("Changing mode of %s to %o", relative_path, stat.S_IMODE(desired.mode))
+                fs.chmod(path, stat.S_IMODE(desired.mode), **dir_fd_argument)
+            else:
+                _logger.debug("Skipping mode change of %s, it was replaced during the walk", relative_path)
+                return calls
+            calls += 1
+        return calls
+
+    return apply_to_tree(directory, apply_entry, max_workers=max_workers)
+
+
+def _is_same_file(stat_result: os.stat_result, expected: os.stat_result) -> bool:
+    return not stat.S_ISLNK(stat_result.st_mode) \
+        and (stat_result.st_dev, stat_result.st_ino) == (expected.st_dev, expected.st_ino)
+
+
+def _mode_change_needed(desired_mode: int, current_mode: int, owner_changed: bool) -> bool:
+    if stat.S_IMODE(desired_mode) != stat.S_IMODE(current_mode):
+        return True
+    # chown clears the setuid and setgid bits
+    return owner_changed and bool(desired_mode & (stat.S_ISUID | stat.S_ISGID))
+
+
+def _resolve_user(owner: Union[str, int, None]) -> Optional[int]:
+    if owner is None or isinstance(owner, int):
+        return owner
+    if pwd is None:
+        raise ValueError("user names can not be resolved on this platform")
+    return pwd.getpwnam(owner).pw_uid
+
+
+def _resolve_group(group: Union[str, int, None]) -> Optional[int]:
+    if group is None or isinstance(group, int):
+        return group
+    if grp is None:
+        raise ValueError("group names can not be resolved on this platform")
+    return grp.getgrnam(group).gr_gid
@@ -0,0 +1,110 @@
+import os
+import stat
+import threading
+from pathlib import Path
+from typing import Callable, List, NamedTuple, Optional
+
+from tjpy_file_util.instrumentation import api_call, fs
+from tjpy_file_util.stat_cache import invalidate
+from tjpy_file_util.tree_walk import WalkedDirectory, walk_directories
+
+_DIR_FD_SUPPORTED = os.unlink in os.supports_dir_fd and os.rmdir in os.supports_dir_fd
+
+
+class RemovalProgress(NamedTuple):
+    files_removed: int
+    directories_removed: int
+
+
+ProgressCallback = Callable[[RemovalProgress], None]
+
+
+@api_call
+def remove_tree(path: Path,
+                *,
+                max_workers: int = 1,
+                keep_root: bool = False,
+                on_progress: Optional[ProgressCallback] = None) -> RemovalProgress:
+    """
+    Removes a file or a directory with all of its content. Symlinks are removed, never followed.
+    Directories are listed with scandir, opened relative to the descriptor of their parent and their entries are
+    unlinked relative to their own descriptor, so swapping a directory for a symlink during the removal can not
+    redirect it (see walk_directories).
+    With multiple workers, directories are emptied in parallel and every directory is removed as soon as its
+    subdirectories are removed.
+    :param path: file or directory to remove
+    :param max_workers: amount of threads used for removing
+    :param keep_root: only remove the content of the directory
+    :param on_progress: called with the accumulated counts after each emptied or removed directory
+    :return: amount of removed files and directories
+    """
+    try:
+        return _remove_tree(path, max_workers, keep_root, on_progress)
+    finally:
+        invalidate(path, recursive=True)
+
+
+def _remove_tree(path: Path,
+                 max_workers: int,
+                 keep_root: bool,
+                 on_progress: Optional[ProgressCallback]) -> RemovalProgress:
+    path_str = str(path)
+    path_stat = fs.lstat(path_str)
+    if not stat.S_ISDIR(path_stat.st_mode):
+        if keep_root:
+            raise NotADirectoryError(f"The path {path_str} is no directory")
+        fs.unlink(path_str)
+        return RemovalProgress(1, 0)
+    remover = _TreeRemover(keep_root, on_progress)
+    walk_directories(path_str, remover.unlink_files, remover.remove_directory, max_workers=max_workers,
+                     follow_root_symlink=False)
+    return remover.progress()
+
+
+class _TreeRemover:
+
+    def __init__(self, keep_root: bool, on_progress: Optional[ProgressCallback]):
+        self._keep_root = keep_root
+        self._on_progress = on_progress
+        self._lock = threading.Lock()
+        self._files_removed = 0
+        self._directories_removed = 0
+
+    def progress(self) -> RemovalProgress:
+        return RemovalProgress(self._files_removed, self._directories_removed)
+
+    def unlink_files(self, directory: WalkedDirectory) -> List[str]:
+        """Removes all non-directories of the directory and returns the names of its subdirectories"""
+        subdirectories = []
+        files_removed = 0
+        with fs.scandir(directory.fd if directory.fd is not None else directory.path) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirectories.append(entry.name)
+                elif directory.fd is not None and _DIR_FD_SUPPORTED:
+                    fs.unlink(entry.name, dir_fd=directory.fd)
+                    files_removed += 1
+                else:
+                    fs.unlink(os.path.join(directory.path, entry.name))
+                    files_removed += 1
+        self._report(files_removed, 0)
+        return subdirectories
+
+    def remove_directory(self, directory: WalkedDirectory):
+        if directory.parent is None:
+            if self._keep_root:
+                return
+            fs.rmdir(directory.path)
+        elif directory.parent.fd is not None and _DIR_FD_SUPPORTED:
+            fs.rmdir(directory.name, dir_fd=directory.parent.fd)
+        else:
+            fs.rmdir(directory.path)
+        self._report(0, 1)
+
+    def _report(self, files_removed: int, directories_removed: int):
+        with self._lock:
+            self._files_removed += files_removed
+            self._directories_removed += directories_removed
+            progress = self.progress()
+        if self._on_progress is not None:
+            self._on_progress(progress)
@@ -0,0 +1,132 @@
+import functools
+import logging
+import os
+import stat
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple, TypeVar, Union, cast
+
+from tjpy_file_util.instrumentation import fs
+
+_logger = logging.getLogger(__name__)
+
+PathLike = Union[str, Path]
+_FunctionType = TypeVar("_FunctionType", bound=Callable[..., Any])
+
+_MISSING_ERRORS = (FileNotFoundError, NotADirectoryError)
+
+
+class StatCache:
+    """
+    Caches stat results (including missing paths) per path, so a path is only stat'ed once per operation.
+    The cache does not notice changes made by others, so it should only be active for the duration of an operation
+    (see stat_cache). Functions of this library invalidate the paths they modify themselves.
+    It is thread-safe, so the worker threads of an operation share the cache of the thread which started it.
+    """
+
+    def __init__(self):
+        self._results: Dict[Tuple[str, bool], Optional[os.stat_result]] = dict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def stat(self, path: PathLike, *, follow_symlinks: bool = True) -> Optional[os.stat_result]:
+        """:return: stat result or None if the path does not exist"""
+        key = (str(path), follow_symlinks)
+        with self._lock:
+            if key in self._results:
+                self.hits += 1
+                return self._results[key]
+        result = _uncached_stat(key[0], follow_symlinks)
+        with self._lock:
+            self.misses += 1
+            self._results[key] = result
+        return result
+
+    def invalidate(self, path: PathLike, *, recursive: bool = False):
+        """Forgets the path (and with recursive all paths below it)"""
+        path_str = str(path)
+        with self._lock:
+            self._results.pop((path_str, True), None)
+            self._results.pop((path_str, False), None)
+            if recursive:
+                prefix = path_str.rstrip(os.sep) + os.sep
+                for key in [key for key in self._results if key[0].startswith(prefix)]:
+                    del self._results[key]
+
+    def clear(self):
+        with self._lock:
+            self._results.clear()
+
+
+_active = threading.local()
+
+
+@contextmanager
+def stat_cache(cache: Optional[StatCache] = None) -> Iterator[StatCache]:
+    """
+    Activates a stat cache for the current thread, which is consulted by all functions of this library,
+    including the worker threads they start (e.g. of parallel copies). Other threads are not affected.
+    Nested usages without an explicit cache reuse the outer cache.
+    """
+    previous: Optional[StatCache] = getattr(_active, "cache", None)
+    active = cache if cache is not None else (previous if previous is not None else StatCache())
+    _active.cache = active
+    try:
+        yield active
+    finally:
+        _active.cache = previous
+
+
+def active_stat_cache() -> Optional[StatCache]:
+    return getattr(_active, "cache", None)
+
+
+def with_active_stat_cache(function: _FunctionType) -> _FunctionType:
+    """Binds the stat cache active in the calling thread (if any) to a function which runs in a worker thread"""
+    cache: Optional[StatCache] = getattr(_active, "cache", None)
+    if cache is None:
+        return function
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        with stat_cache(cache):
+            return function(*args, **kwargs)
+    return cast(_FunctionType, wrapper)
+
+
+def cached_stat(path: PathLike, *, follow_symlinks: bool = True) -> Optional[os.stat_result]:
+    """stat via the active stat cache (if any), None if the path does not exist"""
+    cache: Optional[StatCache] = getattr(_active, "cache", None)
+    if cache is None:
+        return _uncached_stat(str(path), follow_symlinks)
+    return cache.stat(path, follow_symlinks=follow_symlinks)
+
+
+def invalidate(path: PathLike, *, recursive: bool = False):
+    """Tells the active stat cache (if any) that the path was modified"""
+    cache: Optional[StatCache] = getattr(_active, "cache", None)
+    if cache is not None:
+        cache.invalidate(path, recursive=recursive)
+
+
+def path_exists(path: PathLike) -> bool:
+    return cached_stat(path) is not None
+
+
+def path_is_file(path: PathLike) -> bool:
+    stat_result = cached_stat(path)
+    return stat_result is not None and stat.S_ISREG(stat_result.st_mode)
+
+
+def path_is_dir(path: PathLike) -> bool:
+    stat_result = cached_stat(path)
+    return stat_result is not None and stat.S_ISDIR(stat_result.st_mode)
+
+
+def _uncached_stat(path: str, follow_symlinks: bool) -> Optional[os.stat_result]:
+    try:
+        return fs.stat(path, follow_symlinks=follow_symlinks)
+    except _MISSING_ERRORS:
+        return None
@@ -1,80 +1,565 @@
+import atexit
+import itertools
 import logging
+import os
+import queue
 import shutil
+import stat
 import tempfile
+import threading
+import time
 from contextlib import contextmanager
-from pathlib import Path
-from typing import Optional, ContextManager
+from enum import unique, Enum
+from pathlib import Path, PurePosixPath
+from typing import Optional, ContextManager, List, NamedTuple, BinaryIO, Tuple, Dict, Union, Set, Callable
+
+from tjpy_file_util.code_file_trees import scan_file_tree
+from tjpy_file_util.copy import reflink_file, copy_file_content
+from tjpy_file_util.instrumentation import fs
+from tjpy_file_util.remove import remove_tree
+from tjpy_file_util.stat_cache import invalidate, path_is_dir, path_is_file, path_exists
 
 _logger = logging.getLogger(__name__)
 
 
+@unique
+class TempCopyStrategy(Enum):
+    # full copy of every file
+    copy = 1
+    # copy-on-write clones, falls back to a full copy of each file which can not be cloned
+    reflink = 2
+    # hardlinks to the original files, falls back to a full copy of each file which can not be linked.
+    # Files must only be modified after calling break_hardlink for them, otherwise the original is modified as well.
+    hardlink = 3
+
+
+class TempPlacementPolicy:
+    """
+    Decides in which directory temporary files and directories are created.
+    Items with a size hint fitting into the memory budget are placed into the memory backed directory (tmpfs),
+    all others (including items without size hint) into the disk backed directory.
+    The size hints of items handed out are accounted per directory until the context which created them is left,
+    also for items which are not cleaned up (cleanup=False), as the policy can not know when those are removed.
+    """
+
+    def __init__(self,
+                 *,
+                 memory_directory: Path = Path("/dev/shm"),
+                 disk_directory: Optional[Path] = None,
+                 memory_budget_fraction: float = 0.25,
+                 max_memory_item_size: Optional[int] = None):
+        """
+        :param memory_directory: memory backed directory, not used if it does not exist
+        :param disk_directory: defaults to the system temp directory
+        :param memory_budget_fraction: fraction of the free memory (and free space of the memory directory)
+            which may be used by items handed out by this policy
+        :param max_memory_item_size: items bigger than this are never placed into the memory directory
+        """
+        self.memory_directory: Optional[Path] = memory_directory if memory_directory.is_dir() else None
+        self.disk_directory = disk_directory if disk_directory is not None else Path(tempfile.gettempdir())
+        self.memory_budget_fraction = memory_budget_fraction
+        self.max_memory_item_size = max_memory_item_size
+        self._reserved_bytes: Dict[Path, int] = dict()
+        self._lock = threading.Lock()
+
+    def reserved_bytes(self) -> Dict[Path, int]:
+        """bytes (according to the size hints) handed out per directory and not yet released"""
+        with self._lock:
+            return dict(self._reserved_bytes)
+
+    def reserve(self, size_hint: Optional[int]) -> Path:
+        """Chooses the directory for a new item and accounts its size hint until release is called"""
+        with self._lock:
+            directory = self._choose(size_hint)
+            self._reserved_bytes[directory] = self._reserved_bytes.get(directory, 0) + (size_hint or 0)
+            return directory
+
+    def release(self, directory: Path, size_hint: Optional[int]):
+        with self._lock:
+            self._reserved_bytes[directory] = self._reserved_bytes.get(directory, 0) - (size_hint or 0)
+
+    def _choose(self, size_hint: Optional[int]) -> Path:
+        if self.memory_directory is None or size_hint is None:
+            return self.disk_directory
+        if self.max_memory_item_size is not None and size_hint > self.max_memory_item_size:
+            return self.disk_directory
+        if size_hint + self._reserved_bytes.get(self.memory_directory, 0) > self._memory_budget():
+            return self.disk_directory
+        return self.memory_directory
+
+    def _memory_budget(self) -> int:
+        assert self.memory_directory is not None
+        file_system = os.statvfs(str(self.memory_directory))
+        available = file_system.f_bavail * file_system.f_frsize
+        try:
+            available = min(available, os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE"))
+        except (ValueError, OSError, AttributeError):  # not available on all platforms
+            pass
+        return int(available * self.memory_budget_fraction)
+
+
+class TempSpaceQuotaExceeded(Exception):
+    pass
+
+
+class TempPathInfo:
+    """A temporary file or directory created by this module which still exists (as far as the registry knows)"""
+
+    def __init__(self, path: Path, is_directory: bool, owner: str, size_hint: Optional[int] = None):
+        self.path = path
+        self.is_directory = is_directory
+        self.owner = owner
+        self.size_hint = size_hint
+        self.created_at = time.time()
+        # whether the creating context was left without cleaning up the path (cleanup=False)
+        self.released = False
+        self._size: Optional[int] = None
+        self._size_computed_at = 0.0
+
+    def size(self, max_age: float = 0.0) -> int:
+        """Allocated size in bytes (like du), recomputed only if the last value is older than max_age"""
+        if self._size is None or time.monotonic() - self._size_computed_at > max_age:
+            try:
+                self._size = _allocated_size(self.path)
+            except FileNotFoundError:
+                self._size = 0
+            self._size_computed_at = time.monotonic()
+        return self._size
+
+    def quota_size(self, max_age: float = 0.0) -> int:
+        """Size counted against the quota, the size hint is counted until the actual size exceeds it"""
+        return max(self.size(max_age), self.size_hint or 0)
+
+    def __repr__(self):
+        return f"TempPathInfo(path={self.path}, owner={self.owner}, released={self.released})"
+
+
+def _allocated_size(path: Path) -> int:
+    stat_result = fs.lstat(str(path))
+    if not stat.S_ISDIR(stat_result.st_mode):
+        return getattr(stat_result, "st_blocks", 0) * 512
+    invalidate(path)
+    return scan_file_tree(path).statistics[PurePosixPath(".")].allocated_size
+
+
+class TempSpaceRegistry:
+    """
+    Tracks all temporary files and directories created by this module, so forgotten ones (cleanup=False)
+    can be found, measured and limited.
+    Registering a path is only a dict insertion; sizes are computed lazily when they are queried
+    or when a quota is configured and a new path is created.
+    """
+
+    def __init__(self):
+        self._entries: Dict[Path, TempPathInfo] = dict()
+        self._lock = threading.Lock()
+        # serializes quota checks with the registration of the checked path
+        self._quota_lock = threading.Lock()
+        self.quota: Optional[int] = None
+        self.evict_released = False
+        self.size_max_age = 10.0
+
+    def set_quota(self, max_bytes: Optional[int], *, evict_released: bool = False, size_max_age: float = 10.0):
+        """
+        Limits the total size of the tracked paths. Creating a temp path which would exceed the quota
+        (according to its size hint) raises TempSpaceQuotaExceeded.
+        Tracked paths count with their size hint until they grow beyond it, so concurrently created paths
+        can not exceed the quota together.
+        :param max_bytes: quota in bytes, None disables the quota
+        :param evict_released: delete released (not cleaned up) paths, oldest first, before rejecting
+        :param size_max_age: seconds for which computed sizes are reused for quota checks
+        """
+        self.quota = max_bytes
+        self.evict_released = evict_released
+        self.size_max_age = size_max_age
+
+    def entries(self) -> List[TempPathInfo]:
+        with self._lock:
+            return list(self._entries.values())
+
+    def total_size(self, max_age: float = 0.0) -> int:
+        return sum(entry.size(max_age) for entry in self.entries())
+
+    def metrics(self, *, include_sizes: bool = False) -> Dict[str, float]:
+        """Cheap summary for metrics export, sizes are only included (and computed) if requested"""
+        entries = self.entries()
+        now = time.time()
+        metrics: Dict[str, float] = {
+            "temp_paths": len(entries),
+            "temp_paths_released": sum(1 for entry in entries if entry.released),
+            "temp_paths_oldest_age_seconds": max((now - entry.created_at for entry in entries), default=0.0),
+        }
+        if include_sizes:
+            metrics["temp_paths_bytes"] = sum(entry.size(self.size_max_age) for entry in entries)
+        return metrics
+
+    def _check_quota(self, size_hint: Optional[int]):
+        """Must be called with the quota lock held"""
+        if self.quota is None:
+            return
+        required = size_hint or 0
+        used = sum(entry.quota_size(self.size_max_age) for entry in self.entries())
+        if used + required <= self.quota or not self.evict_released:
+            if used + required > self.quota:
+                raise TempSpaceQuotaExceeded(f"Creating a temp path of {required} bytes would exceed the quota "
+                                             f"of {self.quota} bytes ({used} bytes used)")
+            return
+        for entry in sorted((entry for entry in self.entries() if entry.released), key=lambda e: e.created_at):
+            _logger.debug("evicting released temp path %s to stay within the quota", entry.path)
+            used -= entry.quota_size(self.size_max_age)
+            if entry.path.exists():
+                remove_tree(entry.path)
+            self._unregister(entry.path)
+            if used + required <= self.quota:
+                return
+        raise TempSpaceQuotaExceeded(f"Creating a temp path of {required} bytes would exceed the quota "
+                                     f"of {self.quota} bytes even after evicting all released temp paths")
+
+    def _register(self, path: Path, is_directory: bool, size_hint: Optional[int] = None):
+        """
+        Registers a just created path if it fits into the quota.
+        :raises TempSpaceQuotaExceeded: the path is not registered, the caller has to remove it
+        """
+        info = TempPathInfo(path, is_directory, threading.current_thread().name, size_hint)
+        if self.quota is None:
+            with self._lock:
+                self._entries[path] = info
+            return
+        with self._quota_lock:
+            self._check_quota(size_hint)
+            with self._lock:
+                self._entries[path] = info
+
+    def _unregister(self, path: Path):
+        with self._lock:
+            self._entries.pop(path, None)
+
+    def _release(self, path: Path):
+        with self._lock:
+            info = self._entries.get(path)
+            if info is not None:
+                info.released = True
+
+
+temp_space_registry = TempSpaceRegistry()
+
+
+class OpenTempFile(NamedTuple):
+    path: Path
+    # binary file object opened for reading and writing, owned by the context manager which created it
+    file: BinaryIO
+
+
 def create_temp_file(preferred_name: str,
                      *,
-                     cleanup: bool = True) -> ContextManager[Path]:
+                     cleanup: bool = True,
+                     size_hint: Optional[int] = None,
+                     placement: Optional[TempPlacementPolicy] = None) -> ContextManager[Path]:
+    """
+    Creates a temporary file, preferably with the given name.
+    :param size_hint: expected size in bytes, used by the placement policy
+    :param placement: decides where the file is created, defaults to the system temp directory
+    """
+    @contextmanager
+    def impl():  # https://youtrack.jetbrains.com/issue/PY-36444
+        with open_temp_file(preferred_name, cleanup=cleanup, size_hint=size_hint, placement=placement) as temp_file:
+            temp_file.file.close()
+            yield temp_file.path
+
+    return impl()
+
+
+def open_temp_file(preferred_name: str,
+                   *,
+                   cleanup: bool = True,
+                   size_hint: Optional[int] = None,
+                   placement: Optional[TempPlacementPolicy] = None) -> ContextManager[OpenTempFile]:
+    """
+    Like create_temp_file but also providing the already opened file, which is closed when leaving the context.
+    """
     @contextmanager
     def impl():  # https://youtrack.jetbrains.com/issue/PY-36444
         temp_file: Optional[Path] = None
+        directory = placement.reserve(size_hint) if placement is not None else None
         try:
-            temp_file = _create_temp_file(preferred_name)
-            _logger.debug(f"created temp file {str(temp_file)}")
-            yield temp_file
+            temp_file, fd = _create_temp_file(preferred_name, directory)
+            try:
+                temp_space_registry._register(temp_file, is_directory=False, size_hint=size_hint)
+            except TempSpaceQuotaExceeded:
+                os.close(fd)
+                fs.unlink(str(temp_file))
+                invalidate(temp_file)
+                temp_file = None
+                raise
+            _logger.debug("created temp file %s", temp_file)
+            with os.fdopen(fd, "r+b") as file:
+                yield OpenTempFile(temp_file, file)
         finally:
-            if cleanup and temp_file is not None and temp_file.is_file():
-                _logger.debug(f"removing temp file {str(temp_file)}")
+            if temp_file is not None:
+                # the caller may have removed it while the stat cache was active, so the check must be live
+                invalidate(temp_file)
+            if cleanup and temp_file is not None and path_is_file(temp_file):
+                _logger.debug("removing temp file %s", temp_file)
                 temp_file.unlink()
+                invalidate(temp_file)
+            if temp_file is not None:
+                if cleanup:
+                    temp_space_registry._unregister(temp_file)
+                else:
+                    temp_space_registry._release(temp_file)
+            if placement is not None and directory is not None:
+                placement.release(directory, size_hint)
 
     return impl()
 
 
-def _create_temp_file(preferred_name: str) -> Path:
-    system_temp_dir = Path(tempfile.gettempdir())
-    temp_file = system_temp_dir.joinpath(preferred_name)
-    if temp_file.exists():
-        temporary_file_fd, temporary_file_name = tempfile.mkstemp(prefix=preferred_name)
+def _create_temp_file(preferred_name: str, directory: Optional[Path] = None) -> Tuple[Path, int]:
+    parent_directory = directory if directory is not None else Path(tempfile.gettempdir())
+    temp_file = parent_directory.joinpath(preferred_name)
+    try:
+        fd = fs.open(str(temp_file), os.O_RDWR | os.O_CREAT | os.O_EXCL | getattr(os, "O_CLOEXEC", 0), 0o666)
+    except FileExistsError:
+        fd, temporary_file_name = tempfile.mkstemp(prefix=preferred_name, dir=str(parent_directory))
         temp_file = Path(temporary_file_name)
-    else:
-        temp_file.touch(exist_ok=False)
-    return temp_file
+    invalidate(temp_file)
+    return temp_file, fd
+
+
+BACKGROUND_CLEANUP = "background"
+Cleanup = Union[bool, str]  # True, False or BACKGROUND_CLEANUP
 
 
 def create_temp_directory(preferred_name: str,
                           *,
-                          cleanup: bool = True) -> ContextManager[Path]:
+                          cleanup: Cleanup = True,
+                          size_hint: Optional[int] = None,
+                          placement: Optional[TempPlacementPolicy] = None) -> ContextManager[Path]:
+    """
+    Creates a temporary directory, preferably with the given name.
+    :param cleanup: whether to remove the directory when leaving the context.
+        With BACKGROUND_CLEANUP the directory is only renamed into a trash directory and deleted by a worker thread,
+        see flush_background_cleanup.
+    :param size_hint: expected size of the whole content in bytes, used by the placement policy
+    :param placement: decides where the directory is created, defaults to the system temp directory
+    """
+    if cleanup not in (True, False, BACKGROUND_CLEANUP):
+        raise ValueError(f"invalid cleanup mode '{cleanup}'")
+
     @contextmanager
     def impl():  # https://youtrack.jetbrains.com/issue/PY-36444
         temp_directory: Optional[Path] = None
+        parent_directory = placement.reserve(size_hint) if placement is not None else None
         try:
-            temp_directory = _create_temp_directory(preferred_name)
-            _logger.debug(f"created temp directory {str(temp_directory)}")
+            temp_directory = _create_temp_directory(preferred_name, parent_directory)
+            try:
+                temp_space_registry._register(temp_directory, is_directory=True, size_hint=size_hint)
+            except TempSpaceQuotaExceeded:
+                fs.rmdir(str(temp_directory))
+                invalidate(temp_directory)
+                temp_directory = None
+                raise
+            _logger.debug("created temp directory %s", temp_directory)
             yield temp_directory
         finally:
-            if cleanup and temp_directory is not None and temp_directory.is_dir():
-                _logger.debug(f"removing temp directory {str(temp_directory)}")
-                shutil.rmtree(temp_directory)
+            if temp_directory is not None:
+                # the caller may have removed it while the stat cache was active, so the check must be live
+                invalidate(temp_directory)
+            if cleanup and temp_directory is not None and path_is_dir(temp_directory):
+                if cleanup == BACKGROUND_CLEANUP:
+                    _background_cleaner.remove(temp_directory)
+                    invalidate(temp_directory, recursive=True)
+                else:
+                    _logger.debug("removing temp directory %s", temp_directory)
+                    remove_tree(temp_directory)
+            if temp_directory is not None:
+                if cleanup:
+                    temp_space_registry._unregister(temp_directory)
+                else:
+                    temp_space_registry._release(temp_directory)
+            if placement is not None and parent_directory is not None:
+                placement.release(parent_directory, size_hint)
 
     return impl()
 
 
-def _create_temp_directory(preferred_name: str) -> Path:
-    system_temp_dir = Path(tempfile.gettempdir())
-    temp_dir = system_temp_dir.joinpath(preferred_name)
-    if temp_dir.exists():
-        temp_dir = Path(tempfile.mkdtemp(prefix=preferred_name))
+def _create_temp_directory(preferred_name: str, directory: Optional[Path] = None) -> Path:
+    parent_directory = directory if directory is not None else Path(tempfile.gettempdir())
+    temp_dir = parent_directory.joinpath(preferred_name)
+    if path_exists(temp_dir):
+        temp_dir = Path(tempfile.mkdtemp(prefix=preferred_name, dir=str(parent_directory)))
     else:
-        temp_dir.mkdir(exist_ok=False)
+        fs.mkdir(str(temp_dir))
+    invalidate(temp_dir)
     return temp_dir
 
 
+def flush_background_cleanup(timeout: Optional[float] = None) -> bool:
+    """
+    Waits until all directories scheduled for background cleanup are deleted.
+    :return: False if the timeout elapsed before
+    """
+    return _background_cleaner.flush(timeout)
+
+
+class _BackgroundCleaner:
+    """
+    Deletes directories on a worker thread after renaming them into a trash directory next to them,
+    so the caller only has to wait for the rename.
+    The trash directory is private to the user (mode 0700, named after the uid) and removed again once it is empty.
+    If it exists but is no directory owned by the user (e.g. a symlink planted by someone else in a shared temp
+    directory), directories are removed synchronously instead.
+    Trash entries are prefixed with the process id. Entries of processes which do not run anymore
+    (e.g. crashed before their worker finished) are swept when a trash directory is used for the first time.
+    """
+
+    TRASH_DIRECTORY_NAME = ".tjpy_file_util_trash"
+
+    def __init__(self):
+        self._queue: 'queue.Queue[Path]' = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._swept_trash_directories: Set[Path] = set()
+        # trash directory -> amount of queued entries, the directory is removed when it drops to 0
+        self._pending: Dict[Path, int] = dict()
+        self._counter = itertools.count()
+
+    def trash_directory(self, parent_directory: Path) -> Path:
+        uid = os.getuid() if hasattr(os, "getuid") else None
+        return parent_directory.joinpath(self.TRASH_DIRECTORY_NAME if uid is None
+                                         else f"{self.TRASH_DIRECTORY_NAME}_{uid}")
+
+    def remove(self, directory: Path):
+        trash_directory = self.trash_directory(directory.parent)
+        trash_entry = trash_directory.joinpath(f"{os.getpid()}_{next(self._counter)}_{directory.name}")
+        with self._lock:  # the worker removes empty trash directories while holding the lock
+            try:
+                _create_private_directory(trash_directory)
+                os.rename(str(directory), str(trash_entry))
+            except OSError as ex:
+                _logger.debug("removing temp directory %s synchronously because it can not be moved to the trash: %s",
+                              directory, ex)
+                moved = False
+            else:
+                moved = True
+                self._pending[trash_directory] = self._pending.get(trash_directory, 0) + 1
+                self._ensure_worker()
+                if trash_directory not in self._swept_trash_directories:
+                    self._swept_trash_directories.add(trash_directory)
+                    self._sweep_orphans(trash_directory)
+        if not moved:
+            remove_tree(directory)
+            return
+        _logger.debug("moved temp directory %s to %s for background removal", directory, trash_entry)
+        self._queue.put(trash_entry)
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        with self._queue.all_tasks_done:
+            if timeout is None:
+                while self._queue.unfinished_tasks:
+                    self._queue.all_tasks_done.wait()
+                return True
+            return self._queue.all_tasks_done.wait_for(lambda: not self._queue.unfinished_tasks, timeout)
+
+    def _ensure_worker(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="tjpy_file_util background cleanup", daemon=True)
+            self._thread.start()
+            atexit.register(self.flush)
+
+    def _sweep_orphans(self, trash_directory: Path):
+        for entry in trash_directory.iterdir():
+            pid_part = entry.name.split("_", 1)[0]
+            if pid_part.isdigit() and int(pid_part) != os.getpid() and not _is_process_running(int(pid_part)):
+                _logger.debug("removing orphaned trash entry %s", entry)
+                self._pending[trash_directory] += 1
+                self._queue.put(entry)
+
+    def _run(self):
+        while True:
+            trash_entry = self._queue.get()
+            try:
+                remove_tree(trash_entry)
+            except OSError as ex:
+                _logger.debug("failed to remove trash entry %s: %s", trash_entry, ex)
+            finally:
+                self._entry_removed(trash_entry.parent)
+                self._queue.task_done()
+
+    def _entry_removed(self, trash_directory: Path):
+        with self._lock:
+            self._pending[trash_directory] -= 1
+            if self._pending[trash_directory] > 0:
+                return
+            del self._pending[trash_directory]
+            self._swept_trash_directories.discard(trash_directory)
+            try:
+                fs.rmdir(str(trash_directory))
+            except OSError as ex:  # e.g. entries of other running processes
+                _logger.debug("keeping trash directory %s: %s", trash_directory, ex)
+
+
+def _create_private_directory(directory: Path):
+    """Creates the directory with mode 0700 if missing, raises PermissionError if it is not owned by the user"""
+    try:
+        fs.mkdir(str(directory), 0o700)
+    except FileExistsError:
+        pass
+    status = fs.lstat(str(directory))
+    if not stat.S_ISDIR(status.st_mode) or (hasattr(os, "getuid") and status.st_uid != os.getuid()):
+        raise PermissionError(f"'{directory}' is no directory owned by the current user")
+    if stat.S_IMODE(status.st_mode) & 0o077:
+        fs.chmod(str(directory), 0o700)
+
+
+def _is_process_running(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+_background_cleaner = _BackgroundCleaner()
+
+
 def create_temp_file_for(file: Path,
                          *,
-                         adapted_preferred_name: str = None,
-                         cleanup: bool = True) -> ContextManager[Path]:
+                         adapted_preferred_name: Optional[str] = None,
+                         cleanup: bool = True,
+                         placement: Optional[TempPlacementPolicy] = None) -> ContextManager[Path]:
     @contextmanager
     def impl():  # https://youtrack.jetbrains.com/issue/PY-36444
-        assert file.is_file()
+        with open_temp_file_for(file, adapted_preferred_name=adapted_preferred_name, cleanup=cleanup,
+                                placement=placement) as temp_file:
+            temp_file.file.close()
+            yield temp_file.path
+
+    return impl()
+
+
+def open_temp_file_for(file: Path,
+                       *,
+                       adapted_preferred_name: Optional[str] = None,
+                       cleanup: bool = True,
+                       placement: Optional[TempPlacementPolicy] = None) -> ContextManager[OpenTempFile]:
+    """
+    Creates a temporary copy of the file and provides it already opened (positioned at the start).
+    The content is copied by the kernel (reflink, copy_file_range or sendfile) whenever possible,
+    so even huge files are never loaded into memory.
+    The size of the file is used as size hint for the placement policy.
+    """
+    @contextmanager
+    def impl():  # https://youtrack.jetbrains.com/issue/PY-36444
+        assert path_is_file(file)
         preferred_name = adapted_preferred_name if adapted_preferred_name is not None else file.name
-        with create_temp_file(preferred_name, cleanup=cleanup) as temp_file:
-            temp_file.write_bytes(file.read_bytes())
+        size_hint = file.stat().st_size \
+            if placement is not None or temp_space_registry.quota is not None else None
+        with open_temp_file(preferred_name, cleanup=cleanup, size_hint=size_hint, placement=placement) as temp_file, \
+                file.open("rb") as source:
+            copy_file_content(source.fileno(), temp_file.file.fileno())
+            temp_file.file.seek(0)
             yield temp_file
 
     return impl()
@@ -82,15 +567,208 @@ def create_temp_file_for(file: Path,
 
 def create_temp_directory_for(directory: Path,
                               *,
-                              adapted_preferred_name: str = None,
-                              cleanup: bool = True) -> ContextManager[Path]:
+                              adapted_preferred_name: Optional[str] = None,
+                              cleanup: Cleanup = True,
+                              strategy: TempCopyStrategy = TempCopyStrategy.copy,
+                              placement: Optional[TempPlacementPolicy] = None) -> ContextManager[Path]:
+    """
+    Creates a temporary copy of the directory.
+    The apparent size of the directory is used as size hint for the placement policy.
+    :param strategy: how files are copied, reflinks and hardlinks are much faster for big trees (see TempCopyStrategy)
+    """
     @contextmanager
     def impl():  # https://youtrack.jetbrains.com/issue/PY-36444
-        assert directory.is_dir()
+        assert path_is_dir(directory)
         preferred_name = adapted_preferred_name if adapted_preferred_name is not None else directory.name
-        with create_temp_directory(preferred_name, cleanup=cleanup) as temp_directory:
+        size_hint = scan_file_tree(directory).statistics[PurePosixPath(".")].apparent_size \
+            if placement is not None or temp_space_registry.quota is not None else None
+        with create_temp_directory(preferred_name, cleanup=cleanup, size_hint=size_hint,
+                                   placement=placement) as temp_directory:
             temp_directory.rmdir()
-            shutil.copytree(str(directory), str(temp_directory))
+            shutil.copytree(str(directory), str(temp_directory), copy_function=_COPY_FUNCTIONS[strategy])
+            invalidate(temp_directory, recursive=True)
             yield temp_directory
 
     return impl()
+
+
+def break_hardlink(file: Path):
+    """
+    Replaces the file by a private copy if it has other hardlinks, so it can be modified without modifying the others.
+    Intended for directories created by create_temp_directory_for with TempCopyStrategy.hardlink.
+    """
+    if file.stat().st_nlink <= 1:
+        return
+    private_copy = file.with_name(f".{file.name}.tjpy_file_util_break")
+    shutil.copy2(str(file), str(private_copy))
+    os.replace(str(private_copy), str(file))
+
+
+def _reflink_or_copy(source: str, target: str):
+    reflink_file(Path(source), Path(target))
+    shutil.copystat(source, target)
+
+
+def _link_or_copy(source: str, target: str):
+    try:
+        os.link(source, target)
+    except OSError:  # e.g. different file systems or hardlinks are not supported
+        shutil.copy2(source, target)
+
+
+_COPY_FUNCTIONS: Dict[TempCopyStrategy, Callable[[str, str], object]] = {
+    TempCopyStrategy.copy: shutil.copy2,
+    TempCopyStrategy.reflink: _reflink_or_copy,
+    TempCopyStrategy.hardlink: _link_or_copy,
+}
+
+
+class TempDirectoryPool:
+    """
+    Pool of pre-created temporary directories for code which creates lots of temporary directories (e.g. tests).
+    A background thread keeps `size` empty directories ready, so handing one out is a single rename.
+    Released directories are emptied and put back into the pool instead of being deleted,
+    directories exceeding `max_size` idle directories are evicted (deleted).
+    All pooled directories live below a pool directory in the system temp directory which is removed on close,
+    or, if directories are still handed out at that time, when the last of them is released.
+    """
+
+    def __init__(self, *, size: int = 4, max_size: int = 16):
+        assert 0 <= size <= max_size
+        self.size = size
+        self.max_size = max_size
+        self.directory = Path(tempfile.mkdtemp(prefix="tjpy_file_util_pool_"))
+        self._idle: List[Path] = []
+        # idle directories being created or returned, they count towards size and max_size
+        self._incoming = 0
+        self._acquired: Set[Path] = set()
+        self._counter = itertools.count()
+        self._condition = threading.Condition()
+        self._closed = False
+        self._thread = threading.Thread(target=self._refill, name="TempDirectoryPool", daemon=True)
+        self._thread.start()
+
+    def __enter__(self) -> 'TempDirectoryPool':
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def idle_count(self) -> int:
+        with self._condition:
+            return len(self._idle)
+
+    def create_temp_directory(self,
+                              preferred_name: str,
+                              *,
+                              cleanup: bool = True) -> ContextManager[Path]:
+        """
+        Same as the module level create_temp_directory but using a pooled directory,
+        which is tracked by temp_space_registry while it is handed out.
+        Directories which are not cleaned up must outlive the pool, so they are created without the pool.
+        """
+        if not cleanup:
+            return create_temp_directory(preferred_name, cleanup=False)
+
+        @contextmanager
+        def impl():  # https://youtrack.jetbrains.com/issue/PY-36444
+            temp_directory = self._acquire(preferred_name)
+            try:
+                temp_space_registry._register(temp_directory, is_directory=True)
+            except TempSpaceQuotaExceeded:
+                self._release(temp_directory)
+                raise
+            _logger.debug("acquired pooled temp directory %s", temp_directory)
+            try:
+                yield temp_directory
+            finally:
+                temp_space_registry._unregister(temp_directory)
+                self._release(temp_directory)
+
+        return impl()
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        self._thread.join()
+        with self._condition:
+            remove_pool_directory = not self._acquired
+        if remove_pool_directory:
+            self._remove_pool_directory()
+        else:
+            _logger.debug("removing pool directory %s when the handed out directories are released", self.directory)
+
+    def _acquire(self, preferred_name: str) -> Path:
+        temp_directory = self.directory.joinpath(f"{preferred_name}_{next(self._counter)}")
+        with self._condition:
+            assert not self._closed, "the pool is closed"
+            idle_directory = self._idle.pop() if self._idle else None
+            # tracked before it exists, so a concurrent close does not remove the pool directory underneath it
+            self._acquired.add(temp_directory)
+            self._condition.notify_all()
+        try:
+            if idle_directory is None:
+                idle_directory = self._create_idle_directory()
+            os.rename(str(idle_directory), str(temp_directory))
+        except BaseException:
+            self._release(temp_directory)
+            raise
+        return temp_directory
+
+    def _release(self, temp_directory: Path):
+        exists = temp_directory.is_dir()
+        with self._condition:
+            # reserved under the lock, so concurrent releases can not exceed max_size
+            recycle = exists and not self._closed and len(self._idle) + self._incoming < self.max_size
+            if recycle:
+                self._incoming += 1
+        idle_directory: Optional[Path] = None
+        try:
+            if recycle:
+                remove_tree(temp_directory, keep_root=True)
+                renamed_directory = self.directory.joinpath(f".idle_{next(self._counter)}")
+                os.rename(str(temp_directory), str(renamed_directory))
+                idle_directory = renamed_directory
+            elif exists:
+                _logger.debug("evicting pooled temp directory %s", temp_directory)
+                remove_tree(temp_directory)
+        finally:
+            with self._condition:
+                self._acquired.discard(temp_directory)
+                if recycle:
+                    self._incoming -= 1
+                    # if the pool was closed in the meantime, the directory is removed with the pool directory
+                    if idle_directory is not None and not self._closed:
+                        self._idle.append(idle_directory)
+                    self._condition.notify_all()
+                remove_pool_directory = self._closed and not self._acquired
+            if remove_pool_directory:
+                self._remove_pool_directory()
+
+    def _remove_pool_directory(self):
+        try:
+            remove_tree(self.directory)
+        except OSError as ex:
+            _logger.debug("failed to remove pool directory %s: %s", self.directory, ex)
+
+    def _create_idle_directory(self) -> Path:
+        idle_directory = self.directory.joinpath(f".idle_{next(self._counter)}")
+        idle_directory.mkdir()
+        return idle_directory
+
+    def _refill(self):
+        while True:
+            with self._condition:
+                while not self._closed and len(self._idle) + self._incoming >= self.size:
+                    self._condition.wait()
+                if self._closed:
+                    return
+                self._incoming += 1
+            try:
+                idle_directory = self._create_idle_directory()
+            finally:
+                with self._condition:
+                    self._incoming -= 1
+            with self._condition:
+                self._idle.append(idle_directory)
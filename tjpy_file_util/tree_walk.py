@@ -0,0 +1,148 @@
+import os
+import threading
+from typing import Callable, List, Optional, Set, Tuple
+
+from tjpy_file_util.instrumentation import fs
+from tjpy_file_util.stat_cache import with_active_stat_cache
+
+DIR_FD_SUPPORTED = os.open in os.supports_dir_fd and os.scandir in os.supports_fd and hasattr(os, "O_DIRECTORY")
+
+_DIRECTORY_FLAGS = os.O_RDONLY | getattr(os, "O_DIRECTORY", 0) | getattr(os, "O_CLOEXEC", 0)
+_NOFOLLOW = getattr(os, "O_NOFOLLOW", 0)
+
+
+class WalkedDirectory:
+    """
+    A directory of a tree walk. Its descriptor (None if dir_fd is not supported) is open while it is visited,
+    and the descriptor of the parent stays open until all subdirectories of the parent are finished,
+    so system calls relative to the parent (e.g. rmdir(name, dir_fd=parent.fd)) are possible in the finish function.
+    """
+
+    def __init__(self, parent: Optional['WalkedDirectory'], name: str, fd: Optional[int]):
+        self.parent = parent
+        # name in the parent directory, the path of the root
+        self.name = name
+        self.path: str = os.path.join(parent.path, name) if parent is not None else name
+        # relative posix path below the root, "" for the root
+        self.relative_path: str = (parent.relative_path + "/" + name if parent.relative_path else name) \
+            if parent is not None else ""
+        self.depth: int = parent.depth + 1 if parent is not None else 0
+        self.fd = fd
+        # own visit and unfinished subdirectories, guarded by the lock of the walk
+        self._pending = 1
+
+
+# receives an open directory and returns the names of the subdirectories to descend into
+VisitFunction = Callable[[WalkedDirectory], List[str]]
+# receives a directory after it and all of its subdirectories were visited (post order)
+FinishFunction = Callable[[WalkedDirectory], None]
+
+
+def walk_directories(root: str,
+                     visit: VisitFunction,
+                     finish: Optional[FinishFunction] = None,
+                     *,
+                     max_workers: int = 1,
+                     follow_root_symlink: bool = True):
+    """
+    Walks a directory tree, subdirectories are opened relative to the descriptor of their parent with O_NOFOLLOW,
+    so replacing a directory of the tree by a symlink during the walk can not redirect it.
+    With multiple workers, directories are visited in parallel. Pending directories are taken depth first,
+    so only the descriptors of the directories on the current paths of the workers are open at the same time.
+    The walk stops at the first exception (raised after the running visits finished), all descriptors are closed.
+    :param root: path of the root directory
+    :param visit: called once for every directory, from any worker thread
+    :param finish: called once for every directory after its whole subtree was visited, from any worker thread
+    :param max_workers: amount of threads, the walk runs in the calling thread if it is not bigger than 1
+    :param follow_root_symlink: whether the root may be a symlink to a directory
+    """
+    walk = _Walk(visit, finish)
+    walk.push(None, root, follow_root_symlink)
+    try:
+        if max_workers <= 1:
+            walk.work()
+        else:
+            work = with_active_stat_cache(walk.work)
+            workers = [threading.Thread(target=work, name=f"tjpy_file_util walk {index}", daemon=True)
+                       for index in range(max_workers)]
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+    finally:
+        walk.close()
+    if walk.errors:
+        raise walk.errors[0]
+
+
+class _Walk:
+
+    def __init__(self, visit: VisitFunction, finish: Optional[FinishFunction]):
+        self._visit = visit
+        self._finish = finish
+        self._condition = threading.Condition()
+        # (parent, name, follow symlink) of directories not visited yet, taken from the end (depth first)
+        self._stack: List[Tuple[Optional[WalkedDirectory], str, bool]] = []
+        self._running = 0
+        self._open: Set[WalkedDirectory] = set()
+        self.errors: List[BaseException] = []
+
+    def push(self, parent: Optional[WalkedDirectory], name: str, follow_symlink: bool = False):
+        self._stack.append((parent, name, follow_symlink))
+
+    def work(self):
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._stack or not self._running or self.errors)
+                if self.errors or not self._stack:
+                    self._condition.notify_all()
+                    return
+                parent, name, follow_symlink = self._stack.pop()
+                self._running += 1
+            try:
+                self._process(parent, name, follow_symlink)
+            except BaseException as ex:
+                with self._condition:
+                    self.errors.append(ex)
+            finally:
+                with self._condition:
+                    self._running -= 1
+                    self._condition.notify_all()
+
+    def close(self):
+        with self._condition:
+            for directory in self._open:
+                if directory.fd is not None:
+                    os.close(directory.fd)
+            self._open.clear()
+
+    def _process(self, parent: Optional[WalkedDirectory], name: str, follow_symlink: bool):
+        directory = WalkedDirectory(parent, name, None)
+        if DIR_FD_SUPPORTED:
+            flags = _DIRECTORY_FLAGS if follow_symlink else _DIRECTORY_FLAGS | _NOFOLLOW
+            directory.fd = fs.open(name, flags, dir_fd=parent.fd) if parent is not None \
+                else fs.open(name, flags)
+        with self._condition:
+            self._open.add(directory)
+        subdirectories = self._visit(directory)
+        with self._condition:
+            directory._pending += len(subdirectories)
+            for subdirectory in reversed(subdirectories):
+                self.push(directory, subdirectory)
+            self._condition.notify_all()
+        self._finished(directory)
+
+    def _finished(self, directory: Optional[WalkedDirectory]):
+        """Accounts a finished visit or subdirectory and finishes the directories which have nothing pending anymore"""
+        while directory is not None:
+            with self._condition:
+                directory._pending -= 1
+                if directory._pending > 0:
+                    return
+                self._open.discard(directory)
+            if directory.fd is not None:
+                os.close(directory.fd)
+                directory.fd = None
+            if self._finish is not None:
+                self._finish(directory)
+            directory = directory.parent
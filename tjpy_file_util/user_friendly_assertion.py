@@ -1,16 +1,107 @@
 import logging
+import os
+import stat
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from tjpy_file_util.instrumentation import fs
+from tjpy_file_util.stat_cache import cached_stat, with_active_stat_cache
 
 _logger = logging.getLogger(__name__)
 
 
 def assert_path_exists(path: Path):
-    if not path.exists():
+    if cached_stat(path) is None:
         raise FileNotFoundError(f"The path {str(path)} does not exist")
 
 
-def assert_path_is_file(path: Path):
-    if not path.exists():
+def assert_path_is_file(path: Path) -> os.stat_result:
+    """Asserts that the path is a file (following symlinks) using a single stat, which is returned for reuse"""
+    stat_result = cached_stat(path)
+    if stat_result is None:
         raise FileNotFoundError(f"The path {str(path)} does not exist but must be a file")
-    if not path.is_file():
+    if not stat.S_ISREG(stat_result.st_mode):
         raise FileNotFoundError(f"The path {str(path)} exists but must be a file")
+    return stat_result
+
+
+class PathAssertionError(FileNotFoundError):
+    """Raised by the batch assertions, listing every path which failed the assertion"""
+
+    def __init__(self, failures: List[Tuple[Path, str]]):
+        super().__init__(f"{len(failures)} path(s) failed the assertion:\n"
+                         + "\n".join(f"{str(path)}: {reason}" for path, reason in failures))
+        self.failures = failures
+
+
+def assert_paths_exist(paths: Iterable[Path], *, max_workers: int = 8):
+    _assert_paths(paths, None, max_workers)
+
+
+def assert_paths_are_files(paths: Iterable[Path], *, max_workers: int = 8):
+    _assert_paths(paths, stat.S_IFREG, max_workers)
+
+
+def assert_paths_are_directories(paths: Iterable[Path], *, max_workers: int = 8):
+    _assert_paths(paths, stat.S_IFDIR, max_workers)
+
+
+# if at least this many paths share a parent directory, the parent is listed once instead of stat'ing each path
+_SCANDIR_THRESHOLD = 8
+_TYPE_NAMES = {stat.S_IFREG: "file", stat.S_IFDIR: "directory"}
+
+
+def _assert_paths(paths: Iterable[Path], required_type: Optional[int], max_workers: int):
+    """
+    Checks all paths and raises a single PathAssertionError for all failures.
+    Paths are grouped by their parent directory: big groups are answered by a single scandir of the parent
+    (the file type of directory entries is usually known without a stat), small groups by stat'ing each path.
+    Symlinks, other special files and names like ".." are stat'ed in any case, so the result does not depend
+    on the size of the group. The groups are checked in parallel, using the stat cache of the calling thread.
+    """
+    path_list = list(paths)
+    groups: Dict[str, List[Path]] = dict()
+    for path in path_list:
+        groups.setdefault(os.path.dirname(str(path)), []).append(path)
+    check_group = with_active_stat_cache(lambda group: _check_group(group[0], group[1], required_type))
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        group_failures = list(executor.map(check_group, groups.items()))
+    failures_by_path = {path: reason for failures in group_failures for path, reason in failures}
+    failures = [(path, failures_by_path[path]) for path in path_list if path in failures_by_path]
+    if failures:
+        raise PathAssertionError(failures)
+
+
+def _check_group(parent: str, paths: List[Path], required_type: Optional[int]) -> List[Tuple[Path, str]]:
+    entries_by_name: Optional[Dict[str, os.DirEntry]] = None
+    if len(paths) >= _SCANDIR_THRESHOLD:
+        try:
+            with fs.scandir(parent or ".") as entries:
+                entries_by_name = {entry.name: entry for entry in entries}
+        except (FileNotFoundError, NotADirectoryError):
+            return [(path, "does not exist") for path in paths]
+        except PermissionError:  # the paths may still be stat'ed if the parent is searchable but not readable
+            pass
+    failures = []
+    for path in paths:
+        file_type = _file_type(path, entries_by_name)
+        if file_type is None:
+            failures.append((path, "does not exist"))
+        elif required_type is not None and file_type != required_type:
+            failures.append((path, f"exists but must be a {_TYPE_NAMES[required_type]}"))
+    return failures
+
+
+def _file_type(path: Path, entries_by_name: Optional[Dict[str, os.DirEntry]]) -> Optional[int]:
+    """:return: file type (S_IFMT, following symlinks) of the path, None if it does not exist"""
+    if entries_by_name is not None and path.name not in ("", ".", ".."):
+        entry = entries_by_name.get(path.name)
+        if entry is None:
+            return None
+        if entry.is_dir(follow_symlinks=False):
+            return stat.S_IFDIR
+        if entry.is_file(follow_symlinks=False):
+            return stat.S_IFREG
+    stat_result = cached_stat(path)
+    return stat.S_IFMT(stat_result.st_mode) if stat_result is not None else None